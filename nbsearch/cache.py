@@ -0,0 +1,68 @@
+from collections import OrderedDict
+import time
+
+
+class SearchCache:
+    """LRU cache of search results with a TTL and a limit in bytes.
+
+    Each entry is stored with the version of the index it was retrieved from,
+    and entries of another version are treated as missing.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        entry_version, expires, size, value = entry
+        if entry_version != version or expires < self.clock():
+            self._remove(key)
+            self.invalidations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, version, value, size):
+        if key in self.entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (version, self.clock() + self.ttl, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def _remove(self, key):
+        _, _, size, _ = self.entries.pop(key)
+        self.size -= size
@@ -1,23 +1,37 @@
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import io
 import json
 import os
 import re
+import time
 from urllib.parse import urljoin, urlencode
 
 from tornado.httpclient import AsyncHTTPClient, HTTPRequest
 from tornado.web import HTTPError
 
-from traitlets import Unicode, Int
+from jupyter_core.paths import jupyter_data_dir
+from traitlets import Unicode, Int, Bool, Float, default
 from traitlets.config.configurable import Configurable
 from traitlets.config import LoggingConfigurable
 from traitlets.config.loader import PyFileConfigLoader
 import aioboto3
+from aiobotocore.config import AioConfig
+from botocore.exceptions import ClientError
 
-from .source import get_source
+from .cache import SearchCache
+from .manifest import Manifest, file_digest
+from .source import get_source, load_notebook
+from .watcher import create_watcher, debounce
 from . import solr
 
 
-class NBSearchDB(Configurable):
+# Buckets which have been verified in this process
+_ensured_buckets = set()
+
+
+class NBSearchDB(LoggingConfigurable):
 
     solr_base_url = Unicode('http://localhost:8983', help='The base URL of Solr').tag(config=True)
 
@@ -35,36 +49,152 @@ class NBSearchDB(Configurable):
 
     s3_bucket_name = Unicode('notebooks', help='The bucket on S3').tag(config=True)
 
+    s3_max_pool_connections = Int(10, help='The maximum number of connections kept in the pool of the S3 client').tag(config=True)
+
     solr_notebook = Unicode('jupyter-notebook', help='The core for notebooks on Solr').tag(config=True)
 
     solr_cell = Unicode('jupyter-cell', help='The core for cells on Solr').tag(config=True)
 
+    solr_update_batch_documents = Int(1000, help='The maximum number of documents in a batched update').tag(config=True)
+
+    solr_update_batch_bytes = Int(10 * 1024 * 1024, help='The maximum size in bytes of a batched update').tag(config=True)
+
+    solr_update_commit_within = Int(0, help='The commitWithin in milliseconds for batched updates. If 0, batched updates are committed once when the buffer is closed').tag(config=True)
+
+    solr_delete_batch_queries = Int(100, help='The maximum number of queries combined into a delete-by-query request').tag(config=True)
+
+    search_cache_max_bytes = Int(64 * 1024 * 1024, help='The maximum size in bytes of the cached search results. If 0, search results are not cached').tag(config=True)
+
+    search_cache_ttl = Float(300, help='The time in seconds for which a cached search result is kept').tag(config=True)
+
+    search_cache_version_interval = Float(5, help='The time in seconds for which the checked version of the Solr index is reused').tag(config=True)
+
+    highlight_fragment_size = Int(100, help='The size in characters of a highlighted snippet').tag(config=True)
+
+    highlight_snippets = Int(3, help='The maximum number of highlighted snippets per field').tag(config=True)
+
+    export_batch_size = Int(1000, help='The number of documents retrieved from Solr at once when all results are exported').tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(NBSearchDB, self).__init__(**kwargs)
+        self._s3 = None
+        self._s3_context = None
+        self._s3_lock = None
+        self._bucket_lock = None
+        self.search_cache = SearchCache(
+            max_bytes=self.search_cache_max_bytes,
+            ttl=self.search_cache_ttl,
+        )
+        self._index_versions = {}
+
+    async def open(self):
+        await self._get_s3()
+
+    async def close(self):
+        if self._s3_context is None:
+            return
+        s3_context = self._s3_context
+        self._s3 = None
+        self._s3_context = None
+        await s3_context.__aexit__(None, None, None)
+
     async def post_document(self, core_internal, jsondoc):
+        await self._post_update(core_internal, json.dumps(jsondoc), {'commit': 'true'})
+
+    async def commit(self, core_internal):
+        await self._post_update(core_internal, '[]', {'commit': 'true'})
+
+    async def delete_by_query(self, core_internal, queries):
+        """Delete documents matching any of the queries, combining them into batched requests"""
+        for i in range(0, len(queries), self.solr_delete_batch_queries):
+            batch = queries[i:i + self.solr_delete_batch_queries]
+            query = ' OR '.join([f'({q})' for q in batch])
+            params = {}
+            if self.solr_update_commit_within > 0:
+                params['commitWithin'] = self.solr_update_commit_within
+            await self._post_update(core_internal, json.dumps({'delete': {'query': query}}), params)
+
+    def create_update_buffer(self, on_flush=None):
+        return SolrUpdateBuffer(
+            self,
+            max_documents=self.solr_update_batch_documents,
+            max_bytes=self.solr_update_batch_bytes,
+            commit_within=self.solr_update_commit_within,
+            on_flush=on_flush,
+        )
+
+    async def _post_update(self, core_internal, body, params):
         core = self.solr_cell if core_internal == 'jupyter-cell' else self.solr_notebook
         http_client = AsyncHTTPClient()
         response = await http_client.fetch(HTTPRequest(
-            urljoin(self.solr_base_url, f'solr/{core}/update?commit=true'),
+            urljoin(self.solr_base_url, f'solr/{core}/update?{urlencode(params)}'),
             method='POST',
-            body=json.dumps(jsondoc),
+            body=body,
             headers={'Content-Type': 'application/json'},
             **self._http_kwargs(),
         ))
+        if 'commit' in params:
+            self.invalidate_search_cache()
+
+    def invalidate_search_cache(self):
+        self.search_cache.clear()
+        self._index_versions = {}
 
-    def _build_query(self, query, q_op=None, start=None, rows=None, sort=None):
+    def _build_query(self, query, q_op=None, start=None, rows=None, sort=None, fl=None,
+                     highlight=None, highlight_fragment_size=None, highlight_snippets=None,
+                     cursor_mark=None, facets=None, fq=None):
         params = {}
         params['q.op'] = q_op or 'AND'
         params['q'] = query
-        if start is not None:
+        if fq:
+            # Filter queries are not scored and are cached by Solr independently of q
+            params['fq'] = list(fq)
+        if cursor_mark is not None:
+            # Deep paging with a cursor requires a sort which is unique for each document
+            params['cursorMark'] = cursor_mark
+            sort = _with_tiebreaker(sort)
+        elif start is not None:
             params['start'] = start
         if rows is not None:
             params['rows'] = rows
         if sort is not None:
             params['sort'] = sort
-        return urlencode(params)
+        if fl is not None:
+            params['fl'] = ','.join(fl)
+        if highlight is not None:
+            params['hl'] = 'true'
+            params['hl.method'] = 'unified'
+            params['hl.fl'] = ','.join(highlight)
+            # hl.fragsize=0 highlights the whole field value
+            params['hl.fragsize'] = highlight_fragment_size if highlight_fragment_size is not None else self.highlight_fragment_size
+            params['hl.snippets'] = highlight_snippets if highlight_snippets is not None else self.highlight_snippets
+            # Stored outputs may contain HTML
+            params['hl.encoder'] = 'html'
+        if facets is not None:
+            # JSON Facet API, e.g. {'cell_type': {'type': 'terms', 'field': 'cell_type'}}
+            params['json.facet'] = json.dumps(facets, sort_keys=True)
+        return urlencode(params, doseq=True)
 
-    async def query(self, core_internal, query, q_op=None, start=None, rows=None, sort=None):
+    async def query(self, core_internal, query, q_op=None, start=None, rows=None, sort=None, fl=None,
+                    highlight=None, highlight_fragment_size=None, highlight_snippets=None,
+                    cursor_mark=None, facets=None, fq=None, use_cache=False):
         core = self.solr_cell if core_internal == 'jupyter-cell' else self.solr_notebook
-        urlquery = self._build_query(query, q_op=q_op, start=start, rows=rows, sort=sort)
+        urlquery = self._build_query(
+            query, q_op=q_op, start=start, rows=rows, sort=sort, fl=fl,
+            highlight=highlight,
+            highlight_fragment_size=highlight_fragment_size,
+            highlight_snippets=highlight_snippets,
+            cursor_mark=cursor_mark,
+            facets=facets,
+            fq=fq,
+        )
+        version = None
+        if use_cache and self.search_cache_max_bytes > 0:
+            version = await self._get_index_version(core)
+        if version is not None:
+            cached = self.search_cache.get((core, urlquery), version)
+            if cached is not None:
+                return urlquery, cached
         http_client = AsyncHTTPClient()
         response = await http_client.fetch(HTTPRequest(
             urljoin(self.solr_base_url, f'solr/{core}/select?{urlquery}'),
@@ -73,34 +203,134 @@ class NBSearchDB(Configurable):
         ), raise_error=False)
         if response.code >= 500:
             raise HTTPError(response.code)
-        return urlquery, json.loads(response.body)
+        result = json.loads(response.body)
+        if version is not None and response.code == 200:
+            self.search_cache.put((core, urlquery), version, result, len(response.body))
+        return urlquery, result
+
+    async def iter_query(self, core_internal, query, q_op=None, sort=None, fl=None, fq=None, rows=None):
+        """Walk through all documents matching the query with cursors, yielding them page by page"""
+        cursor_mark = '*'
+        while True:
+            _, result = await self.query(
+                core_internal,
+                query,
+                q_op=q_op,
+                rows=rows or self.export_batch_size,
+                sort=sort,
+                fl=fl,
+                fq=fq,
+                cursor_mark=cursor_mark,
+            )
+            if 'error' in result:
+                raise HTTPError(400, result['error'].get('msg'))
+            docs = result['response']['docs']
+            if len(docs) > 0:
+                yield docs
+            next_cursor_mark = result.get('nextCursorMark')
+            if next_cursor_mark is None or next_cursor_mark == cursor_mark:
+                break
+            cursor_mark = next_cursor_mark
+
+    async def _get_index_version(self, core):
+        now = time.monotonic()
+        if core in self._index_versions:
+            version, expires = self._index_versions[core]
+            if now < expires:
+                return version
+        http_client = AsyncHTTPClient()
+        response = await http_client.fetch(HTTPRequest(
+            # The version of the open searcher, which changes on soft commits unlike
+            # the replication indexversion which changes only on hard commits
+            urljoin(self.solr_base_url, f'solr/{core}/admin/luke?show=index&numTerms=0&wt=json'),
+            method='GET',
+            **self._http_kwargs(),
+        ), raise_error=False)
+        if response.code != 200:
+            return None
+        index = json.loads(response.body).get('index', {})
+        version = (index.get('version'), index.get('numDocs'), index.get('maxDoc'))
+        self._index_versions[core] = (version, now + self.search_cache_version_interval)
+        return version
+
+    async def _get_s3(self):
+        if self._s3 is not None:
+            return self._s3
+        if self._s3_lock is None:
+            self._s3_lock = asyncio.Lock()
+        async with self._s3_lock:
+            if self._s3 is None:
+                session = aioboto3.Session(
+                    aws_access_key_id=self.s3_access_key,
+                    aws_secret_access_key=self.s3_secret_key,
+                    region_name=self.s3_region_name,
+                )
+                s3_context = session.client(
+                    's3',
+                    endpoint_url=self.s3_endpoint_url,
+                    config=AioConfig(max_pool_connections=self.s3_max_pool_connections),
+                )
+                self._s3 = await s3_context.__aenter__()
+                self._s3_context = s3_context
+        return self._s3
 
     async def _ensure_bucket(self, s3):
-        buckets = await s3.list_buckets()
-        bucket_names = [b['Name'] for b in buckets['Buckets']]
-        if self.s3_bucket_name in bucket_names:
+        key = (self.s3_endpoint_url, self.s3_bucket_name)
+        if key in _ensured_buckets:
             return
-        await s3.create_bucket(Bucket=self.s3_bucket_name)
+        if self._bucket_lock is None:
+            self._bucket_lock = asyncio.Lock()
+        async with self._bucket_lock:
+            if key in _ensured_buckets:
+                return
+            buckets = await s3.list_buckets()
+            bucket_names = [b['Name'] for b in buckets['Buckets']]
+            if self.s3_bucket_name not in bucket_names:
+                try:
+                    await s3.create_bucket(Bucket=self.s3_bucket_name)
+                except ClientError as e:
+                    # Created by another process in the meantime
+                    if e.response.get('Error', {}).get('Code') not in ['BucketAlreadyOwnedByYou', 'BucketAlreadyExists']:
+                        raise
+            _ensured_buckets.add(key)
 
     async def upload_file(self, notebook_id, notebook_data):
-        session = aioboto3.Session(
-            aws_access_key_id=self.s3_access_key,
-            aws_secret_access_key=self.s3_secret_key,
-            region_name=self.s3_region_name,
-        )
-        async with session.client('s3', endpoint_url=self.s3_endpoint_url) as s3:
-            await self._ensure_bucket(s3)
-            data = io.BytesIO(json.dumps(notebook_data, ensure_ascii=False).encode('utf8'))
-            await s3.upload_fileobj(data, self.s3_bucket_name, notebook_id)
+        content = json.dumps(notebook_data, ensure_ascii=False).encode('utf8')
+        await self.upload_fileobj(notebook_id, io.BytesIO(content))
+
+    async def upload_fileobj(self, notebook_id, f):
+        s3 = await self._get_s3()
+        await self._ensure_bucket(s3)
+        await s3.upload_fileobj(f, self.s3_bucket_name, notebook_id)
 
     async def download_file(self, notebook_id, f):
-        session = aioboto3.Session(
-            aws_access_key_id=self.s3_access_key,
-            aws_secret_access_key=self.s3_secret_key,
-            region_name=self.s3_region_name,
-        )
-        async with session.client('s3', endpoint_url=self.s3_endpoint_url) as s3:
-            await s3.download_fileobj(self.s3_bucket_name, notebook_id, f)
+        s3 = await self._get_s3()
+        await s3.download_fileobj(self.s3_bucket_name, notebook_id, f)
+
+    async def delete_files(self, notebook_ids):
+        s3 = await self._get_s3()
+        # DeleteObjects accepts up to 1000 keys per request
+        for i in range(0, len(notebook_ids), 1000):
+            batch = notebook_ids[i:i + 1000]
+            await s3.delete_objects(
+                Bucket=self.s3_bucket_name,
+                Delete={
+                    'Objects': [{'Key': notebook_id} for notebook_id in batch],
+                    'Quiet': True,
+                },
+            )
+
+    async def stream_file(self, notebook_id, chunk_size=1024 * 1024, progress=None):
+        s3 = await self._get_s3()
+        response = await s3.get_object(Bucket=self.s3_bucket_name, Key=notebook_id)
+        total = response.get('ContentLength')
+        received = 0
+        async with response['Body'] as body:
+            async for chunk in body.iter_chunks(chunk_size):
+                received += len(chunk)
+                if progress is not None:
+                    progress(received, total)
+                yield chunk
 
     def _http_kwargs(self):
         if self.solr_basic_auth_username or self.solr_basic_auth_password:
@@ -112,40 +342,546 @@ class NBSearchDB(Configurable):
         return {}
 
 
+def _quote(value):
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def _server_query(field, server):
+    # The documents of notebooks on a source without server have no server field
+    if len(server) == 0:
+        return f'-{field}:[* TO *]'
+    return f'{field}:{_quote(server)}'
+
+def _with_tiebreaker(sort):
+    if sort is None or len(sort.strip()) == 0:
+        return 'score desc,id asc'
+    fields = [clause.split()[0] for clause in sort.split(',') if len(clause.strip()) > 0]
+    if 'id' in fields:
+        return sort
+    return f'{sort},id asc'
+
+
+class SolrUpdateBuffer:
+    """Accumulates documents of many notebooks and posts them to Solr in bulk.
+
+    Documents are added with the key of the notebook they came from. When a
+    bulk update fails, the documents are posted again per key so that
+    `on_flush(core_internal, succeeded_keys, failed_keys)` reports the
+    notebooks which actually failed.
+    """
+
+    def __init__(self, db, max_documents=1000, max_bytes=10 * 1024 * 1024, commit_within=0, on_flush=None):
+        self.db = db
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.commit_within = commit_within
+        self.on_flush = on_flush
+        self.buffers = {}
+        self.uncommitted_cores = set()
+        self.failed_keys = set()
+
+    async def add(self, core_internal, docs, key=None):
+        if core_internal not in self.buffers:
+            self.buffers[core_internal] = {'entries': [], 'documents': 0, 'bytes': 0}
+        buffer = self.buffers[core_internal]
+        serialized = [json.dumps(doc) for doc in docs]
+        buffer['entries'].append((key, serialized))
+        buffer['documents'] += len(serialized)
+        buffer['bytes'] += sum([len(doc) + 1 for doc in serialized])
+        if buffer['documents'] >= self.max_documents or buffer['bytes'] >= self.max_bytes:
+            await self.flush(core_internal)
+
+    async def flush(self, core_internal=None):
+        cores = list(self.buffers.keys()) if core_internal is None else [core_internal]
+        for core in cores:
+            if core not in self.buffers:
+                continue
+            # Detach the entries before posting so that concurrent adds go to a new buffer
+            entries = self.buffers.pop(core)['entries']
+            if len(entries) == 0:
+                continue
+            self.uncommitted_cores.add(core)
+            succeeded, failed = await self._post_entries(core, entries)
+            self.failed_keys.update(failed)
+            if self.on_flush is not None:
+                self.on_flush(core, succeeded, failed)
+
+    async def close(self):
+        await self.flush()
+        if self.commit_within > 0:
+            return
+        for core in sorted(self.uncommitted_cores):
+            await self.db.commit(core)
+        self.uncommitted_cores = set()
+
+    async def _post_entries(self, core_internal, entries):
+        keys = [key for key, _ in entries]
+        try:
+            await self._post(core_internal, [doc for _, docs in entries for doc in docs])
+            return keys, []
+        except Exception:
+            if len(entries) == 1:
+                self.db.log.exception('failed to update documents for {}'.format(keys[0]))
+                return [], keys
+        # Find the notebooks which caused the failure
+        succeeded = []
+        failed = []
+        for key, docs in entries:
+            try:
+                await self._post(core_internal, docs)
+                succeeded.append(key)
+            except Exception:
+                self.db.log.exception('failed to update documents for {}'.format(key))
+                failed.append(key)
+        return succeeded, failed
+
+    async def _post(self, core_internal, serialized_docs):
+        params = {}
+        if self.commit_within > 0:
+            params['commitWithin'] = self.commit_within
+        await self.db._post_update(core_internal, '[' + ','.join(serialized_docs) + ']', params)
+
+
+_converter_source = None
+_converter_output_limits = None
+
+def _init_converter(source_name, config, output_limits=None):
+    global _converter_source, _converter_output_limits
+    _converter_source = get_source(source_name, config)
+    _converter_output_limits = output_limits
+
+def _convert_notebook(file, previous_digest=None):
+    # Only the documents are returned, the notebook itself is uploaded from the source
+    # so that the process does not hold the whole notebook
+    with _converter_source.open_notebook(file['server'], file['path']) as f:
+        digest = file_digest(f)
+        if previous_digest is not None and previous_digest == digest:
+            return digest, None
+        f.seek(0)
+        notebook_data = load_notebook(f, indexed_only=True)
+    attr = dict([(k, v) for k, v in file.items()
+                 if k in ['server', 'owner', 'mtime', 'ctime', 'atime'] and v is not None])
+    documents = solr.ipynb_to_documents(file['path'], notebook_data, attr=attr, output_limits=_converter_output_limits)
+    return digest, documents
+
+
+class _DigestingReader:
+    """Reads a binary file in the default executor, computing the digest of what has been read"""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    async def read(self, size=-1):
+        chunk = await asyncio.get_running_loop().run_in_executor(None, self.f.read, size)
+        self.digest.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
 
 class UpdateIndexHandler(LoggingConfigurable):
 
+    incremental = Bool(False, help='Skip notebooks which are not changed since the last update').tag(config=True)
+
+    manifest_path = Unicode(help='The path of the manifest which records indexed notebooks for the incremental update').tag(config=True)
+
+    convert_workers = Int(None, allow_none=True, help='The number of processes which load and convert notebooks (defaults to the number of CPUs)').tag(config=True)
+
+    post_concurrency = Int(4, help='The maximum number of concurrent updates to Solr').tag(config=True)
+
+    upload_concurrency = Int(4, help='The maximum number of concurrent uploads to S3').tag(config=True)
+
+    max_pending_notebooks = Int(16, help='The maximum number of notebooks being processed at once').tag(config=True)
+
+    garbage_collect = Bool(False, help='Delete the indexed documents and stored files of notebooks which no longer exist on the source').tag(config=True)
+
+    output_field_max_chars = Int(1024 * 1024, help='The maximum number of characters indexed for each output field of a cell. Longer outputs keep their head and tail. If 0, outputs are not truncated').tag(config=True)
+
+    output_document_max_chars = Int(4 * 1024 * 1024, help='The maximum number of characters indexed for all the outputs fields of a cell or a notebook in total. If 0, outputs are not truncated').tag(config=True)
+
+    html_output_max_chars = Int(256 * 1024, help='HTML outputs longer than this number of characters, such as embedded figures, are indexed as text without tags and scripts. If 0, HTML outputs are indexed as they are').tag(config=True)
+
+    reindex_source = Unicode('local', help='The source of the notebooks which are reindexed through the server API').tag(config=True)
+
+    watch_method = Unicode('auto', help='The method to detect changes in the watch mode: auto, inotify or polling').tag(config=True)
+
+    watch_poll_interval = Float(10, help='The interval in seconds to crawl the source when changes are detected by polling').tag(config=True)
+
+    watch_debounce = Float(2, help='The time in seconds for which a notebook must be unchanged before it is indexed in the watch mode').tag(config=True)
+
+    watch_retry_max_interval = Float(300, help='The maximum time in seconds to wait before retrying the changes which have failed to be applied in the watch mode').tag(config=True)
+
+    @default('manifest_path')
+    def _default_manifest_path(self):
+        return os.path.join(jupyter_data_dir(), 'nbsearch', 'manifest.sqlite')
+
     def __init__(self, **kwargs):
         super(UpdateIndexHandler, self).__init__(**kwargs)
 
     async def update(self, cpath, source_path, path):
         self.log.info('updating indices for {}, {}({})'.format(source_path, path, cpath))
-        self.config.merge(PyFileConfigLoader(cpath).load_config())
+        self.update_config(PyFileConfigLoader(cpath).load_config())
+        if path is not None:
+            return await self.update_notebooks(source_path, [path] if isinstance(path, str) else list(path))
+        db = NBSearchDB(config=self.config)
+        await db.open()
+        source = get_source(source_path, self.config)
+        manifest = Manifest(self.manifest_path) if self.incremental else None
+        crawled = set()
+
+        def crawl():
+            for file in source.get_files():
+                crawled.add((file['server'], file['path']))
+                yield file
+
+        try:
+            with self._create_executor(source_path) as executor:
+                counts, failed, current_ids = await self._update_files(db, executor, source, manifest, crawl())
+            if self.garbage_collect:
+                if manifest is not None:
+                    for entry in manifest.get_entries(source.server):
+                        key = (entry['server'], entry['path'])
+                        if key in crawled and entry['notebook_id'] is not None:
+                            current_ids.setdefault(key, entry['notebook_id'])
+                failed_paths = set([file['path'] for file in failed])
+                counts['deleted'] = await self._collect_garbage(db, source.server, failed_paths, current_ids)
+            if manifest is not None:
+                for entry in manifest.get_entries(source.server):
+                    if (entry['server'], entry['path']) in crawled:
+                        continue
+                    self.log.info('notebook removed: {}'.format(entry['path']))
+                    manifest.remove(entry['server'], entry['path'])
+                    counts['removed'] += 1
+        finally:
+            if manifest is not None:
+                manifest.close()
+            await db.close()
+        self.log.info('finished: {} updates, {} skipped, {} removed, {} deleted, {} fails'.format(
+            counts['updated'], counts['skipped'], counts['removed'], counts['deleted'], len(failed),
+        ))
+        if len(failed) > 0:
+            raise RuntimeError('Failed to update: {}'.format(','.join([f['path'] for f in failed])))
+        return counts
+
+    async def update_notebooks(self, source_path, paths, db=None, use_processes=True):
+        """Update the indices of the notebooks at the paths without crawling the source
+
+        The paths are absolute or relative to the source. Notebooks which
+        no longer exist are deleted from the index.
+        """
+        source = get_source(source_path, self.config)
+        paths = [source.relpath(path) for path in paths]
+        ignored = [path for path in paths if source.is_ignored(path)]
+        for path in ignored:
+            self.log.warning('ignored notebook: {}'.format(path))
+        paths = sorted(set([path for path in paths if path not in ignored]))
+        close_db = db is None
+        if db is None:
+            db = NBSearchDB(config=self.config)
+            await db.open()
+        manifest = Manifest(self.manifest_path) if self.incremental else None
+        try:
+            with self._create_executor(source_path, use_processes=use_processes) as executor:
+                counts, failed = await self._apply_changes(db, executor, source, manifest, paths)
+        finally:
+            if manifest is not None:
+                manifest.close()
+            if close_db:
+                await db.close()
+        if len(failed) > 0:
+            raise RuntimeError('Failed to update: {}'.format(','.join([f['path'] for f in failed])))
+        return counts
+
+    async def watch(self, cpath, source_path):
+        self.log.info('watching {}({})'.format(source_path, cpath))
+        self.update_config(PyFileConfigLoader(cpath).load_config())
         db = NBSearchDB(config=self.config)
+        await db.open()
         source = get_source(source_path, self.config)
+        manifest = Manifest(self.manifest_path) if self.incremental else None
+        watcher = create_watcher(
+            source, method=self.watch_method, poll_interval=self.watch_poll_interval, log=self.log,
+        )
+        watcher.start()
+        loop = asyncio.get_running_loop()
+        failures = 0
+        retries = []
+        try:
+            with self._create_executor(source_path) as executor:
+                async for paths in debounce(watcher, self.watch_debounce):
+                    try:
+                        await self._apply_changes(db, executor, source, manifest, paths)
+                        failures = 0
+                    except Exception:
+                        # Keep watching, and retry the changes with an exponential backoff
+                        failures += 1
+                        delay = min(self.watch_debounce * 2 ** (failures - 1), self.watch_retry_max_interval)
+                        self.log.exception('failed to apply changes, retrying in {:.1f}s: {}'.format(
+                            delay, ', '.join(paths),
+                        ))
+                        retries = [handle for handle in retries if handle.when() > loop.time()]
+                        retries.append(loop.call_later(delay, watcher.retry, paths))
+        finally:
+            for handle in retries:
+                handle.cancel()
+            watcher.close()
+            if manifest is not None:
+                manifest.close()
+            await db.close()
 
-        updated = 0
+    async def _apply_changes(self, db, executor, source, manifest, paths):
+        files = [source.get_file(path) for path in paths]
+        removed = [path for path, file in zip(paths, files) if file is None]
+        counts, failed, _ = await self._update_files(
+            db, executor, source, manifest, iter([file for file in files if file is not None]),
+        )
+        counts['removed'] = len(removed)
+        if len(removed) > 0:
+            counts['deleted'] = await self._delete_removed(db, source.server, removed, manifest)
+        self.log.info('changes applied: {} updates, {} skipped, {} deleted, {} fails'.format(
+            counts['updated'], counts['skipped'], counts['deleted'], len(failed),
+        ))
+        return counts, failed
+
+    def _create_executor(self, source_path, use_processes=True):
+        # Threads avoid starting worker processes for a few notebooks, e.g. in the server
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        return executor_class(
+            max_workers=self.convert_workers,
+            initializer=_init_converter,
+            initargs=(source_path, self.config, self._output_limits()),
+        )
+
+    def _output_limits(self):
+        return solr.OutputLimits(
+            field_max_chars=self.output_field_max_chars,
+            document_max_chars=self.output_document_max_chars,
+            html_max_chars=self.html_output_max_chars,
+        )
+
+    async def _update_files(self, db, executor, source, manifest, files):
+        """Index the files through the pipeline of conversion, upload and batched posts
+
+        Returns the counts, the failed files and the notebook IDs of the
+        files which have been indexed.
+        """
+        loop = asyncio.get_running_loop()
+        post_semaphore = asyncio.Semaphore(self.post_concurrency)
+        upload_semaphore = asyncio.Semaphore(self.upload_concurrency)
+
+        counts = {
+            'updated': 0,
+            'skipped': 0,
+            'removed': 0,
+            'deleted': 0,
+        }
         failed = []
-        for file in source.get_files():
-            if path is not None and os.path.split(file['path'])[-1] != os.path.split(path)[-1]:
-                continue
+        notebooks = {}
+        # Notebook IDs of the crawled notebooks which have been indexed
+        current_ids = {}
+        # Updated notebooks and their numbers of cells, to remove the cells which no longer exist
+        trimmed = []
+
+        def complete(key, succeeded):
+            notebook = notebooks[key]
+            if not succeeded:
+                notebook['failed'] = True
+            notebook['remaining'] -= 1
+            if notebook['remaining'] > 0:
+                return
+            del notebooks[key]
+            if notebook['failed']:
+                self.log.error('failed to update index for {}'.format(key[1]))
+                failed.append(notebook['file'])
+                return
+            # A notebook is counted once all of its cores and its upload have been done
+            counts['updated'] += 1
+            current_ids[key] = notebook['notebook_id']
+            trimmed.append((notebook['notebook_id'], notebook['cells']))
+            if manifest is not None:
+                manifest.put(notebook['file'], notebook['digest'], notebook_id=notebook['notebook_id'])
+                manifest.commit()
+
+        def on_flush(core, succeeded, failed_keys):
+            for key in succeeded:
+                self.log.info(f"{key[1]} - {core}")
+                complete(key, True)
+            for key in failed_keys:
+                complete(key, False)
+
+        async def upload(key, notebook_id, digest):
             try:
-                notebook_data = source.get_notebook(file['server'], file['path'])
-                attr = dict([(k, v) for k, v in file.items()
-                             if k in ['server', 'owner', 'mtime', 'ctime', 'atime'] and v is not None])
-                r = solr.ipynb_to_documents(file['path'], notebook_data, attr=attr)
-                results = []
-                for core, docs in r.items():
-                    self.log.info(f"{file['path']} - {core}")
-                    await db.post_document(core, docs)
-                    updated += 1
-                    if core != 'jupyter-notebook':
-                        continue
-                    await db.upload_file(docs[0]['id'], notebook_data)
-                updated += 1
+                async with upload_semaphore:
+                    f = await loop.run_in_executor(None, source.open_notebook, key[0], key[1])
+                    try:
+                        reader = _DigestingReader(f)
+                        await db.upload_fileobj(notebook_id, reader)
+                    finally:
+                        f.close()
+                # The notebook may have been saved again after it was converted
+                if reader.hexdigest() != digest:
+                    raise ValueError('notebook has been changed while indexing: {}'.format(key[1]))
+            except:
+                self.log.exception('failed to upload {}'.format(key[1]))
+                complete(key, False)
+                return
+            complete(key, True)
+
+        update_buffer = db.create_update_buffer(on_flush=on_flush)
+
+        async def update_notebook(file):
+            try:
+                previous_digest = None
+                if manifest is not None:
+                    entry = manifest.get(file['server'], file['path'])
+                    previous_digest = entry['digest'] if entry is not None else None
+                digest, documents = await loop.run_in_executor(
+                    executor, _convert_notebook, file, previous_digest,
+                )
+                if documents is None:
+                    self.log.debug('skip notebook with unchanged content: {}'.format(file['path']))
+                    manifest.put(file, digest)
+                    counts['skipped'] += 1
+                    return
+                notebook_id = documents['jupyter-notebook'][0]['id']
+                key = (file['server'], file['path'])
+                notebooks[key] = {
+                    'file': file,
+                    'digest': digest,
+                    'notebook_id': notebook_id,
+                    # The cores and the upload
+                    'remaining': len(documents) + 1,
+                    'failed': False,
+                    'cells': len(documents.get('jupyter-cell', [])),
+                }
+                # Uploads while the documents are posted
+                uploading = asyncio.ensure_future(upload(key, notebook_id, digest))
+                for core, docs in documents.items():
+                    async with post_semaphore:
+                        await update_buffer.add(core, docs, key=key)
+                await uploading
             except:
                 self.log.exception('failed to update index for {}'.format(file['path']))
                 failed.append(file)
-        self.log.info('finished: {} updates, {} fails'.format(updated, len(failed)))
-        if len(failed) > 0:
-            raise RuntimeError('Failed to update: {}'.format(','.join([f['path'] for f in failed])))
+
+        pending = set()
+        while True:
+            # Crawl in a thread so that the event loop keeps posting documents
+            file = await loop.run_in_executor(None, next, files, None)
+            if file is None:
+                break
+            if manifest is not None and manifest.is_stat_unchanged(file):
+                self.log.debug('skip unchanged notebook: {}'.format(file['path']))
+                counts['skipped'] += 1
+                continue
+            if len(pending) >= self.max_pending_notebooks:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.ensure_future(update_notebook(file)))
+        if len(pending) > 0:
+            await asyncio.wait(pending)
+        await update_buffer.flush()
+        await self._remove_trailing_cells(db, trimmed)
+        # Commits the updates and the deletions of the trailing cells at once
+        await update_buffer.close()
+        return counts, failed, current_ids
+
+    async def _remove_trailing_cells(self, db, trimmed):
+        if len(trimmed) == 0:
+            return
+        await db.delete_by_query('jupyter-cell', [
+            f'notebook_id:{_quote(notebook_id)} AND index:[{cells} TO *]'
+            for notebook_id, cells in trimmed
+        ])
+
+    async def _find_notebook_paths(self, db, server, query='*:*'):
+        """Map the IDs of the notebooks indexed for the server to their paths
+
+        The notebook core keeps only the basename of a notebook, so the path
+        is taken from the first cell of the notebook in the cell core.
+        """
+        notebook_paths = {}
+        pages = db.iter_query(
+            'jupyter-cell',
+            query,
+            fl=['notebook_id', 'notebook_filename', 'notebook_server'],
+            fq=['index:0', _server_query('notebook_server', server)],
+        )
+        async for docs in pages:
+            for doc in docs:
+                if doc.get('notebook_server', '') != server:
+                    continue
+                notebook_paths[doc['notebook_id']] = doc['notebook_filename']
+        return notebook_paths
+
+    async def _collect_garbage(self, db, server, failed_paths, current_ids):
+        """Delete the notebooks on the server which are indexed but no longer crawled
+
+        A notebook document is kept while its ID is used by any crawled
+        notebook, since notebooks copied with their memes share the same ID.
+        The IDs of a notebook whose update failed are kept as they are, but
+        the old ID of a notebook which has been indexed under a new one is
+        deleted.
+        """
+        live_ids = set(current_ids.values())
+        notebook_paths = await self._find_notebook_paths(db, server)
+        vanished = []
+        pages = db.iter_query(
+            'jupyter-notebook',
+            '*:*',
+            fl=['id', 'filename', 'server'],
+            fq=[_server_query('server', server)],
+        )
+        async for docs in pages:
+            for doc in docs:
+                if doc.get('server', '') != server or doc['id'] in live_ids:
+                    continue
+                path = notebook_paths.get(doc['id'])
+                if path is not None and path in failed_paths:
+                    # Exists but has not been indexed successfully
+                    continue
+                self.log.info('notebook deleted: {} ({})'.format(path or doc.get('filename'), doc['id']))
+                vanished.append(doc['id'])
+        if len(vanished) == 0:
+            return 0
+        await self._delete_notebooks(db, vanished)
+        return len(vanished)
+
+    async def _delete_removed(self, db, server, paths, manifest):
+        """Delete the notebooks at the paths which have been removed from the source"""
+        removed = set(paths)
+        notebook_ids = set()
+        for i in range(0, len(paths), db.solr_delete_batch_queries):
+            query = ' OR '.join([f'notebook_filename:{_quote(path)}'
+                                 for path in paths[i:i + db.solr_delete_batch_queries]])
+            notebook_paths = await self._find_notebook_paths(db, server, query=query)
+            notebook_ids.update([notebook_id for notebook_id, path in notebook_paths.items() if path in removed])
+        if manifest is not None:
+            # Notebooks without cells are found only in the manifest
+            for path in paths:
+                entry = manifest.get(server, path)
+                if entry is not None and entry['notebook_id'] is not None:
+                    notebook_ids.add(entry['notebook_id'])
+            # Keep the IDs shared by the notebooks which still exist
+            shared = set([entry['notebook_id'] for entry in manifest.get_entries(server)
+                          if entry['path'] not in removed])
+            notebook_ids = set([notebook_id for notebook_id in notebook_ids if notebook_id not in shared])
+            for path in paths:
+                manifest.remove(server, path)
+            manifest.commit()
+        if len(notebook_ids) == 0:
+            return 0
+        notebook_ids = sorted(notebook_ids)
+        for notebook_id in notebook_ids:
+            self.log.info('notebook deleted: {}'.format(notebook_id))
+        await self._delete_notebooks(db, notebook_ids)
+        return len(notebook_ids)
+
+    async def _delete_notebooks(self, db, notebook_ids):
+        await db.delete_by_query('jupyter-cell', [f'notebook_id:{_quote(notebook_id)}' for notebook_id in notebook_ids])
+        await db.delete_by_query('jupyter-notebook', [f'id:{_quote(notebook_id)}' for notebook_id in notebook_ids])
+        await db.commit('jupyter-cell')
+        await db.commit('jupyter-notebook')
+        await db.delete_files(notebook_ids)
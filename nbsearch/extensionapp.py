@@ -18,13 +18,18 @@ class UpdateIndexApp(Application):
     version = __version__
 
     examples = """
-        jupyter nbsearch update-index [options] <config-path> <source> <path>
+        jupyter nbsearch update-index [options] <config-path> <source> [<path> ...]
     """
 
     classes = List([UpdateIndexHandler])
-    aliases = Dict({'log-level': 'Application.log_level'})
+    aliases = Dict({'log-level': 'Application.log_level',
+                    'manifest': 'UpdateIndexHandler.manifest_path'})
     flags = Dict({'debug': ({'Application': {'log_level': 10}},
-                            'Set loglevel to DEBUG')})
+                            'Set loglevel to DEBUG'),
+                  'incremental': ({'UpdateIndexHandler': {'incremental': True}},
+                                  'Skip notebooks which are not changed since the last update'),
+                  'gc': ({'UpdateIndexHandler': {'garbage_collect': True}},
+                         'Delete the indexes and stored files of notebooks which no longer exist')})
 
     @catch_config_error
     def initialize(self, argv=None):
@@ -37,8 +42,46 @@ class UpdateIndexApp(Application):
             sys.exit(-1)
         config_path = self.extra_args[0]
         source = self.extra_args[1]
-        path = self.extra_args[2] if len(self.extra_args) == 3 else None
-        asyncio.run(self.handler.update(config_path, source, path))
+        # Only the given notebooks are updated, without crawling the source
+        paths = [os.path.abspath(path) for path in self.extra_args[2:]]
+        asyncio.run(self.handler.update(config_path, source, paths if len(paths) > 0 else None))
+
+
+class WatchApp(Application):
+    """Watch notebooks and update Index of Solr"""
+    name = "jupyter nbsearch watch"
+    description = "Watch notebooks and update Index of Solr when they are changed"
+    version = __version__
+
+    examples = """
+        jupyter nbsearch watch [options] <config-path> <source>
+    """
+
+    classes = List([UpdateIndexHandler])
+    aliases = Dict({'log-level': 'Application.log_level',
+                    'manifest': 'UpdateIndexHandler.manifest_path',
+                    'method': 'UpdateIndexHandler.watch_method',
+                    'debounce': 'UpdateIndexHandler.watch_debounce'})
+    flags = Dict({'debug': ({'Application': {'log_level': 10}},
+                            'Set loglevel to DEBUG'),
+                  'incremental': ({'UpdateIndexHandler': {'incremental': True}},
+                                  'Skip notebooks which are not changed since the last update')})
+
+    @catch_config_error
+    def initialize(self, argv=None):
+        super(WatchApp, self).initialize(argv)
+        self.handler = UpdateIndexHandler(config=self.config)
+
+    def start(self):
+        if len(self.extra_args) != 2:
+            self.print_help()
+            sys.exit(-1)
+        config_path = self.extra_args[0]
+        source = self.extra_args[1]
+        try:
+            asyncio.run(self.handler.watch(config_path, source))
+        except KeyboardInterrupt:
+            pass
 
 
 class ExtensionApp(Application):
@@ -55,6 +98,10 @@ class ExtensionApp(Application):
             UpdateIndexApp,
             "Update Index of Solr"
         ),
+        "watch": (
+            WatchApp,
+            "Watch notebooks and update Index of Solr"
+        ),
     })
 
     def _classes_default(self):
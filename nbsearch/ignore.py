@@ -0,0 +1,143 @@
+from collections import namedtuple
+from functools import lru_cache
+import os
+import re
+
+
+IgnoreRule = namedtuple('IgnoreRule', ['pattern', 'regex', 'negated', 'dir_only'])
+
+
+def translate_pattern(pattern):
+    """Translate a gitignore-style pattern into a regex for paths relative to the ignore file"""
+    # Patterns with a slash except at the end are relative to the directory of the ignore file,
+    # others match at any level
+    anchored = '/' in pattern
+    if pattern.startswith('/'):
+        pattern = pattern[1:]
+    if pattern.startswith('**/'):
+        pattern = pattern[3:]
+        anchored = False
+    regex = ''
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('/**/', i):
+            regex += '/(?:.*/)?'
+            i += 4
+        elif pattern.startswith('/**', i) and i + 3 == n:
+            regex += '/.*'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif c == '*':
+            regex += '[^/]*'
+            i += 1
+        elif c == '?':
+            regex += '[^/]'
+            i += 1
+        elif c == '[':
+            start = i + 1
+            if start < n and pattern[start] in '!^':
+                start += 1
+            if start < n and pattern[start] == ']':
+                start += 1
+            end = pattern.find(']', start)
+            if end < 0:
+                regex += re.escape(c)
+                i += 1
+                continue
+            body = pattern[i + 1:end].replace('\\', '\\\\').replace('[', '\\[')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex += '[' + body + ']'
+            i = end + 1
+        elif c == '\\' and i + 1 < n:
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(c)
+            i += 1
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return regex
+
+
+def parse_rules(lines):
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        elif line.startswith('\\'):
+            # Escaped leading '#' or '!'
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if len(line) == 0:
+            continue
+        rules.append(IgnoreRule(line, translate_pattern(line), negated, dir_only))
+    return rules
+
+
+@lru_cache(maxsize=1024)
+def _load_rules(path, mtime_ns, size):
+    with open(path, 'r') as f:
+        return parse_rules(f.readlines())
+
+
+def load_rules(path):
+    """Load the rules of an ignore file, reusing the parsed rules while the file is unchanged"""
+    stat = os.stat(path)
+    return _load_rules(path, stat.st_mtime_ns, stat.st_size)
+
+
+def _compile(rules):
+    if len(rules) == 0:
+        return None, []
+    # The last matching rule decides, so the rules are tried in reverse order
+    # and the index of the matched group identifies the rule
+    rules = list(reversed(rules))
+    regex = re.compile('|'.join(['({})'.format(rule.regex) for rule in rules]))
+    return regex, [rule.negated for rule in rules]
+
+
+class IgnoreMatcher:
+    """Matches paths against the rules of an ignore file and those inherited from the parent directories
+
+    Each rule set is compiled into one regex for files and one for
+    directories. Rules in deeper directories take precedence over their
+    parents, and within a file the last matching rule wins.
+    """
+
+    def __init__(self, rules, base_dir='', parent=None):
+        self.rules = rules
+        self.base_dir = base_dir
+        self.parent = parent
+        self.file_regex, self.file_negated = _compile([rule for rule in rules if not rule.dir_only])
+        dir_rules = list(rules)
+        if not any([rule.negated for rule in rules]):
+            # 'dir/**' ignores everything in dir, so the directory itself can be skipped
+            # unless a negated rule may include something in it again
+            dir_rules += [IgnoreRule(rule.pattern, rule.regex[:-len('/.*')], False, True)
+                          for rule in rules if rule.regex.endswith('/.*')]
+        self.dir_regex, self.dir_negated = _compile(dir_rules)
+
+    def match(self, path, is_dir=False):
+        """Return True if the path is ignored, False if it is included again by a negated rule, or None"""
+        relpath = path[len(self.base_dir) + 1:] if len(self.base_dir) > 0 else path
+        regex, negated = (self.dir_regex, self.dir_negated) if is_dir else (self.file_regex, self.file_negated)
+        if regex is not None:
+            m = regex.fullmatch(relpath)
+            if m is not None:
+                return not negated[m.lastindex - 1]
+        if self.parent is not None:
+            return self.parent.match(path, is_dir)
+        return None
+
+    def is_ignored(self, path, is_dir=False):
+        return self.match(path, is_dir) is True
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import sqlite3
+
+
+def file_digest(f, chunk_size=1024 * 1024):
+    """Compute the SHA-256 digest of a binary file without reading it at once"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Local record of the notebooks which have been indexed.
+
+    Each notebook is keyed on its server and path, and keeps the mtime, size
+    and content digest observed when it was last indexed.
+    """
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if len(dirname) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS notebooks (
+                server TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime_ns INTEGER,
+                size INTEGER,
+                digest TEXT,
+                notebook_id TEXT,
+                PRIMARY KEY (server, path)
+            )
+        ''')
+
+    def get(self, server, path):
+        row = self.conn.execute(
+            'SELECT mtime_ns, size, digest, notebook_id FROM notebooks WHERE server = ? AND path = ?',
+            (server, path),
+        ).fetchone()
+        if row is None:
+            return None
+        mtime_ns, size, digest, notebook_id = row
+        return {
+            'server': server,
+            'path': path,
+            'mtime_ns': mtime_ns,
+            'size': size,
+            'digest': digest,
+            'notebook_id': notebook_id,
+        }
+
+    def is_stat_unchanged(self, file):
+        entry = self.get(file['server'], file['path'])
+        if entry is None:
+            return False
+        return entry['mtime_ns'] == file['mtime_ns'] and entry['size'] == file['size']
+
+    def put(self, file, digest, notebook_id=None):
+        if notebook_id is None:
+            entry = self.get(file['server'], file['path'])
+            notebook_id = entry['notebook_id'] if entry is not None else None
+        self.conn.execute(
+            'INSERT OR REPLACE INTO notebooks (server, path, mtime_ns, size, digest, notebook_id) VALUES (?, ?, ?, ?, ?, ?)',
+            (file['server'], file['path'], file['mtime_ns'], file['size'], digest, notebook_id),
+        )
+
+    def remove(self, server, path):
+        self.conn.execute(
+            'DELETE FROM notebooks WHERE server = ? AND path = ?',
+            (server, path),
+        )
+
+    def get_entries(self, server):
+        rows = self.conn.execute(
+            'SELECT path, mtime_ns, size, digest, notebook_id FROM notebooks WHERE server = ?',
+            (server,),
+        ).fetchall()
+        return [{
+            'server': server,
+            'path': path,
+            'mtime_ns': mtime_ns,
+            'size': size,
+            'digest': digest,
+            'notebook_id': notebook_id,
+        } for path, mtime_ns, size, digest, notebook_id in rows]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -3,12 +3,16 @@ import os
 from tornado import gen
 import tornado.web
 
-from .db import NBSearchDB
+from .db import NBSearchDB, UpdateIndexHandler
 from .handlers import (MainHandler)
 from .v1.handlers import (
     NBSEARCH_TMP,
     SearchHandler,
+    ExportHandler,
+    ReindexHandler,
+    SearchCacheHandler,
     ImportHandler,
+    ImportProgressHandler,
     DataHandler,
 )
 
@@ -26,25 +30,47 @@ def _get_root_dir(nb_server_app):
     return nb_server_app.notebook_dir
 
 
-def get_api_handlers(parent_app, base_dir):
-    db = NBSearchDB(parent=parent_app)
+def get_api_handlers(parent_app, base_dir, db=None):
+    if db is None:
+        db = NBSearchDB(parent=parent_app)
 
     handler_settings = {}
     handler_settings['db'] = db
     handler_settings['base_dir'] = base_dir
+    reindex_settings = dict(handler_settings)
+    reindex_settings['indexer'] = UpdateIndexHandler(parent=parent_app)
 
     return [
         (r"/v1/(?P<target>[^\/]+)/search", SearchHandler, handler_settings),
+        (r"/v1/(?P<target>[^\/]+)/export", ExportHandler, handler_settings),
+        (r"/v1/reindex", ReindexHandler, reindex_settings),
+        (r"/v1/cache", SearchCacheHandler, handler_settings),
         (r"/v1/import(?P<path>/.+)?/(?P<id>[^\/]+)", ImportHandler, handler_settings),
+        (r"/v1/imports", ImportProgressHandler, handler_settings),
         (r"/v1/data/(?P<id>[^\/]+)", DataHandler, handler_settings),
     ]
 
 
+def _close_on_cleanup(nb_server_app, db):
+    # Server extensions without ExtensionApp have no stop hook, so the S3 client
+    # of the shared NBSearchDB is closed along with the other extensions.
+    cleanup_extensions = getattr(nb_server_app, 'cleanup_extensions', None)
+    if cleanup_extensions is None:
+        return
+
+    async def _cleanup_extensions():
+        await cleanup_extensions()
+        await db.close()
+    nb_server_app.cleanup_extensions = _cleanup_extensions
+
+
 def register_routes(nb_server_app, web_app):
     from notebook.utils import url_path_join
     base_dir = _get_root_dir(nb_server_app)
     nb_server_app.log.info(f'nbsearch extension: base_dir={base_dir}')
-    api_handlers = get_api_handlers(nb_server_app, base_dir)
+    db = NBSearchDB(parent=nb_server_app)
+    _close_on_cleanup(nb_server_app, db)
+    api_handlers = get_api_handlers(nb_server_app, base_dir, db=db)
 
     nbsearchignore = os.path.join(base_dir, '.nbsearchignore')
     if not os.path.exists(nbsearchignore):
@@ -1,7 +1,9 @@
+from collections import namedtuple
+import html
 import io
-import json
 import os
 import re
+import threading
 from datetime import datetime
 import pytz
 import requests
@@ -10,6 +12,51 @@ import mistletoe
 from mistletoe.ast_renderer import ASTRenderer
 
 
+# Limits in characters of the indexed outputs, each disabled by 0: field_max_chars for each
+# outputs field of a cell, document_max_chars for all the outputs fields of a cell or a notebook
+# in total, and html_max_chars for HTML outputs kept as they are instead of stripped to text
+OutputLimits = namedtuple('OutputLimits', ['field_max_chars', 'document_max_chars', 'html_max_chars'])
+
+TRUNCATED_MARKER = '\n[... {} characters truncated ...]\n'
+
+_HTML_SCRIPT_PATTERN = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_HTML_TAG_PATTERN = re.compile(r'<[^>]*>')
+_SPACES_PATTERN = re.compile(r'\s+')
+
+def _truncate_text(text, max_chars):
+    """Keep the head and the tail of text within max_chars, returning the text and whether it is truncated"""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text, False
+    head = max_chars // 2
+    tail = max_chars - head
+    return text[:head] + TRUNCATED_MARKER.format(len(text) - max_chars) + text[-tail:], True
+
+def _truncate_fields(doc, keys, field_max_chars, total_max_chars):
+    """Truncate each of the fields within field_max_chars and all of them within total_max_chars
+
+    The total is shared equally between the fields longer than their share.
+    Returns the keys of the truncated fields.
+    """
+    truncated = []
+    remaining = total_max_chars
+    keys = sorted(keys, key=lambda k: len(doc[k]))
+    for i, k in enumerate(keys):
+        max_chars = field_max_chars
+        if total_max_chars > 0:
+            share = max(remaining // (len(keys) - i), 1)
+            max_chars = share if max_chars <= 0 else min(max_chars, share)
+            remaining -= min(len(doc[k]), max_chars)
+        doc[k], is_truncated = _truncate_text(doc[k], max_chars)
+        if is_truncated:
+            truncated.append(k)
+    return sorted(truncated)
+
+def _html_to_text(text):
+    # Embedded scripts such as plotly figures are dropped with their contents
+    text = _HTML_SCRIPT_PATTERN.sub(' ', text)
+    text = _HTML_TAG_PATTERN.sub(' ', text)
+    return _SPACES_PATTERN.sub(' ', html.unescape(text)).strip()
+
 def notebook_to_notebook_id(path, notebook_data):
     _, filename = os.path.split(path)
     if 'metadata' not in notebook_data:
@@ -47,75 +94,129 @@ def _get_current_meme(cell):
         return None
     return meme['current']
 
-def _add_field(fields, name, text):
-    if name not in fields:
-        fields[name] = text
-        return
-    if len(fields[name]) == 0:
-        fields[name] = text
-        return
-    fields[name] += '\n' + text
+def _join_field(values):
+    # Same as appending each value to the field with a newline, replacing an empty field
+    for i, value in enumerate(values):
+        if len(value) > 0:
+            return '\n'.join(values[i:])
+    return ''
+
+_markdown_lock = threading.Lock()
+
+def parse_markdown(markdown):
+    """Parse markdown into the tree of mistletoe tokens
+
+    The tokens are walked directly instead of being rendered into a JSON
+    AST by ASTRenderer and loaded again. The type of a node is the class
+    name of the token, as in the JSON AST.
+    """
+    # mistletoe keeps the parse state and the token types in module globals
+    with _markdown_lock, ASTRenderer():
+        return mistletoe.Document(markdown)
+
+def _token_type(token):
+    return token.__class__.__name__
 
 def _get_markdown_text(ast):
-    if ast['type'] == 'RawText':
-        return ast['content']
-    if 'children' not in ast:
+    if _token_type(ast) == 'RawText':
+        return ast.content
+    if ast.children is None:
         return ''
     r = []
-    for child in ast['children']:
+    for child in ast.children:
         r.append(_get_markdown_text(child))
     return ' '.join(r)
 
-def markdown_ast_to_solr_fields(fields, ast, prefix=''):
-    r = fields.copy()
-    if ast['type'] == 'Heading':
-        level = min(ast['level'], 6)
-        _add_field(r, f'{prefix}heading', '#' * level + ' ' + _get_markdown_text(ast))
-        _add_field(r, f'{prefix}heading_{level}', _get_markdown_text(ast))
-    elif ast['type'] == 'Link':
-        _add_field(r, f'{prefix}link', _get_markdown_text(ast) + ' ' + ast['target'])
-        _add_field(r, f'{prefix}url', ast['target'])
-    elif ast['type'] == 'RawText':
-        # extract url from text
-        m = re.finditer(r'https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)', ast['content'])
-        for url in m:
-            _add_field(r, f'{prefix}url', url.group())
-    elif ast['type'] == 'InlineCode':
-        _add_field(r, f'{prefix}code_inline', _get_markdown_text(ast))
-        _add_field(r, f'{prefix}code', _get_markdown_text(ast))
-    elif ast['type'] == 'CodeFence':
-        _add_field(r, f'{prefix}code_fence', _get_markdown_text(ast))
-        _add_field(r, f'{prefix}code', _get_markdown_text(ast))
-    elif ast['type'] == 'Emphasis':
-        _add_field(r, f'{prefix}emphasis_1', _get_markdown_text(ast))
-        _add_field(r, f'{prefix}emphasis', _get_markdown_text(ast))
-    elif ast['type'] == 'Strong':
-        _add_field(r, f'{prefix}emphasis_2', _get_markdown_text(ast))
-        _add_field(r, f'{prefix}emphasis', _get_markdown_text(ast))
-    if 'children' not in ast:
+_URL_PATTERN = re.compile(r'https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)')
+
+class MarkdownFieldsVisitor:
+    """Collects the fields of a markdown AST of mistletoe tokens in a single walk.
+
+    The values are appended to per-field lists and the text of each node is
+    built from those of its children, so no subtree is visited twice. The
+    values which depend on the text of a node are reserved before its
+    children are visited to keep the order of the fields.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.values = {}
+        self.texts = {}
+
+    def _add(self, name, text):
+        self.values.setdefault(self.prefix + name, []).append(text)
+
+    def _reserve(self, name, head='', tail=''):
+        # The value is filled in with the text of the node once its children are visited
+        values = self.values.setdefault(self.prefix + name, [])
+        values.append(None)
+        return values, len(values) - 1, head, tail
+
+    def visit(self, ast):
+        """Collect the fields of the node and its descendants, returning the text of the node"""
+        node_type = _token_type(ast)
+        if node_type == 'RawText':
+            for url in _URL_PATTERN.finditer(ast.content):
+                self._add('url', url.group())
+            return ast.content
+        slots = []
+        if node_type == 'Heading':
+            level = min(ast.level, 6)
+            slots = [self._reserve('heading', head='#' * level + ' '), self._reserve(f'heading_{level}')]
+        elif node_type == 'Link':
+            slots = [self._reserve('link', tail=' ' + ast.target)]
+            self._add('url', ast.target)
+        elif node_type == 'InlineCode':
+            slots = [self._reserve('code_inline'), self._reserve('code')]
+        elif node_type == 'CodeFence':
+            slots = [self._reserve('code_fence'), self._reserve('code')]
+        elif node_type == 'Emphasis':
+            slots = [self._reserve('emphasis_1'), self._reserve('emphasis')]
+        elif node_type == 'Strong':
+            slots = [self._reserve('emphasis_2'), self._reserve('emphasis')]
+        if ast.children is None:
+            text = ''
+        else:
+            text = ' '.join([self.visit(child) for child in ast.children])
+        self.texts[id(ast)] = text
+        for values, index, head, tail in slots:
+            values[index] = head + text + tail
+        return text
+
+    def get_text(self, ast):
+        if _token_type(ast) == 'RawText':
+            return ast.content
+        return self.texts[id(ast)]
+
+    def to_fields(self, fields=None):
+        r = dict(fields) if fields is not None else {}
+        for name, values in self.values.items():
+            r[name] = _join_field(([r[name]] if name in r else []) + values)
         return r
-    for child in ast['children']:
-        r = markdown_ast_to_solr_fields(r, child, prefix=prefix)
-    return r
 
-def _retrieve_markdown_content(ast, header_pattern):
+def markdown_ast_to_solr_fields(fields, ast, prefix=''):
+    visitor = MarkdownFieldsVisitor(prefix=prefix)
+    visitor.visit(ast)
+    return visitor.to_fields(fields)
+
+def _retrieve_markdown_content(ast, header_pattern, get_text=_get_markdown_text):
     target = None
-    if 'children' not in ast:
+    if ast.children is None:
         return None
-    for child in ast['children']:
-        if child['type'] == 'Heading':
+    for child in ast.children:
+        if _token_type(child) == 'Heading':
             if target is not None:
                 return '\n'.join(target)
-            if header_pattern.search(_get_markdown_text(child)) is not None:
+            if header_pattern.search(get_text(child)) is not None:
                 target = []
             continue
         if target is None:
             continue
-        target.append(_get_markdown_text(child))
+        target.append(get_text(child))
     if target is not None:
         return '\n'.join(target)
-    for child in ast['children']:
-        t = _retrieve_markdown_content(child, header_pattern)
+    for child in ast.children:
+        t = _retrieve_markdown_content(child, header_pattern, get_text=get_text)
         if t is not None:
             return t
     return None
@@ -126,13 +227,13 @@ def _contains_markdown(fields, name, keywords):
     return any([k in fields[name].lower() for k in keywords])
 
 def _get_markdown_ast_heading_levels(ast):
-    if ast['type'] == 'Heading':
-        return (ast['level'], ast['level'])
-    if 'children' not in ast:
+    if _token_type(ast) == 'Heading':
+        return (ast.level, ast.level)
+    if ast.children is None:
         return None
     pre_r = None
     post_r = None
-    for child in ast['children']:
+    for child in ast.children:
         levels = _get_markdown_ast_heading_levels(child)
         if levels is None:
             continue
@@ -144,48 +245,101 @@ def _get_markdown_ast_heading_levels(ast):
         return None
     return (pre_r, post_r)
 
-def _get_markdown_heading_levels(cell):
+def _get_markdown_ast(cell):
     if cell['cell_type'] != 'markdown' or 'source' not in cell:
         return None
     markdown = ''.join(cell['source'])
-    ast = json.loads(mistletoe.markdown(markdown, ASTRenderer))
+    return parse_markdown(markdown)
+
+def _get_markdown_heading_levels(cell):
+    ast = _get_markdown_ast(cell)
+    if ast is None:
+        return None
     return _get_markdown_ast_heading_levels(ast)
 
-def _find_section_beginning(headings, index, start_level=None):
-    if index == 0:
-        return 0
-    current = headings[index]
-    if current is not None:
-        if start_level is None:
-            return index
-        if start_level - 1 >= current[0]:
-            return index
-    return _find_section_beginning(headings, index - 1, start_level=start_level)
-
-def _find_section_ending(headings, index, start_level=None):
-    if index + 1 >= len(headings):
-        return len(headings)
-    current_levels = [h[-1] for h in headings[:index + 1] if h is not None]
-    post = headings[index + 1]
-    if len(current_levels) == 0:
-        # If there is no preceding heading, then it will be applied to the end.
-        return len(headings)
-    if post is None:
-        return _find_section_ending(headings, index + 1, start_level=start_level)
-    current_level = start_level if start_level is not None else current_levels[-1]
-    post_level, _ = post
-    if current_level < post_level:
-        return _find_section_ending(headings, index + 1, start_level=current_level)
-    return index + 1
-
-def markdown_to_solr_fields(markdown, prefix=''):
-    ast = json.loads(mistletoe.markdown(markdown, ASTRenderer))
-    r = {}
-    r = markdown_ast_to_solr_fields(r, ast, prefix=prefix)
+def _find_section_beginnings(headings):
+    # A cell without headings belongs to the section of the closest preceding heading.
+    # A heading cell belongs to the section of the closest preceding heading whose
+    # level is higher (smaller) than its own first heading.
+    beginnings = []
+    last_heading = 0
+    parents = []
+    for index, levels in enumerate(headings):
+        if levels is None:
+            beginnings.append(last_heading)
+            continue
+        while len(parents) > 0 and headings[parents[-1]][0] >= levels[0]:
+            parents.pop()
+        beginnings.append(parents[-1] if len(parents) > 0 else 0)
+        parents.append(index)
+        last_heading = index
+    return beginnings
+
+def _find_section_endings(headings):
+    # A section ends at the next heading cell whose first heading level is equal to
+    # or higher than the last heading level of the closest heading cell.
+    endings = [len(headings)] * len(headings)
+    following = {}
+    for index in reversed(range(len(headings))):
+        levels = headings[index]
+        if levels is None:
+            continue
+        candidates = [i for level, i in following.items() if level <= levels[-1]]
+        if len(candidates) > 0:
+            endings[index] = min(candidates)
+        following[levels[0]] = index
+    last_ending = len(headings)
+    for index, levels in enumerate(headings):
+        if levels is not None:
+            last_ending = endings[index]
+        endings[index] = last_ending
+    return endings
+
+class NotebookAnalysis:
+    """Per-notebook values shared by the documents of all cells.
+
+    Every markdown cell is parsed exactly once, so that building the documents
+    of a notebook stays linear in the number of cells.
+    """
+
+    def __init__(self, cells):
+        self.cells = cells
+        self.markdown_asts = [_get_markdown_ast(cell) for cell in cells]
+        self.memes = [_get_current_meme(cell) for cell in cells]
+        self.heading_levels = [
+            None if ast is None else _get_markdown_ast_heading_levels(ast)
+            for ast in self.markdown_asts
+        ]
+        self.section_beginnings = _find_section_beginnings(self.heading_levels)
+        self.section_endings = _find_section_endings(self.heading_levels)
+        # Offsets of each cell's meme in the space-separated list of all memes
+        self.joined_memes = ' '.join([meme for meme in self.memes if meme is not None])
+        self.meme_offsets = [0]
+        for meme in self.memes:
+            self.meme_offsets.append(
+                self.meme_offsets[-1] + (0 if meme is None else len(meme) + 1)
+            )
+
+    def memes_between(self, begin, end):
+        begin_offset = self.meme_offsets[begin]
+        end_offset = self.meme_offsets[end]
+        if end_offset <= begin_offset:
+            return ''
+        return self.joined_memes[begin_offset:end_offset - 1]
+
+_OPERATION_NOTE_PATTERN = re.compile(r'Operation\s*Note', re.IGNORECASE)
+
+def markdown_to_solr_fields(markdown, prefix='', ast=None):
+    if ast is None:
+        ast = parse_markdown(markdown)
+    visitor = MarkdownFieldsVisitor(prefix=prefix)
+    visitor.visit(ast)
+    r = visitor.to_fields()
 
     operation_note = _retrieve_markdown_content(
         ast,
-        re.compile(r'Operation\s*Note', re.IGNORECASE)
+        _OPERATION_NOTE_PATTERN,
+        get_text=visitor.get_text,
     )
     if operation_note is not None:
         r[f'{prefix}operation_note'] = operation_note
@@ -201,7 +355,8 @@ def markdown_to_solr_fields(markdown, prefix=''):
 
     return r
 
-def cell_to_solr_document(notebook_id, path, cell, cell_index, cells=None, notebook_attr=None):
+def cell_to_solr_document(notebook_id, path, cell, cell_index, cells=None, notebook_attr=None, analysis=None,
+                          output_limits=None):
     doc = {
         'id': notebook_id + f'_{cell_index}',
         'index': cell_index,
@@ -222,28 +377,15 @@ def cell_to_solr_document(notebook_id, path, cell, cell_index, cells=None, noteb
     if 'metadata' in cell and 'lc_cell_meme' in cell['metadata']:
         doc.update(_meme_to_solr_document(cell['metadata']['lc_cell_meme']))
     if cells is not None:
-        all_memes = [_get_current_meme(c) for c in cells]
-        all_heading_levels = [_get_markdown_heading_levels(c) for c in cells]
-        current_heading_level_ = all_heading_levels[cell_index]
-        if current_heading_level_ is None:
-            current_heading_level = None
-        else:
-            current_heading_level, _ = current_heading_level_
-        doc['lc_cell_memes__previous__in_notebook'] = ' '.join(
-            [meme for meme in all_memes[:cell_index] if meme is not None]
-        )
-        doc['lc_cell_memes__next__in_notebook'] = ' '.join(
-            [meme for meme in all_memes[cell_index + 1:] if meme is not None]
+        if analysis is None:
+            analysis = NotebookAnalysis(cells)
+        doc['lc_cell_memes__previous__in_notebook'] = analysis.memes_between(0, cell_index)
+        doc['lc_cell_memes__next__in_notebook'] = analysis.memes_between(cell_index + 1, len(cells))
+        doc['lc_cell_memes__previous__in_section'] = analysis.memes_between(
+            analysis.section_beginnings[cell_index], cell_index,
         )
-        doc['lc_cell_memes__previous__in_section'] = ' '.join(
-            [meme for meme in all_memes[_find_section_beginning(
-                all_heading_levels, cell_index, start_level=current_heading_level,
-            ):cell_index] if meme is not None]
-        )
-        doc['lc_cell_memes__next__in_section'] = ' '.join(
-            [meme for meme in all_memes[cell_index + 1:_find_section_ending(
-                all_heading_levels, cell_index
-            )] if meme is not None]
+        doc['lc_cell_memes__next__in_section'] = analysis.memes_between(
+            cell_index + 1, analysis.section_endings[cell_index],
         )
     if cell['cell_type'] == 'code' and 'source' in cell:
         code = ''.join(cell['source'])
@@ -253,7 +395,11 @@ def cell_to_solr_document(notebook_id, path, cell, cell_index, cells=None, noteb
         markdown = ''.join(cell['source'])
         doc['source__markdown'] = markdown
         doc['source'] = markdown
-        doc.update(markdown_to_solr_fields(markdown, prefix='source__markdown__'))
+        doc.update(markdown_to_solr_fields(
+            markdown,
+            prefix='source__markdown__',
+            ast=analysis.markdown_asts[cell_index] if analysis is not None else None,
+        ))
     doc['_text_'] = doc['source'] if 'source' in doc else ''
     if 'notebook_mtime' in doc or 'lc_cell_meme__execution_end_time' in doc:
         doc['estimated_mtime'] = doc['lc_cell_meme__execution_end_time'] if 'lc_cell_meme__execution_end_time' in doc else doc['notebook_mtime']
@@ -264,16 +410,29 @@ def cell_to_solr_document(notebook_id, path, cell, cell_index, cells=None, noteb
             if 'data' in output and 'text/plain' in output['data']:
                 doc['outputs__result_plain'] = ''.join(output['data']['text/plain'])
             if 'data' in output and 'text/html' in output['data']:
-                doc['outputs__result_html'] = ''.join(output['data']['text/html'])
+                result_html = ''.join(output['data']['text/html'])
+                if output_limits is not None and 0 < output_limits.html_max_chars < len(result_html):
+                    result_html = _html_to_text(result_html)
+                doc['outputs__result_html'] = result_html
             continue
         if 'name' not in output or output['name'] not in ['stdout', 'stderr']:
             continue
         doc['outputs__{}'.format(output['name'])] = ''.join(output['text'])
-    doc['outputs'] = ' '.join([doc[k] for k in sorted(doc.keys()) if k.split('_')[0] == 'outputs'])
+    output_keys = sorted([k for k in doc.keys() if k.split('_')[0] == 'outputs'])
+    truncated = []
+    if output_limits is not None:
+        # The outputs field repeats the others, so they share a half of the limit
+        truncated = _truncate_fields(
+            doc, output_keys, output_limits.field_max_chars, output_limits.document_max_chars // 2,
+        )
+    doc['outputs'] = ' '.join([doc[k] for k in output_keys])
+    if len(truncated) > 0:
+        doc['truncated_outputs'] = truncated
     doc['_text_'] += '\n' + doc['outputs']
     return doc
 
-def notebook_to_solr_document(path, notebook_data, attr=None, user_pattern=None):
+def notebook_to_solr_document(path, notebook_data, attr=None, user_pattern=None, analysis=None, cell_docs=None,
+                              output_limits=None):
     notebook_id = notebook_to_notebook_id(path, notebook_data)
     _, filename = os.path.split(path)
     doc = {
@@ -285,25 +444,46 @@ def notebook_to_solr_document(path, notebook_data, attr=None, user_pattern=None)
     memes = []
     if 'cells' not in notebook_data:
         return doc
+    if cell_docs is None:
+        if analysis is None:
+            analysis = NotebookAnalysis(notebook_data['cells'])
+        cell_docs = [cell_to_solr_document(notebook_id, path, cell, i, analysis=analysis, output_limits=output_limits)
+                     for i, cell in enumerate(notebook_data['cells'])]
     execution_end_times = []
-    doc['source'] = ''
-    doc['outputs'] = ''
-    for i, cell in enumerate(notebook_data['cells']):
+    # The texts of the cells are collected per field and joined once
+    values = {
+        'source': [],
+        'outputs': [],
+    }
+    for cell, fields in zip(notebook_data['cells'], cell_docs):
         if 'metadata' in cell and 'lc_cell_meme' in cell['metadata'] and 'current' in cell['metadata']['lc_cell_meme']:
             memes.append(cell['metadata']['lc_cell_meme']['current'])
-        fields = cell_to_solr_document(notebook_id, path, cell, i)
         for k, v in fields.items():
             if k == 'lc_cell_meme__execution_end_time':
                 execution_end_times.append(v)
                 continue
             if k.split('_')[0] not in ['outputs', 'source']:
                 continue
-            _add_field(doc, k, v)
+            values.setdefault(k, []).append(v)
+    doc.update([(k, _join_field(v)) for k, v in values.items()])
+    truncated = set()
+    for fields in cell_docs:
+        truncated.update(fields.get('truncated_outputs', []))
+    if output_limits is not None:
+        # The outputs field and the others each take a half of the limit
+        max_chars = output_limits.document_max_chars // 2
+        output_keys = [k for k in values.keys() if k.split('_')[0] == 'outputs' and k != 'outputs']
+        truncated.update(_truncate_fields(doc, output_keys, 0, max_chars))
+        doc['outputs'], is_truncated = _truncate_text(doc['outputs'], max_chars)
+        if is_truncated:
+            truncated.add('outputs')
+    if len(truncated) > 0:
+        doc['truncated_outputs'] = sorted(truncated)
     doc['lc_cell_memes'] = ' '.join(memes)
     if len(execution_end_times) > 0:
         doc['lc_cell_meme__execution_end_time'] = sorted(execution_end_times)[-1]
-    doc['_text_'] = doc['filename'] + '\n' + doc['source'] + '\n' + doc['outputs']
-    if 'source__markdown__heading' in doc:
+    doc['_text_'] = '\n'.join([doc['filename'], doc['source'], doc['outputs']])
+    if 'source__markdown__heading' in values:
         doc['source__markdown__heading_count'] = str(len(doc['source__markdown__heading'].split('\n')))
     else:
         doc['source__markdown__heading_count'] = '0'
@@ -329,20 +509,31 @@ def _get_notebook_attr(notebook_data, base_attr=None):
         attr['server'] = attr['signature_server_url']
     return attr
 
-def ipynb_to_documents(path, notebook_data, attr=None, user_pattern=None):
+def ipynb_to_documents(path, notebook_data, attr=None, user_pattern=None, output_limits=None):
     notebook_attr = _get_notebook_attr(notebook_data, base_attr=attr)
-    notebook_docs = notebook_to_solr_document(path, notebook_data, attr=notebook_attr, user_pattern=user_pattern)
     notebook_id = notebook_to_notebook_id(path, notebook_data)
     if 'cells' not in notebook_data:
+        notebook_docs = notebook_to_solr_document(
+            path, notebook_data, attr=notebook_attr, user_pattern=user_pattern,
+        )
         return {
             'jupyter-notebook': [notebook_docs],
         }
+    analysis = NotebookAnalysis(notebook_data['cells'])
     cell_docs = [cell_to_solr_document(
                     notebook_id, path, cell, cell_index,
                     cells=notebook_data['cells'],
-                    notebook_attr=notebook_attr
+                    notebook_attr=notebook_attr,
+                    analysis=analysis,
+                    output_limits=output_limits,
                  )
                  for cell_index, cell in enumerate(notebook_data['cells'])]
+    # The notebook document aggregates only the source and outputs fields of the cells,
+    # which do not depend on the notebook attributes
+    notebook_docs = notebook_to_solr_document(
+        path, notebook_data, attr=notebook_attr, user_pattern=user_pattern,
+        analysis=analysis, cell_docs=cell_docs, output_limits=output_limits,
+    )
     return {
         'jupyter-cell': cell_docs,
         'jupyter-notebook': [notebook_docs],
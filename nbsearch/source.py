@@ -1,13 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from fnmatch import fnmatch
 import json
 import os
 import re
 
 import pytz
-from traitlets import Unicode
+from traitlets import Unicode, Int
 from traitlets.config import LoggingConfigurable
 
+from .ignore import IgnoreMatcher, load_rules
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Output data used for the index, the others such as images are not needed to index notebooks
+INDEXED_MIME_TYPES = ['text/plain', 'text/html']
+
+# Large reads keep the parser from growing long strings such as base64 images in small steps
+_PARSE_BUFFER_SIZE = 1024 * 1024
+
 
 def get_source(name, config):
     if name == 'local':
@@ -15,9 +28,60 @@ def get_source(name, config):
     else:
         raise KeyError('Unknown source: {}'.format(name))
 
-def _listdir(path):
+def _is_unindexed(prefix, key):
+    if prefix == 'cells.item.outputs.item.data':
+        return key not in INDEXED_MIME_TYPES
+    if prefix == 'cells.item':
+        return key == 'attachments'
+    return prefix == 'metadata' and key == 'widgets'
+
+def _strip_unindexed(notebook):
+    notebook.get('metadata', {}).pop('widgets', None)
+    for cell in notebook.get('cells', []):
+        cell.pop('attachments', None)
+        for output in cell.get('outputs', []):
+            if 'data' in output:
+                output['data'] = dict([(k, v) for k, v in output['data'].items() if k in INDEXED_MIME_TYPES])
+    return notebook
+
+def load_notebook(f, indexed_only=False):
+    """Load a notebook from a binary file
+
+    With indexed_only, the values which are not indexed, such as images in
+    outputs, attachments and widget states, are dropped. If ijson is
+    installed, they are skipped while the file is parsed incrementally, so
+    that the memory usage depends on the indexed text rather than the size
+    of the file.
+    """
+    if not indexed_only or ijson is None:
+        notebook = json.load(f)
+        return _strip_unindexed(notebook) if indexed_only else notebook
+    builder = ijson.ObjectBuilder()
+    # Number of containers opened in the value being skipped
+    skipping = 0
+    skip_value = False
+    for prefix, event, value in ijson.parse(f, buf_size=_PARSE_BUFFER_SIZE, use_float=True):
+        if skip_value:
+            skip_value = False
+            if event in ('start_map', 'start_array'):
+                skipping = 1
+            continue
+        if skipping > 0:
+            if event in ('start_map', 'start_array'):
+                skipping += 1
+            elif event in ('end_map', 'end_array'):
+                skipping -= 1
+            continue
+        if event == 'map_key' and _is_unindexed(prefix, value):
+            skip_value = True
+            continue
+        builder.event(event, value)
+    return builder.value
+
+def _scandir(path):
     try:
-        return os.listdir(path)
+        with os.scandir(path) as it:
+            return list(it)
     except PermissionError:
         return []
 
@@ -33,6 +97,18 @@ class Source(LoggingConfigurable):
     def get_notebook(self, server, path):
         raise NotImplementedError()
 
+    def open_notebook(self, server, path):
+        raise NotImplementedError()
+
+    def get_file(self, path):
+        raise NotImplementedError()
+
+    def relpath(self, path):
+        raise NotImplementedError()
+
+    def is_ignored(self, path):
+        raise NotImplementedError()
+
     def prepare(self):
         pass
 
@@ -50,61 +126,143 @@ class LocalSource(Source):
 
     owner_pattern = Unicode(help='The regex pattern for owner').tag(config=True)
 
+    crawl_workers = Int(1, help='The number of threads which traverse directories in parallel').tag(config=True)
+
     def __init__(self, **kwargs):
         super(LocalSource, self).__init__(**kwargs)
 
     def get_files(self):
+        if self.crawl_workers > 1:
+            return self._get_files_parallel()
         return self._get_files(self.base_dir, '')
 
-    def get_notebook(self, server, path):
+    def get_notebook(self, server, path, indexed_only=False):
         if self.server != server:
             return None
-        with open(os.path.join(self.base_dir, path), 'r') as f:
-            return json.load(f)
+        with open(os.path.join(self.base_dir, path), 'rb') as f:
+            return load_notebook(f, indexed_only=indexed_only)
 
-    def _get_files(self, actual_base_dir, db_base_dir, check_ignore_base=None):
-        ignore_file = os.path.join(actual_base_dir, '.nbsearchignore')
-        _check_ignore = None
-        if os.path.exists(ignore_file):
-            with open(ignore_file, 'r') as f:
-                ignore_patterns = [l.strip() for l in f.readlines()
-                                   if not l.strip().startswith('#')]
-            db_base_offset = 0 if len(db_base_dir) == 0 else len(db_base_dir) + 1
-            _check_ignore = lambda path: any([fnmatch(path[db_base_offset:], p) or
-                                              fnmatch(os.path.split(path)[-1], p)
-                                              for p in ignore_patterns])
-        check_ignore = _check_ignore
-        if check_ignore_base is not None:
-            if _check_ignore is not None:
-                check_ignore = lambda path: check_ignore_base(path) or _check_ignore(path)
-            else:
-                check_ignore = check_ignore_base
-        for name in _listdir(actual_base_dir):
+    def open_notebook(self, server, path):
+        """Open the notebook as a binary file, or return None if it is not on this server"""
+        if self.server != server:
+            return None
+        return open(os.path.join(self.base_dir, path), 'rb')
+
+    def get_file(self, path):
+        """Get the file of the notebook at the path, or None if it does not exist"""
+        actual_path = os.path.join(self.base_dir, path)
+        if not os.path.isfile(actual_path):
+            return None
+        return self._to_file(actual_path, path)
+
+    def relpath(self, path):
+        """Convert an absolute path or a path relative to base_dir into the path of the notebook on this source"""
+        base_dir = os.path.abspath(self.base_dir)
+        path = os.path.normpath(os.path.join(base_dir, path))
+        relpath = os.path.relpath(path, base_dir)
+        if relpath == os.curdir or relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            raise ValueError('Not a notebook in {}: {}'.format(self.base_dir, path))
+        return relpath
+
+    def is_ignored(self, path):
+        """Check whether the path is excluded from the index as hidden or by .nbsearchignore"""
+        actual_base_dir = self.base_dir
+        db_base_dir = ''
+        matcher = None
+        names = path.split(os.sep)
+        for i, name in enumerate(names):
+            matcher = self._load_ignore(actual_base_dir, db_base_dir, matcher)
+            db_path = os.path.join(db_base_dir, name)
             actual_path = os.path.join(actual_base_dir, name)
+            if name.startswith('.'):
+                return True
+            is_dir = i < len(names) - 1 or os.path.isdir(actual_path)
+            if matcher is not None and matcher.is_ignored(db_path, is_dir):
+                return True
+            actual_base_dir = actual_path
+            db_base_dir = db_path
+        return False
+
+    def _load_ignore(self, actual_base_dir, db_base_dir, parent_matcher=None, has_ignore_file=None):
+        ignore_file = os.path.join(actual_base_dir, '.nbsearchignore')
+        if has_ignore_file is None:
+            has_ignore_file = os.path.exists(ignore_file)
+        if not has_ignore_file:
+            return parent_matcher
+        rules = load_rules(ignore_file)
+        if len(rules) == 0:
+            return parent_matcher
+        return IgnoreMatcher(rules, db_base_dir, parent_matcher)
+
+    def _get_files(self, actual_base_dir, db_base_dir, matcher=None):
+        files, directories = self._scan_directory(actual_base_dir, db_base_dir, matcher)
+        for file in files:
+            yield file
+        for directory in directories:
+            for file in self._get_files(*directory):
+                yield file
+
+    def _get_files_parallel(self):
+        with ThreadPoolExecutor(max_workers=self.crawl_workers) as executor:
+            pending = set([executor.submit(self._scan_directory, self.base_dir, '')])
+            try:
+                while len(pending) > 0:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        files, directories = future.result()
+                        for directory in directories:
+                            pending.add(executor.submit(self._scan_directory, *directory))
+                        for file in files:
+                            yield file
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _scan_directory(self, actual_base_dir, db_base_dir, parent_matcher=None):
+        """List the notebooks and the subdirectories to be crawled in the directory
+
+        The type and the stat of each entry are taken from the cached
+        results of os.scandir to reduce system calls. Ignored directories
+        are pruned without being listed.
+        """
+        entries = _scandir(actual_base_dir)
+        has_ignore_file = any([entry.name == '.nbsearchignore' for entry in entries])
+        matcher = self._load_ignore(actual_base_dir, db_base_dir, parent_matcher, has_ignore_file)
+        files = []
+        directories = []
+        for entry in entries:
+            name = entry.name
+            actual_path = entry.path
             db_path = os.path.join(db_base_dir, name)
             if name.startswith('.'):
                 self.log.debug('ignore hidden file: {}'.format(actual_path))
                 continue
-            if check_ignore is not None and check_ignore(db_path):
+            is_dir = entry.is_dir()
+            if matcher is not None and matcher.is_ignored(db_path, is_dir):
                 self.log.debug('ignore file: {}'.format(actual_path))
                 continue
-            if os.path.isdir(actual_path):
-                for n in self._get_files(actual_path, db_path, check_ignore):
-                    yield n
-            elif os.path.isfile(actual_path):
+            if is_dir:
+                directories.append((actual_path, db_path, matcher))
+            elif entry.is_file():
                 if name.lower().endswith('.ipynb'):
-                    stat = os.stat(actual_path)
-                    yield {
-                        'server': self.server,
-                        'path': db_path,
-                        'owner': self._get_owner(actual_path),
-                        'mtime': datetime.fromtimestamp(stat.st_mtime).astimezone(pytz.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
-                        'atime': datetime.fromtimestamp(stat.st_atime).astimezone(pytz.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
-                        'ctime': datetime.fromtimestamp(stat.st_ctime).astimezone(pytz.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
-                    }
+                    files.append(self._to_file(actual_path, db_path, entry.stat()))
                 else:
                     self.log.debug('ignore file that are not ipynb: {}'.format(actual_path))
-                    continue
+        return files, directories
+
+    def _to_file(self, actual_path, db_path, stat=None):
+        if stat is None:
+            stat = os.stat(actual_path)
+        return {
+            'server': self.server,
+            'path': db_path,
+            'owner': self._get_owner(actual_path),
+            'mtime': datetime.fromtimestamp(stat.st_mtime).astimezone(pytz.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
+            'atime': datetime.fromtimestamp(stat.st_atime).astimezone(pytz.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
+            'ctime': datetime.fromtimestamp(stat.st_ctime).astimezone(pytz.utc).isoformat(timespec='seconds').replace('+00:00', 'Z'),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+        }
 
     def _get_owner(self, path):
         if self.owner is not None and len(self.owner) > 0:
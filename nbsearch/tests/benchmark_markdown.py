@@ -0,0 +1,55 @@
+"""Microbenchmark of the markdown field extraction
+
+    python -m nbsearch.tests.benchmark_markdown [--repeat N]
+
+Compares parsing markdown into mistletoe tokens with rendering the JSON AST
+by ASTRenderer and loading it again, which the extraction used before.
+"""
+import argparse
+import json
+import os
+import timeit
+
+import mistletoe
+from mistletoe.ast_renderer import ASTRenderer
+
+from nbsearch.solr import markdown_to_solr_fields, parse_markdown
+
+
+def _load_samples():
+    with open(os.path.join(os.path.dirname(__file__), 'data', 'markdown_fields.json')) as f:
+        return [sample['markdown'] for sample in json.load(f)]
+
+
+def _json_ast(markdown):
+    return json.loads(mistletoe.markdown(markdown, ASTRenderer))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the markdown field extraction')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    samples = _load_samples()
+    cells = {
+        'small cells': samples,
+        'large cell': ['\n\n'.join(samples) * 50],
+    }
+    for name, markdowns in cells.items():
+        size = sum([len(markdown) for markdown in markdowns])
+        print(f'{name} ({len(markdowns)} cells, {size} chars)')
+        for label, func in [
+            ('json ast', _json_ast),
+            ('tokens', parse_markdown),
+            ('fields', lambda markdown: markdown_to_solr_fields(markdown, prefix='source__markdown__')),
+        ]:
+            elapsed = min(timeit.repeat(
+                lambda: [func(markdown) for markdown in markdowns],
+                number=1,
+                repeat=args.repeat,
+            ))
+            print(f'  {label:8s} {elapsed * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
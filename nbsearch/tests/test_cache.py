@@ -0,0 +1,59 @@
+from nbsearch.cache import SearchCache
+
+
+class _Clock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_search_cache():
+    cache = SearchCache(max_bytes=100, ttl=10)
+    assert cache.get('a', 1) is None
+    cache.put('a', 1, {'value': 'a'}, 10)
+    assert cache.get('a', 1) == {'value': 'a'}
+    # Results of another index version are invalidated
+    assert cache.get('a', 2) is None
+    assert cache.get('a', 1) is None
+    assert cache.stats() == {
+        'entries': 0,
+        'bytes': 0,
+        'max_bytes': 100,
+        'hits': 1,
+        'misses': 3,
+        'evictions': 0,
+        'invalidations': 1,
+    }
+
+def test_search_cache_ttl():
+    clock = _Clock()
+    cache = SearchCache(max_bytes=100, ttl=10, clock=clock)
+    cache.put('a', 1, {'value': 'a'}, 10)
+    clock.now = 10
+    assert cache.get('a', 1) == {'value': 'a'}
+    clock.now = 11
+    assert cache.get('a', 1) is None
+    assert cache.stats()['bytes'] == 0
+
+def test_search_cache_lru():
+    cache = SearchCache(max_bytes=100, ttl=10)
+    cache.put('a', 1, 'a', 40)
+    cache.put('b', 1, 'b', 40)
+    assert cache.get('a', 1) == 'a'
+    cache.put('c', 1, 'c', 40)
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) == 'a'
+    assert cache.get('c', 1) == 'c'
+    assert cache.stats()['bytes'] == 80
+    assert cache.stats()['evictions'] == 1
+    # Too large results are not cached
+    cache.put('d', 1, 'd', 101)
+    assert cache.get('d', 1) is None
+    assert cache.stats()['bytes'] == 80
+
+    cache.clear()
+    assert cache.get('a', 1) is None
+    assert cache.stats()['entries'] == 0
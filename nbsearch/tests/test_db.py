@@ -0,0 +1,284 @@
+import asyncio
+import io
+import json
+from unittest import mock
+from urllib.parse import parse_qs
+
+from botocore.exceptions import ClientError
+
+from nbsearch.db import NBSearchDB, SolrUpdateBuffer
+
+
+def _doc(id):
+    return {'id': id}
+
+def test_update_buffer_thresholds():
+    db = mock.Mock()
+    db._post_update = mock.AsyncMock()
+    db.commit = mock.AsyncMock()
+    flushed = []
+    buffer = SolrUpdateBuffer(
+        db, max_documents=3, max_bytes=1000,
+        on_flush=lambda core, succeeded, failed: flushed.append((core, succeeded, failed)),
+    )
+
+    async def run():
+        await buffer.add('jupyter-cell', [_doc('a_0'), _doc('a_1')], key='a')
+        assert db._post_update.call_count == 0
+        await buffer.add('jupyter-cell', [_doc('b_0')], key='b')
+        assert db._post_update.call_count == 1
+        await buffer.add('jupyter-notebook', [_doc('c' * 2000)], key='c')
+        assert db._post_update.call_count == 2
+        await buffer.add('jupyter-cell', [_doc('d_0')], key='d')
+        await buffer.close()
+    asyncio.run(run())
+
+    calls = db._post_update.call_args_list
+    assert calls[0][0][0] == 'jupyter-cell'
+    assert json.loads(calls[0][0][1]) == [_doc('a_0'), _doc('a_1'), _doc('b_0')]
+    assert calls[0][0][2] == {}
+    assert calls[1][0][0] == 'jupyter-notebook'
+    assert calls[2][0][0] == 'jupyter-cell'
+    assert json.loads(calls[2][0][1]) == [_doc('d_0')]
+    assert len(calls) == 3
+    assert sorted([c[0][0] for c in db.commit.call_args_list]) == ['jupyter-cell', 'jupyter-notebook']
+    assert flushed == [
+        ('jupyter-cell', ['a', 'b'], []),
+        ('jupyter-notebook', ['c'], []),
+        ('jupyter-cell', ['d'], []),
+    ]
+
+def test_update_buffer_commit_within():
+    db = mock.Mock()
+    db._post_update = mock.AsyncMock()
+    buffer = SolrUpdateBuffer(db, commit_within=10000)
+
+    async def run():
+        await buffer.add('jupyter-cell', [_doc('a_0')], key='a')
+        await buffer.close()
+    asyncio.run(run())
+
+    assert db._post_update.call_count == 1
+    assert db._post_update.call_args[0][2] == {'commitWithin': 10000}
+
+def test_update_buffer_failures():
+    async def post_update(core, body, params):
+        if 'broken' in body:
+            raise IOError('Bad Request')
+    db = mock.Mock()
+    db._post_update = mock.AsyncMock(side_effect=post_update)
+    flushed = []
+    buffer = SolrUpdateBuffer(
+        db, commit_within=10000,
+        on_flush=lambda core, succeeded, failed: flushed.append((core, succeeded, failed)),
+    )
+
+    async def run():
+        await buffer.add('jupyter-cell', [_doc('a_0')], key='a')
+        await buffer.add('jupyter-cell', [_doc('broken_0')], key='broken')
+        await buffer.add('jupyter-cell', [_doc('c_0')], key='c')
+        await buffer.close()
+    asyncio.run(run())
+
+    assert flushed == [('jupyter-cell', ['a', 'c'], ['broken'])]
+    assert buffer.failed_keys == set(['broken'])
+
+@mock.patch('nbsearch.db._ensured_buckets', new_callable=set)
+@mock.patch('nbsearch.db.aioboto3.Session')
+def test_s3_client_reuse(mock_session, mock_ensured_buckets):
+    s3 = mock.Mock()
+    s3.list_buckets = mock.AsyncMock(return_value={'Buckets': []})
+    s3.create_bucket = mock.AsyncMock()
+    s3.upload_fileobj = mock.AsyncMock()
+    s3.download_fileobj = mock.AsyncMock()
+    s3_context = mock_session.return_value.client.return_value
+    s3_context.__aenter__ = mock.AsyncMock(return_value=s3)
+    s3_context.__aexit__ = mock.AsyncMock()
+
+    db = NBSearchDB()
+    async def run():
+        await db.open()
+        await db.upload_fileobj('NOTEBOOK_1', io.BytesIO(b'{}'))
+        await db.upload_file('NOTEBOOK_2', {})
+        await db.download_file('NOTEBOOK_1', io.BytesIO())
+        await db.close()
+    asyncio.run(run())
+
+    assert mock_session.return_value.client.call_count == 1
+    assert s3.list_buckets.call_count == 1
+    s3.create_bucket.assert_awaited_once_with(Bucket='notebooks')
+    assert s3.upload_fileobj.call_count == 2
+    assert s3.download_fileobj.call_count == 1
+    s3_context.__aexit__.assert_awaited_once()
+
+@mock.patch('nbsearch.db.AsyncHTTPClient')
+def test_query_cache(mock_http_client):
+    versions = [1]
+
+    async def fetch(request, raise_error=True):
+        response = mock.Mock()
+        response.code = 200
+        if '/admin/luke?' in request.url:
+            response.body = json.dumps({'index': {'version': versions[0], 'numDocs': 10, 'maxDoc': 10}}).encode('utf8')
+        elif '/select?' in request.url:
+            response.body = json.dumps({'response': {'docs': [], 'numFound': 0, 'start': 0}}).encode('utf8')
+        else:
+            response.body = b'{}'
+        return response
+    mock_http_client.return_value.fetch = mock.AsyncMock(side_effect=fetch)
+
+    def selects():
+        return len([c for c in mock_http_client.return_value.fetch.call_args_list
+                    if '/select?' in c[0][0].url])
+
+    db = NBSearchDB()
+    db.search_cache_version_interval = 0
+    async def run():
+        await db.query('jupyter-cell', '_text_:*', start=0, rows=10, use_cache=True)
+        await db.query('jupyter-cell', '_text_:*', start=0, rows=10, use_cache=True)
+        assert selects() == 1
+        await db.query('jupyter-cell', '_text_:*', start=10, rows=10, use_cache=True)
+        await db.query('jupyter-notebook', '_text_:*', start=0, rows=10, use_cache=True)
+        await db.query('jupyter-cell', '_text_:*', start=0, rows=10)
+        assert selects() == 4
+        # The index has been updated by another process, e.g. with commitWithin
+        versions[0] = 2
+        await db.query('jupyter-cell', '_text_:*', start=0, rows=10, use_cache=True)
+        assert selects() == 5
+        await db.query('jupyter-cell', '_text_:*', start=0, rows=10, use_cache=True)
+        assert selects() == 5
+        # Committed by this process
+        await db.commit('jupyter-cell')
+        await db.query('jupyter-cell', '_text_:*', start=0, rows=10, use_cache=True)
+        assert selects() == 6
+    asyncio.run(run())
+    assert db.search_cache.stats()['hits'] == 2
+
+
+@mock.patch('nbsearch.db._ensured_buckets', new_callable=set)
+@mock.patch('nbsearch.db.aioboto3.Session')
+def test_s3_concurrent_uploads(mock_session, mock_ensured_buckets):
+    created = []
+
+    async def list_buckets():
+        await asyncio.sleep(0.01)
+        return {'Buckets': [{'Name': name} for name in created]}
+
+    async def create_bucket(Bucket):
+        if Bucket in created:
+            raise ClientError({'Error': {'Code': 'BucketAlreadyOwnedByYou'}}, 'CreateBucket')
+        created.append(Bucket)
+    s3 = mock.Mock()
+    s3.list_buckets = mock.AsyncMock(side_effect=list_buckets)
+    s3.create_bucket = mock.AsyncMock(side_effect=create_bucket)
+    s3.upload_fileobj = mock.AsyncMock()
+    s3_context = mock_session.return_value.client.return_value
+    s3_context.__aenter__ = mock.AsyncMock(return_value=s3)
+    s3_context.__aexit__ = mock.AsyncMock()
+
+    db = NBSearchDB()
+    async def run():
+        await db.open()
+        await asyncio.gather(*[
+            db.upload_fileobj(f'NOTEBOOK_{i}', io.BytesIO(b'{}'))
+            for i in range(5)
+        ])
+        await db.close()
+    asyncio.run(run())
+
+    s3.create_bucket.assert_awaited_once_with(Bucket='notebooks')
+    assert s3.upload_fileobj.call_count == 5
+
+def test_ensure_bucket_created_by_another_process():
+    s3 = mock.Mock()
+    s3.list_buckets = mock.AsyncMock(return_value={'Buckets': []})
+    s3.create_bucket = mock.AsyncMock(
+        side_effect=ClientError({'Error': {'Code': 'BucketAlreadyOwnedByYou'}}, 'CreateBucket'),
+    )
+
+    db = NBSearchDB()
+    with mock.patch('nbsearch.db._ensured_buckets', new_callable=set) as ensured_buckets:
+        asyncio.run(db._ensure_bucket(s3))
+        assert len(ensured_buckets) == 1
+
+def test_build_query_with_highlight():
+    db = NBSearchDB()
+    db.highlight_fragment_size = 80
+    params = parse_qs(db._build_query(
+        '_text_:numpy', fl=['id', 'index'], highlight=['source__code', 'outputs__stdout'],
+        highlight_snippets=5,
+    ))
+    assert params['fl'] == ['id,index']
+    assert params['hl'] == ['true']
+    assert params['hl.method'] == ['unified']
+    assert params['hl.fl'] == ['source__code,outputs__stdout']
+    assert params['hl.fragsize'] == ['80']
+    assert params['hl.snippets'] == ['5']
+    assert 'hl' not in parse_qs(db._build_query('_text_:numpy'))
+    # An explicit 0 highlights the whole value instead of taking the default
+    params = parse_qs(db._build_query(
+        '_text_:numpy', highlight=['source__code'], highlight_fragment_size=0,
+    ))
+    assert params['hl.fragsize'] == ['0']
+    assert params['hl.snippets'] == ['3']
+
+
+def test_build_query_with_cursor():
+    db = NBSearchDB()
+    params = parse_qs(db._build_query('_text_:*', start=100, rows=10, cursor_mark='*'))
+    assert params['cursorMark'] == ['*']
+    assert 'start' not in params
+    assert params['sort'] == ['score desc,id asc']
+    params = parse_qs(db._build_query('_text_:*', sort='mtime desc', cursor_mark='AoE'))
+    assert params['sort'] == ['mtime desc,id asc']
+    params = parse_qs(db._build_query('_text_:*', sort='id desc', cursor_mark='AoE'))
+    assert params['sort'] == ['id desc']
+    params = parse_qs(db._build_query('_text_:*', start=100, sort='mtime desc'))
+    assert params['start'] == ['100']
+    assert params['sort'] == ['mtime desc']
+
+
+def test_iter_query():
+    db = NBSearchDB()
+    results = [
+        {'response': {'docs': [{'id': 'a'}, {'id': 'b'}]}, 'nextCursorMark': 'c1'},
+        {'response': {'docs': [{'id': 'c'}]}, 'nextCursorMark': 'c2'},
+        {'response': {'docs': []}, 'nextCursorMark': 'c2'},
+    ]
+    db.query = mock.AsyncMock(side_effect=[('', r) for r in results])
+
+    async def run():
+        return [docs async for docs in db.iter_query('jupyter-cell', '_text_:*', fl=['id'], rows=2)]
+    pages = asyncio.run(run())
+    assert pages == [[{'id': 'a'}, {'id': 'b'}], [{'id': 'c'}]]
+    assert [c[1]['cursor_mark'] for c in db.query.call_args_list] == ['*', 'c1', 'c2']
+    assert all([c[1]['rows'] == 2 for c in db.query.call_args_list])
+
+
+def test_build_query_with_facets():
+    db = NBSearchDB()
+    facets = {'cell_type': {'type': 'terms', 'field': 'cell_type'}}
+    params = parse_qs(db._build_query('_text_:*', facets=facets))
+    assert json.loads(params['json.facet'][0]) == facets
+    assert 'json.facet' not in parse_qs(db._build_query('_text_:*'))
+
+
+def test_build_query_with_filter_queries():
+    db = NBSearchDB()
+    params = parse_qs(db._build_query('_text_:numpy', fq=['cell_type:code', 'notebook_owner:alice']))
+    assert params['q'] == ['_text_:numpy']
+    assert params['fq'] == ['cell_type:code', 'notebook_owner:alice']
+    assert 'fq' not in parse_qs(db._build_query('_text_:numpy', fq=[]))
+
+
+def test_delete_by_query_batches():
+    db = NBSearchDB()
+    db.solr_delete_batch_queries = 2
+    db._post_update = mock.AsyncMock()
+    asyncio.run(db.delete_by_query('jupyter-cell', ['a:1', 'b:2', 'c:3']))
+    bodies = [json.loads(c[0][1]) for c in db._post_update.call_args_list]
+    assert bodies == [
+        {'delete': {'query': '(a:1) OR (b:2)'}},
+        {'delete': {'query': '(c:3)'}},
+    ]
+    assert all([c[0][2] == {} for c in db._post_update.call_args_list])
@@ -10,18 +10,37 @@ import tornado.testing
 import tornado.web
 from unittest import mock
 import nbsearch.server
-from nbsearch.v1.handlers import SearchHandler, ImportHandler, DataHandler
+import nbsearch.v1.handlers
+from nbsearch.v1.handlers import SearchHandler, ExportHandler, ReindexHandler, ImportHandler, DataHandler
 
 collection_name = 'test_notebooks'
 history_name = 'test_history'
 
 
+async def _stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
 # Test handlers without authentication
 class TestableSearchHandler(SearchHandler):
     def get_current_user(self):
         return "test_user"
 
 
+class TestableExportHandler(ExportHandler):
+    def get_current_user(self):
+        return "test_user"
+
+
+class TestableReindexHandler(ReindexHandler):
+    def get_current_user(self):
+        return "test_user"
+
+    def check_xsrf_cookie(self):
+        pass
+
+
 class TestableImportHandler(ImportHandler):
     def get_current_user(self):
         return "test_user"
@@ -41,6 +60,9 @@ class ApiHandlerTestCaseBase(tornado.testing.AsyncHTTPTestCase):
             'NBSearchDB',
         )
         self.mock_nbsearchdb = self.nbsearchdb_patcher.start()
+        self.mock_indexer = mock.Mock()
+        self.mock_indexer.reindex_source = 'local'
+        self.mock_indexer.update_notebooks = mock.AsyncMock()
         super().setUp()
 
     def tearDown(self):
@@ -52,9 +74,13 @@ class ApiHandlerTestCaseBase(tornado.testing.AsyncHTTPTestCase):
         handler_settings = {}
         handler_settings['db'] = self.mock_nbsearchdb()
         handler_settings['base_dir'] = self.base_dir
+        reindex_settings = dict(handler_settings)
+        reindex_settings['indexer'] = self.mock_indexer
 
         handlers = [
             (r"/v1/(?P<target>[^\/]+)/search", TestableSearchHandler, handler_settings),
+            (r"/v1/(?P<target>[^\/]+)/export", TestableExportHandler, handler_settings),
+            (r"/v1/reindex", TestableReindexHandler, reindex_settings),
             (r"/v1/import(?P<path>/.+)?/(?P<id>[^\/]+)", TestableImportHandler, handler_settings),
             (r"/v1/data/(?P<id>[^\/]+)", TestableDataHandler, handler_settings),
         ]
@@ -137,6 +163,262 @@ class TestSearchHandler(ApiHandlerTestCaseBase):
         self.assertEqual(mock_query.call_args[0][0], 'jupyter-notebook')
         self.assertEqual(mock_query.call_args[0][1], '_text_:*')
 
+    def test_cell_search_with_fields(self):
+        result = {
+            'response': {
+                'docs': [
+                    {'id': 'cell-1', 'notebook_id': 'notebook-1'},
+                ],
+                'numFound': 1,
+                'start': 0,
+            },
+        }
+        mock_query = mock.AsyncMock(return_value=('_text_:*', result))
+        self.mock_nbsearchdb().query.side_effect = mock_query
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:*') +
+                              '&fl=' + quote('id, notebook_id'))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf8'))['cells'], [
+            {'id': 'cell-1', 'notebook_id': 'notebook-1'},
+        ])
+        self.assertEqual(mock_query.call_args[1]['fl'], ['id', 'notebook_id'])
+
+    def test_cell_search_summary(self):
+        result = {
+            'response': {
+                'docs': [
+                    {
+                        'id': 'cell-1',
+                        'notebook_id': 'notebook-1',
+                        'index': 0,
+                        'cell_type': 'code',
+                        'source__code': 'x' * 300,
+                    },
+                    {
+                        'id': 'cell-2',
+                        'notebook_id': 'notebook-1',
+                        'index': 1,
+                        'cell_type': 'markdown',
+                        'source__markdown': '# Title',
+                    },
+                ],
+                'numFound': 2,
+                'start': 0,
+            },
+        }
+        mock_query = mock.AsyncMock(return_value=('_text_:*', result))
+        self.mock_nbsearchdb().query.side_effect = mock_query
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:*') +
+                              '&mode=summary')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf8'))['cells'], [
+            {
+                'id': 'cell-1',
+                'notebook_id': 'notebook-1',
+                'index': 0,
+                'cell_type': 'code',
+                'snippet': 'x' * 200 + '...',
+            },
+            {
+                'id': 'cell-2',
+                'notebook_id': 'notebook-1',
+                'index': 1,
+                'cell_type': 'markdown',
+                'snippet': '# Title',
+            },
+        ])
+        self.assertEqual(mock_query.call_args[1]['fl'],
+                         ['id', 'notebook_id', 'index', 'cell_type',
+                          'source__markdown', 'source__code'])
+
+    def test_cell_search_highlight(self):
+        result = {
+            'response': {
+                'docs': [
+                    {'id': 'cell-1'},
+                    {'id': 'cell-2'},
+                ],
+                'numFound': 2,
+                'start': 0,
+            },
+            'highlighting': {
+                'cell-1': {'source__code': ['import <em>numpy</em>']},
+            },
+        }
+        mock_query = mock.AsyncMock(return_value=('_text_:numpy', result))
+        self.mock_nbsearchdb().query.side_effect = mock_query
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:numpy') +
+                              '&fl=index&highlight=true&hl_fragsize=50')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf8'))['cells'], [
+            {'id': 'cell-1', 'highlights': {'source__code': ['import <em>numpy</em>']}},
+            {'id': 'cell-2', 'highlights': {}},
+        ])
+        kwargs = mock_query.call_args[1]
+        self.assertEqual(kwargs['fl'], ['index', 'id'])
+        self.assertIn('outputs__stdout', kwargs['highlight'])
+        self.assertEqual(kwargs['highlight_fragment_size'], 50)
+        self.assertIsNone(kwargs['highlight_snippets'])
+
+    def test_cell_search_with_cursor(self):
+        result = {
+            'response': {
+                'docs': [{'id': 'cell-1'}],
+                'numFound': 100,
+                'start': 0,
+            },
+            'nextCursorMark': 'AoE_next',
+        }
+        mock_query = mock.AsyncMock(return_value=('_text_:*', result))
+        self.mock_nbsearchdb().query.side_effect = mock_query
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:*') +
+                              '&limit=1&cursor=' + quote('*'))
+        self.assertEqual(response.code, 200)
+        resp = json.loads(response.body.decode('utf8'))
+        self.assertEqual(resp['cells'], [{'id': 'cell-1'}])
+        self.assertEqual(resp['cursor'], '*')
+        self.assertEqual(resp['nextCursor'], 'AoE_next')
+        self.assertEqual(mock_query.call_args[1]['cursor_mark'], '*')
+        self.assertEqual(mock_query.call_args[1]['rows'], 1)
+
+    def test_cell_search_with_facets(self):
+        result = {
+            'response': {
+                'docs': [],
+                'numFound': 3,
+                'start': 0,
+            },
+            'facets': {
+                'count': 3,
+                'cell_type': {
+                    'buckets': [
+                        {'val': 'code', 'count': 2},
+                        {'val': 'markdown', 'count': 1},
+                    ],
+                },
+                'estimated_mtime': {
+                    'buckets': [
+                        {'val': '2024-01-01T00:00:00Z', 'count': 3},
+                    ],
+                },
+            },
+        }
+        mock_query = mock.AsyncMock(return_value=('_text_:*', result))
+        self.mock_nbsearchdb().query.side_effect = mock_query
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:*') +
+                              '&facet=' + quote('cell_type,owner,estimated_mtime') +
+                              '&facet_limit=5&facet_date_gap=' + quote('+1DAY'))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body.decode('utf8'))['facets'], {
+            'cell_type': [
+                {'value': 'code', 'count': 2},
+                {'value': 'markdown', 'count': 1},
+            ],
+            'owner': [],
+            'estimated_mtime': [
+                {'value': '2024-01-01T00:00:00Z', 'count': 3},
+            ],
+        })
+        facets = mock_query.call_args[1]['facets']
+        self.assertEqual(facets['cell_type'], {
+            'type': 'terms',
+            'field': 'cell_type',
+            'limit': 5,
+            'mincount': 1,
+        })
+        self.assertEqual(facets['owner']['field'], 'notebook_owner__facet')
+        self.assertEqual(facets['estimated_mtime']['type'], 'range')
+        self.assertEqual(facets['estimated_mtime']['gap'], '+1DAY')
+
+    def test_search_unknown_facet(self):
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:*') +
+                              '&facet=unknown')
+        self.assertEqual(response.code, 400)
+
+    def test_cell_search_with_filter_queries(self):
+        result = {
+            'response': {
+                'docs': [],
+                'numFound': 0,
+                'start': 0,
+            },
+        }
+        mock_query = mock.AsyncMock(return_value=('_text_:numpy', result))
+        self.mock_nbsearchdb().query.side_effect = mock_query
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:numpy') +
+                              '&fq=' + quote('cell_type:code') +
+                              '&fq=' + quote('notebook_owner:alice'))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(mock_query.call_args[0][1], '_text_:numpy')
+        self.assertEqual(mock_query.call_args[1]['fq'],
+                         ['cell_type:code', 'notebook_owner:alice'])
+
+    def test_search_unknown_mode(self):
+        response = self.fetch('/v1/cell/search?query=' + quote('_text_:*') +
+                              '&mode=unknown')
+        self.assertEqual(response.code, 400)
+
+
+class TestExportHandler(ApiHandlerTestCaseBase):
+
+    def test_export(self):
+        pages = [
+            [{'id': 'cell-1'}, {'id': 'cell-2'}],
+            [{'id': 'cell-3'}],
+        ]
+        iter_query = mock.Mock(return_value=_stream(pages))
+        self.mock_nbsearchdb().iter_query = iter_query
+        response = self.fetch('/v1/cell/export?query=' + quote('source__code:numpy') +
+                              '&fl=' + quote('id,notebook_id'))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/x-ndjson')
+        lines = response.body.decode('utf8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'id': 'cell-1'},
+            {'id': 'cell-2'},
+            {'id': 'cell-3'},
+        ])
+        self.assertEqual(iter_query.call_args[0], ('jupyter-cell', 'source__code:numpy'))
+        self.assertEqual(iter_query.call_args[1]['fl'], ['id', 'notebook_id'])
+
+    def test_export_empty(self):
+        self.mock_nbsearchdb().iter_query = mock.Mock(return_value=_stream([]))
+        response = self.fetch('/v1/notebook/export?query=' + quote('_text_:nothing'))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'')
+
+    def test_export_unknown_target(self):
+        response = self.fetch('/v1/unknown/export?query=' + quote('_text_:*'))
+        self.assertEqual(response.code, 400)
+
+
+class TestReindexHandler(ApiHandlerTestCaseBase):
+
+    def test_reindex(self):
+        counts = {'updated': 2, 'skipped': 0, 'removed': 0, 'deleted': 0}
+        self.mock_indexer.update_notebooks.return_value = counts
+        response = self.fetch('/v1/reindex', method='POST', body=json.dumps({
+            'paths': ['/work/test.ipynb'],
+        }))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), counts)
+        args, kwargs = self.mock_indexer.update_notebooks.call_args
+        self.assertEqual(args, ('local', [os.path.join(self.base_dir, 'work', 'test.ipynb')]))
+        self.assertIs(kwargs['db'], self.mock_nbsearchdb())
+        self.assertFalse(kwargs['use_processes'])
+
+    def test_reindex_without_paths(self):
+        response = self.fetch('/v1/reindex', method='POST', body=json.dumps({}))
+        self.assertEqual(response.code, 400)
+        self.mock_indexer.update_notebooks.assert_not_awaited()
+
+    def test_reindex_outside_source(self):
+        self.mock_indexer.update_notebooks.side_effect = ValueError('Not a notebook')
+        response = self.fetch('/v1/reindex', method='POST', body=json.dumps({
+            'paths': ['../test.ipynb'],
+        }))
+        self.assertEqual(response.code, 400)
+
 
 class TestImportHandler(ApiHandlerTestCaseBase):
 
@@ -160,9 +442,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
             },
         }
         mock_query = mock.AsyncMock(return_value=(None, result))
-        mock_download_file = mock.AsyncMock()
+        mock_stream_file = mock.Mock(side_effect=lambda file_id, progress=None: _stream([b'{}']))
         self.mock_nbsearchdb().query.side_effect = mock_query
-        self.mock_nbsearchdb().download_file.side_effect = mock_download_file
+        self.mock_nbsearchdb().stream_file = mock_stream_file
 
         dest_path = 'dest'
         dest_full_path = os.path.join(self.base_dir, dest_path)
@@ -174,11 +456,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
         self.assertEqual(mock_query.call_count, 1)
         self.assertEqual(mock_query.call_args[0][0], 'jupyter-notebook')
         self.assertEqual(mock_query.call_args[0][1], 'id:"0123456789ab0123456789ab"')
-        self.assertEqual(mock_download_file.call_count, 1)
-        self.assertEqual(mock_download_file.call_args[0][0], self.notebook_file_id)
-        self.assertIsInstance(mock_download_file.call_args[0][1], io.BufferedIOBase)
-        self.assertEqual(mock_download_file.call_args[0][1].name,
-                         os.path.join(dest_full_path, self.notebook_filename))
+        self.assertEqual(mock_stream_file.call_count, 1)
+        self.assertEqual(mock_stream_file.call_args[0][0], self.notebook_file_id)
+        self.assertTrue(os.path.exists(os.path.join(dest_full_path, self.notebook_filename)))
         mock_chmod.assert_not_called()
 
     @mock.patch('nbsearch.v1.handlers.os.chmod')
@@ -196,9 +476,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
             },
         }
         mock_query = mock.AsyncMock(return_value=(None, result))
-        mock_download_file = mock.AsyncMock()
+        mock_stream_file = mock.Mock(side_effect=lambda file_id, progress=None: _stream([b'{}']))
         self.mock_nbsearchdb().query.side_effect = mock_query
-        self.mock_nbsearchdb().download_file.side_effect = mock_download_file
+        self.mock_nbsearchdb().stream_file = mock_stream_file
 
         dest_path = 'nbsearch-tmp'
         dest_full_path = os.path.join(self.base_dir, dest_path)
@@ -210,11 +490,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
         self.assertEqual(mock_query.call_count, 1)
         self.assertEqual(mock_query.call_args[0][0], 'jupyter-notebook')
         self.assertEqual(mock_query.call_args[0][1], 'id:"0123456789ab0123456789ab"')
-        self.assertEqual(mock_download_file.call_count, 1)
-        self.assertEqual(mock_download_file.call_args[0][0], self.notebook_file_id)
-        self.assertIsInstance(mock_download_file.call_args[0][1], io.BufferedIOBase)
-        self.assertEqual(mock_download_file.call_args[0][1].name,
-                         os.path.join(dest_full_path, self.notebook_filename))
+        self.assertEqual(mock_stream_file.call_count, 1)
+        self.assertEqual(mock_stream_file.call_args[0][0], self.notebook_file_id)
+        self.assertTrue(os.path.exists(os.path.join(dest_full_path, self.notebook_filename)))
         mock_chmod.assert_called_once()
         self.assertTrue(mock_chmod.call_args[0][0].endswith('/' + self.notebook_filename))
         self.assertEqual(mock_chmod.call_args[0][1], S_IREAD)
@@ -243,9 +521,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
         }
         for dest_notebook_filename in dest_notebook_filenames:
             mock_query = mock.AsyncMock(return_value=(None, result))
-            mock_download_file = mock.AsyncMock()
+            mock_stream_file = mock.Mock(side_effect=lambda file_id, progress=None: _stream([b'{}']))
             self.mock_nbsearchdb().query.side_effect = mock_query
-            self.mock_nbsearchdb().download_file.side_effect = mock_download_file
+            self.mock_nbsearchdb().stream_file = mock_stream_file
 
             response = self.fetch('/v1/import/{}/{}'.format(dest_path, self.notebook_file_id))
             self.assertEqual(response.code, 200)
@@ -253,9 +531,8 @@ class TestImportHandler(ApiHandlerTestCaseBase):
             self.assertEqual(mock_query.call_count, 1)
             self.assertEqual(mock_query.call_args[0][0], 'jupyter-notebook')
             self.assertEqual(mock_query.call_args[0][1], 'id:"0123456789ab0123456789ab"')
-            self.assertEqual(mock_download_file.call_count, 1)
-            self.assertEqual(mock_download_file.call_args[0][1].name,
-                             os.path.join(dest_full_path, dest_notebook_filename))
+            self.assertEqual(mock_stream_file.call_count, 1)
+            self.assertTrue(os.path.exists(os.path.join(dest_full_path, dest_notebook_filename)))
 
     def test_import_to_nested_path(self):
         dummy_doc = {
@@ -271,9 +548,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
             },
         }
         mock_query = mock.AsyncMock(return_value=(None, result))
-        mock_download_file = mock.AsyncMock()
+        mock_stream_file = mock.Mock(side_effect=lambda file_id, progress=None: _stream([b'{}']))
         self.mock_nbsearchdb().query.side_effect = mock_query
-        self.mock_nbsearchdb().download_file.side_effect = mock_download_file
+        self.mock_nbsearchdb().stream_file = mock_stream_file
 
         dest_path = 'dest/a/b/c'
         dest_full_path = os.path.join(self.base_dir, dest_path)
@@ -282,11 +559,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
         response = self.fetch('/v1/import/{}/{}'.format(dest_path, self.notebook_file_id))
         self.assertEqual(response.code, 200)
 
-        self.assertEqual(mock_download_file.call_count, 1)
-        self.assertEqual(mock_download_file.call_args[0][0], self.notebook_file_id)
-        self.assertIsInstance(mock_download_file.call_args[0][1], io.BufferedIOBase)
-        self.assertEqual(mock_download_file.call_args[0][1].name,
-                         os.path.join(dest_full_path, self.notebook_filename))
+        self.assertEqual(mock_stream_file.call_count, 1)
+        self.assertEqual(mock_stream_file.call_args[0][0], self.notebook_file_id)
+        self.assertTrue(os.path.exists(os.path.join(dest_full_path, self.notebook_filename)))
 
     def test_import_multiple_to_nested_path(self):
         dest_notebook_filenames = [
@@ -312,9 +587,9 @@ class TestImportHandler(ApiHandlerTestCaseBase):
         }
         for dest_notebook_filename in dest_notebook_filenames:
             mock_query = mock.AsyncMock(return_value=(None, result))
-            mock_download_file = mock.AsyncMock()
+            mock_stream_file = mock.Mock(side_effect=lambda file_id, progress=None: _stream([b'{}']))
             self.mock_nbsearchdb().query.side_effect = mock_query
-            self.mock_nbsearchdb().download_file.side_effect = mock_download_file
+            self.mock_nbsearchdb().stream_file = mock_stream_file
 
             response = self.fetch('/v1/import/{}/{}'.format(dest_path, self.notebook_file_id))
             self.assertEqual(response.code, 200)
@@ -322,9 +597,42 @@ class TestImportHandler(ApiHandlerTestCaseBase):
             self.assertEqual(mock_query.call_count, 1)
             self.assertEqual(mock_query.call_args[0][0], 'jupyter-notebook')
             self.assertEqual(mock_query.call_args[0][1], 'id:"0123456789ab0123456789ab"')
-            self.assertEqual(mock_download_file.call_count, 1)
-            self.assertEqual(mock_download_file.call_args[0][1].name,
-                             os.path.join(dest_full_path, dest_notebook_filename))
+            self.assertEqual(mock_stream_file.call_count, 1)
+            self.assertTrue(os.path.exists(os.path.join(dest_full_path, dest_notebook_filename)))
+
+    def test_import_progress_and_failure(self):
+        result = {
+            'response': {
+                'docs': [{'filename': self.notebook_filename}],
+                'numFound': 1,
+                'start': 0,
+            },
+        }
+        observed = []
+
+        async def stream_file(file_id, progress=None):
+            progress(2, 4)
+            observed.extend([dict(p) for p in nbsearch.v1.handlers.IMPORTS.values()])
+            yield b'{"'
+            raise IOError('connection reset')
+        self.mock_nbsearchdb().query.side_effect = mock.AsyncMock(return_value=(None, result))
+        self.mock_nbsearchdb().stream_file = mock.Mock(side_effect=stream_file)
+
+        dest_path = 'dest'
+        dest_full_path = os.path.join(self.base_dir, dest_path)
+        os.mkdir(dest_full_path)
+
+        response = self.fetch('/v1/import/{}/{}'.format(dest_path, self.notebook_file_id))
+        self.assertEqual(response.code, 500)
+        self.assertEqual(observed, [{
+            'id': self.notebook_file_id,
+            'path': dest_path,
+            'filename': self.notebook_filename,
+            'received': 2,
+            'total': 4,
+        }])
+        self.assertEqual(nbsearch.v1.handlers.IMPORTS, {})
+        self.assertEqual(os.listdir(dest_full_path), [])
 
     def test_import_to_empty_path(self):
         response = self.fetch('/v1/import/{}/{}'.format('', self.notebook_file_id))
@@ -350,14 +658,14 @@ class TestImportHandler(ApiHandlerTestCaseBase):
         }
         for dest_path in dest_paths:
             mock_query = mock.AsyncMock(return_value=(None, result))
-            mock_download_file = mock.AsyncMock()
+            mock_stream_file = mock.Mock(side_effect=lambda file_id, progress=None: _stream([b'{}']))
             self.mock_nbsearchdb().query.side_effect = mock_query
-            self.mock_nbsearchdb().download_file.side_effect = mock_download_file
+            self.mock_nbsearchdb().stream_file = mock_stream_file
 
             response = self.fetch('/v1/import/{}/{}'.format(dest_path, self.notebook_file_id))
             self.assertEqual(response.code, 400)
             self.assertEqual(mock_query.call_count, 1)
-            self.assertEqual(mock_download_file.call_count, 0)
+            self.assertEqual(mock_stream_file.call_count, 0)
 
     def test_import_to_start_with_multiple_slashed_path(self):
         dest_paths = [
@@ -378,14 +686,14 @@ class TestImportHandler(ApiHandlerTestCaseBase):
         }
         for dest_path in dest_paths:
             mock_query = mock.AsyncMock(return_value=(None, result))
-            mock_download_file = mock.AsyncMock()
+            mock_stream_file = mock.Mock(side_effect=lambda file_id, progress=None: _stream([b'{}']))
             self.mock_nbsearchdb().query.side_effect = mock_query
-            self.mock_nbsearchdb().download_file.side_effect = mock_download_file
+            self.mock_nbsearchdb().stream_file = mock_stream_file
 
             response = self.fetch('/v1/import/{}/{}'.format(dest_path, self.notebook_file_id))
             self.assertEqual(response.code, 400)
             self.assertEqual(mock_query.call_count, 1)
-            self.assertEqual(mock_download_file.call_count, 0)
+            self.assertEqual(mock_stream_file.call_count, 0)
 
 
 class TestDataHandler(ApiHandlerTestCaseBase):
@@ -426,16 +734,11 @@ class TestDataHandler(ApiHandlerTestCaseBase):
             },
         }
 
-        # Mock the query and download_file methods
+        # Mock the query and stream_file methods
         mock_query = mock.AsyncMock(return_value=(None, result))
-
-        def mock_download_file(file_id, file_obj):
-            file_obj.write(notebook_json.encode('utf-8'))
-            return mock.AsyncMock()
-
-        mock_download = mock.AsyncMock(side_effect=mock_download_file)
+        mock_stream = mock.Mock(side_effect=lambda file_id: _stream([notebook_json.encode('utf-8')]))
         self.mock_nbsearchdb().query = mock_query
-        self.mock_nbsearchdb().download_file = mock_download
+        self.mock_nbsearchdb().stream_file = mock_stream
 
         response = self.fetch(f'/v1/data/{self.notebook_file_id}')
         self.assertEqual(response.code, 200)
@@ -483,18 +786,71 @@ class TestDataHandler(ApiHandlerTestCaseBase):
         }
 
         mock_query = mock.AsyncMock(return_value=(None, result))
+        mock_stream = mock.Mock(side_effect=lambda file_id: _stream([b'invalid json content']))
+        self.mock_nbsearchdb().query = mock_query
+        self.mock_nbsearchdb().stream_file = mock_stream
 
-        def mock_download_file(file_id, file_obj):
-            file_obj.write(b'invalid json content')
-            return mock.AsyncMock()
+        response = self.fetch(f'/v1/data/{self.notebook_file_id}')
+        self.assertEqual(response.code, 400)
 
-        mock_download = mock.AsyncMock(side_effect=mock_download_file)
-        self.mock_nbsearchdb().query = mock_query
-        self.mock_nbsearchdb().download_file = mock_download
+    def test_data_chunks(self):
+        notebook_data = {
+            "cells": [
+                {
+                    "cell_type": "markdown",
+                    "source": ["ノートブック " * 100],
+                    "metadata": {},
+                }
+            ],
+            "metadata": {},
+            "nbformat": 4,
+            "nbformat_minor": 4
+        }
+        content = b'\n  ' + json.dumps(notebook_data, ensure_ascii=False).encode('utf-8')
+        # Split the content inside of multibyte characters
+        chunks = [content[:1], content[1:3]] + [content[i:i + 7] for i in range(3, len(content), 7)]
+        result = {
+            'response': {
+                'docs': [{'filename': self.notebook_filename}],
+                'numFound': 1,
+                'start': 0,
+            },
+        }
+        self.mock_nbsearchdb().query = mock.AsyncMock(return_value=(None, result))
+        self.mock_nbsearchdb().stream_file = mock.Mock(side_effect=lambda file_id: _stream(chunks))
+
+        response = self.fetch(f'/v1/data/{self.notebook_file_id}')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        response_data = json.loads(response.body.decode())
+        self.assertEqual(response_data['notebook'], notebook_data)
+        self.assertEqual(response_data['metadata']['filename'], 'test_notebook.ipynb')
+
+    def test_data_invalid_encoding(self):
+        result = {
+            'response': {
+                'docs': [{'filename': self.notebook_filename}],
+                'numFound': 1,
+                'start': 0,
+            },
+        }
+        self.mock_nbsearchdb().query = mock.AsyncMock(return_value=(None, result))
+        self.mock_nbsearchdb().stream_file = mock.Mock(side_effect=lambda file_id: _stream([b'{"a": "\xff"}']))
 
         response = self.fetch(f'/v1/data/{self.notebook_file_id}')
         self.assertEqual(response.code, 400)
 
+        response = self.fetch(f'/v1/data/{self.notebook_file_id}?validate=false')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'{"notebook": {"a": "\xff"}, "metadata": ' + json.dumps({
+            'id': self.notebook_file_id,
+            'filename': 'test_notebook.ipynb',
+            'original_path': self.notebook_filename,
+            'owner': None,
+            'server': None,
+            'modified': None,
+        }).encode('utf-8') + b'}')
+
 
 if __name__ == '__main__':
     unittest.main()
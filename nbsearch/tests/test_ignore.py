@@ -0,0 +1,96 @@
+from nbsearch.ignore import IgnoreMatcher, parse_rules
+
+
+def _matcher(text, base_dir='', parent=None):
+    return IgnoreMatcher(parse_rules(text.splitlines()), base_dir, parent)
+
+
+def test_parse_rules():
+    rules = parse_rules('''
+# comment
+\\#hash.ipynb
+!keep.ipynb
+build/
+'''.splitlines())
+    assert [(r.pattern, r.negated, r.dir_only) for r in rules] == [
+        ('#hash.ipynb', False, False),
+        ('keep.ipynb', True, False),
+        ('build', False, True),
+    ]
+
+
+def test_basename_and_anchored_patterns():
+    matcher = _matcher('''
+*.tmp.ipynb
+/top.ipynb
+docs/draft?.ipynb
+''')
+    assert matcher.is_ignored('a.tmp.ipynb')
+    assert matcher.is_ignored('x/y/a.tmp.ipynb')
+    assert matcher.is_ignored('top.ipynb')
+    assert not matcher.is_ignored('x/top.ipynb')
+    assert matcher.is_ignored('docs/draft1.ipynb')
+    assert not matcher.is_ignored('x/docs/draft1.ipynb')
+    assert not matcher.is_ignored('docs/sub/draft1.ipynb')
+    assert not matcher.is_ignored('a.ipynb')
+
+
+def test_double_asterisk():
+    matcher = _matcher('''
+**/cache/*.ipynb
+logs/**/old.ipynb
+test2/**
+''')
+    assert matcher.is_ignored('cache/a.ipynb')
+    assert matcher.is_ignored('x/y/cache/a.ipynb')
+    assert matcher.is_ignored('logs/old.ipynb')
+    assert matcher.is_ignored('logs/2024/01/old.ipynb')
+    assert matcher.is_ignored('test2/test2sub.ipynb')
+    assert matcher.is_ignored('test2/sub/test2sub.ipynb')
+    # Pruned before descent as everything in it is ignored
+    assert matcher.is_ignored('test2', is_dir=True)
+    assert not matcher.is_ignored('test2')
+
+
+def test_negation_and_directory_only():
+    matcher = _matcher('''
+*.ipynb
+output/
+test2/**
+!important.ipynb
+''')
+    assert matcher.is_ignored('a.ipynb')
+    assert not matcher.is_ignored('important.ipynb')
+    assert matcher.match('important.ipynb') is False
+    assert matcher.is_ignored('output', is_dir=True)
+    assert not matcher.is_ignored('output')
+    # Not pruned since a negated rule may include a file in it
+    assert not matcher.is_ignored('test2', is_dir=True)
+    assert not matcher.is_ignored('test2/important.ipynb')
+    assert matcher.is_ignored('test2/other.txt')
+
+
+def test_character_class():
+    matcher = _matcher('''
+run[0-9].ipynb
+tmp[!a].ipynb
+''')
+    assert matcher.is_ignored('run1.ipynb')
+    assert not matcher.is_ignored('runx.ipynb')
+    assert matcher.is_ignored('tmpb.ipynb')
+    assert not matcher.is_ignored('tmpa.ipynb')
+
+
+def test_inheritance():
+    parent = _matcher('''
+*.ipynb
+''')
+    child = _matcher('''
+!keep.ipynb
+/local.ipynb
+''', 'sub', parent)
+    assert child.is_ignored('sub/a.ipynb')
+    assert not child.is_ignored('sub/keep.ipynb')
+    assert child.is_ignored('sub/local.ipynb')
+    assert parent.is_ignored('keep.ipynb')
+    assert child.match('sub/x/local.txt') is None
@@ -0,0 +1,52 @@
+import hashlib
+import io
+import os
+import tempfile
+
+from nbsearch.manifest import Manifest, file_digest
+
+
+def _file(path, mtime_ns=1000, size=10):
+    return {
+        'server': 'http://test/server',
+        'path': path,
+        'mtime_ns': mtime_ns,
+        'size': size,
+    }
+
+def test_manifest():
+    with tempfile.TemporaryDirectory() as tempdirname:
+        manifest_path = os.path.join(tempdirname, 'sub', 'manifest.sqlite')
+        manifest = Manifest(manifest_path)
+        assert manifest.get('http://test/server', 'test.ipynb') is None
+        assert not manifest.is_stat_unchanged(_file('test.ipynb'))
+
+        digest = file_digest(io.BytesIO(b'{}'))
+        manifest.put(_file('test.ipynb'), digest, notebook_id='NOTEBOOK_ID')
+        manifest.close()
+
+        manifest = Manifest(manifest_path)
+        entry = manifest.get('http://test/server', 'test.ipynb')
+        assert entry['digest'] == digest
+        assert entry['notebook_id'] == 'NOTEBOOK_ID'
+        assert manifest.is_stat_unchanged(_file('test.ipynb'))
+        assert not manifest.is_stat_unchanged(_file('test.ipynb', mtime_ns=2000))
+        assert not manifest.is_stat_unchanged(_file('test.ipynb', size=11))
+
+        manifest.put(_file('test.ipynb', mtime_ns=2000), digest)
+        assert manifest.get('http://test/server', 'test.ipynb')['notebook_id'] == 'NOTEBOOK_ID'
+        assert manifest.is_stat_unchanged(_file('test.ipynb', mtime_ns=2000))
+
+        manifest.put(_file('test2.ipynb'), digest)
+        assert sorted([e['path'] for e in manifest.get_entries('http://test/server')]) == \
+            ['test.ipynb', 'test2.ipynb']
+        assert manifest.get_entries('http://other/server') == []
+
+        manifest.remove('http://test/server', 'test.ipynb')
+        assert manifest.get('http://test/server', 'test.ipynb') is None
+        manifest.close()
+
+
+def test_file_digest():
+    content = b'{"cells": []}' * 1000
+    assert file_digest(io.BytesIO(content), chunk_size=7) == hashlib.sha256(content).hexdigest()
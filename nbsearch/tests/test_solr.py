@@ -1,4 +1,51 @@
-from nbsearch.solr import cell_to_solr_document
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from unittest.mock import patch
+
+import mistletoe
+import pytest
+
+from nbsearch.solr import (
+    NotebookAnalysis,
+    OutputLimits,
+    TRUNCATED_MARKER,
+    cell_to_solr_document,
+    ipynb_to_documents,
+    markdown_to_solr_fields,
+    notebook_to_solr_document,
+    parse_markdown,
+    _get_markdown_ast_heading_levels,
+)
+
+
+# Fields extracted from the JSON AST rendered by mistletoe's ASTRenderer
+with open(os.path.join(os.path.dirname(__file__), 'data', 'markdown_fields.json')) as f:
+    MARKDOWN_FIELDS = json.load(f)
+
+
+def _generate_notebook(size):
+    cells = []
+    for i in range(size):
+        if i % 10 == 0:
+            source = ['#' * (1 + i % 3) + f' Section {i}\n']
+        elif i % 2 == 0:
+            source = [f'Content {i}\n']
+        else:
+            source = None
+        cell = {
+            'cell_type': 'code' if source is None else 'markdown',
+            'source': source if source is not None else [f'print({i})'],
+            'metadata': {
+                'lc_cell_meme': {
+                    'current': f'CURRENT_METADATA_{i}',
+                },
+            },
+        }
+        if source is None:
+            cell['outputs'] = [{'output_type': 'stream', 'name': 'stdout', 'text': [f'{i}\n']}]
+        cells.append(cell)
+    return {'cells': cells, 'metadata': {}}
 
 
 def test_cell_to_solr_document():
@@ -422,3 +469,182 @@ def test_cell_to_solr_document_memes():
     )
     assert doc['lc_cell_memes__next__in_section'] == ''
     assert doc['lc_cell_memes__previous__in_section'] == 'CURRENT_METADATA_2 CURRENT_METADATA_3'
+
+
+def test_cell_to_solr_document_with_analysis():
+    notebook = _generate_notebook(45)
+    cells = notebook['cells']
+    analysis = NotebookAnalysis(cells)
+    for i, cell in enumerate(cells):
+        expected = cell_to_solr_document('NOTEBOOK_ID', 'path/to/notebook', cell, i, cells=cells)
+        actual = cell_to_solr_document(
+            'NOTEBOOK_ID', 'path/to/notebook', cell, i, cells=cells, analysis=analysis,
+        )
+        assert actual == expected
+
+
+def test_ipynb_to_documents_parses_each_cell_once():
+    for size in [10, 100, 1000]:
+        notebook = _generate_notebook(size)
+        markdown_cells = len([c for c in notebook['cells'] if c['cell_type'] == 'markdown'])
+        with patch('nbsearch.solr.mistletoe.Document', wraps=mistletoe.Document) as mock_document:
+            docs = ipynb_to_documents('path/to/notebook', notebook)
+        assert len(docs['jupyter-cell']) == size
+        assert mock_document.call_count == markdown_cells
+
+
+def test_notebook_analysis_long_sections():
+    cells = [{'cell_type': 'markdown', 'source': ['# Section']}] + [
+        {
+            'cell_type': 'code',
+            'source': [f'print({i})'],
+            'metadata': {'lc_cell_meme': {'current': f'CURRENT_METADATA_{i}'}},
+        }
+        for i in range(5000)
+    ] + [{'cell_type': 'markdown', 'source': ['# Section 2']}]
+    analysis = NotebookAnalysis(cells)
+    assert analysis.section_beginnings[0] == 0
+    assert analysis.section_beginnings[2500] == 0
+    assert analysis.section_endings[2500] == 5001
+    assert analysis.section_beginnings[5001] == 0
+    assert analysis.section_endings[5001] == 5002
+    assert analysis.memes_between(1, 3) == 'CURRENT_METADATA_0 CURRENT_METADATA_1'
+    assert analysis.memes_between(4999, 5002) == 'CURRENT_METADATA_4998 CURRENT_METADATA_4999'
+    assert analysis.memes_between(0, 1) == ''
+
+
+def test_notebook_to_solr_document():
+    notebook = {
+        'cells': [
+            {'cell_type': 'code', 'source': [], 'outputs': []},
+            {'cell_type': 'markdown', 'source': ['# Title\n', 'About *TODO*']},
+            {'cell_type': 'code', 'source': ['print(1)'], 'outputs': [
+                {'output_type': 'stream', 'name': 'stdout', 'text': ['1\n']},
+            ]},
+            {'cell_type': 'markdown', 'source': ['## Next']},
+        ],
+        'metadata': {},
+    }
+    doc = notebook_to_solr_document('path/to/notebook.ipynb', notebook)
+    assert doc['source'] == '# Title\nAbout *TODO*\nprint(1)\n## Next'
+    assert doc['source__code'] == 'print(1)'
+    assert doc['source__markdown__heading'] == '# Title\n## Next'
+    assert doc['source__markdown__heading_count'] == '2'
+    assert doc['outputs'] == '1\n'
+    assert doc['outputs__stdout'] == '1\n'
+    assert doc['_text_'] == 'notebook.ipynb\n' + doc['source'] + '\n' + doc['outputs']
+
+
+def test_ipynb_to_documents_reuses_cell_documents():
+    notebook = _generate_notebook(45)
+    docs = ipynb_to_documents('path/to/notebook', notebook)
+    assert docs['jupyter-notebook'] == [notebook_to_solr_document('path/to/notebook', notebook)]
+
+
+def test_markdown_to_solr_fields_nested():
+    markdown = '# [Doc](http://x.org) *TODO*\n\n**bold *nested*** `code`\n\n## Operation Note\nrun it #ops'
+    fields = markdown_to_solr_fields(markdown, prefix='p__')
+    assert fields == {
+        'p__heading': '# Doc   TODO\n## Operation Note',
+        'p__heading_1': 'Doc   TODO',
+        'p__heading_2': 'Operation Note',
+        'p__link': 'Doc http://x.org',
+        'p__url': 'http://x.org',
+        # The values of enclosing nodes come first
+        'p__emphasis': 'TODO\nbold  nested\nnested',
+        'p__emphasis_1': 'TODO\nnested',
+        'p__emphasis_2': 'bold  nested',
+        'p__code_inline': 'code',
+        'p__code': 'code',
+        'p__operation_note': 'run it #ops',
+        'p__todo': markdown,
+        'p__hashtags': '## #ops',
+    }
+
+
+@pytest.mark.parametrize('expected', MARKDOWN_FIELDS, ids=lambda expected: repr(expected['markdown'][:20]))
+def test_markdown_to_solr_fields_compatibility(expected):
+    markdown = expected['markdown']
+    assert markdown_to_solr_fields(markdown, prefix='source__markdown__') == expected['fields']
+    levels = _get_markdown_ast_heading_levels(parse_markdown(markdown))
+    assert (list(levels) if levels is not None else None) == expected['heading_levels']
+
+
+def test_ipynb_to_documents_with_output_limits():
+    notebook = {
+        'cells': [
+            {'cell_type': 'code', 'source': ['train()'], 'outputs': [
+                {'output_type': 'stream', 'name': 'stdout', 'text': ['epoch {}\n'.format(i) for i in range(1000)]},
+                {'output_type': 'stream', 'name': 'stderr', 'text': ['warning\n']},
+            ]},
+            {'cell_type': 'code', 'source': ['plot()'], 'outputs': [
+                {'output_type': 'execute_result', 'data': {
+                    'text/plain': ['<Figure>'],
+                    'text/html': ['<div>Figure &amp; legend</div><script>Plotly.newPlot({"x": [1, 2, 3]})</script>'],
+                }},
+            ]},
+        ],
+        'metadata': {},
+    }
+    limits = OutputLimits(field_max_chars=100, document_max_chars=150, html_max_chars=50)
+    docs = ipynb_to_documents('path/to/notebook.ipynb', notebook, output_limits=limits)
+    cell = docs['jupyter-cell'][0]
+    assert cell['outputs__stdout'].startswith('epoch 0\nepoch 1\n')
+    assert cell['outputs__stdout'].endswith('epoch 998\nepoch 999\n')
+    assert '[... 9823 characters truncated ...]' in cell['outputs__stdout']
+    assert cell['outputs__stderr'] == 'warning\n'
+    assert cell['truncated_outputs'] == ['outputs__stdout']
+    assert cell['outputs'] == cell['outputs__stderr'] + ' ' + cell['outputs__stdout']
+    plot = docs['jupyter-cell'][1]
+    assert plot['outputs__result_html'] == 'Figure & legend'
+    assert 'truncated_outputs' not in plot
+    notebook_doc = docs['jupyter-notebook'][0]
+    assert '[... ' in notebook_doc['outputs']
+    assert notebook_doc['truncated_outputs'] == ['outputs', 'outputs__stdout']
+
+    docs = ipynb_to_documents('path/to/notebook.ipynb', notebook)
+    assert len(docs['jupyter-cell'][0]['outputs__stdout']) == 9890
+    assert docs['jupyter-cell'][1]['outputs__result_html'].startswith('<div>')
+    assert 'truncated_outputs' not in docs['jupyter-notebook'][0]
+
+
+def test_ipynb_to_documents_with_large_outputs_of_several_types():
+    cell = {'cell_type': 'code', 'source': ['run()'], 'outputs': [
+        {'output_type': 'stream', 'name': 'stdout', 'text': ['o' * 10000]},
+        {'output_type': 'stream', 'name': 'stderr', 'text': ['e' * 10000]},
+        {'output_type': 'execute_result', 'data': {
+            'text/plain': ['p' * 10000],
+            'text/html': ['h' * 10000],
+        }},
+    ]}
+    notebook = {'cells': [cell, cell], 'metadata': {}}
+    limits = OutputLimits(field_max_chars=0, document_max_chars=1000, html_max_chars=0)
+    docs = ipynb_to_documents('path/to/notebook.ipynb', notebook, output_limits=limits)
+    # The markers and the separators are allowed in addition to the limit
+    overhead = 10 * len(TRUNCATED_MARKER.format(100000)) + 10
+    for doc in [docs['jupyter-cell'][0], docs['jupyter-notebook'][0]]:
+        output_keys = [k for k in doc.keys() if k.split('_')[0] == 'outputs']
+        assert len(output_keys) == 5
+        assert sum([len(doc[k]) for k in output_keys]) <= 1000 + overhead
+        assert set(doc['truncated_outputs']) >= set([k for k in output_keys if k != 'outputs'])
+    cell_doc = docs['jupyter-cell'][0]
+    # The limit is shared equally between the fields
+    assert cell_doc['outputs__stdout'].startswith('o' * 62 + '\n[...')
+    assert cell_doc['outputs__stderr'].startswith('e' * 62 + '\n[...')
+
+
+def test_ipynb_to_documents_in_threads():
+    notebooks = []
+    for i in range(16):
+        markdown = '\n\n'.join([expected['markdown'] for expected in MARKDOWN_FIELDS])
+        notebooks.append({
+            'cells': [{'cell_type': 'markdown', 'source': [f'# Notebook {i}\n\n', markdown]}] * 20,
+            'metadata': {},
+        })
+    expected = [ipynb_to_documents(f'path/to/{i}.ipynb', notebook) for i, notebook in enumerate(notebooks)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        actual = list(executor.map(
+            lambda args: ipynb_to_documents(f'path/to/{args[0]}.ipynb', args[1]),
+            enumerate(notebooks),
+        ))
+    assert actual == expected
@@ -1,12 +1,15 @@
 from datetime import datetime, timedelta
+import io
 import json
 import os
 import tempfile
 import time
-import pytz
 from unittest.mock import patch
 
-from nbsearch.source import LocalSource
+import pytest
+import pytz
+
+from nbsearch.source import LocalSource, load_notebook
 
 
 def _fromisoformat(dt):
@@ -218,12 +221,164 @@ test2/**
 
         assert source.get_notebook('http://test/server', 'test1/ignore.ipynb') == {}
 
-@patch('nbsearch.source.os.listdir')
-def test_get_files_with_permission_error(mock_listdir):
-    mock_listdir.side_effect = PermissionError()
+@patch('nbsearch.source.os.scandir')
+def test_get_files_with_permission_error(mock_scandir):
+    mock_scandir.side_effect = PermissionError()
 
     source = LocalSource()
     source.server = 'http://test/server'
     source.base_dir = '/no_permissions'
 
     assert list(source.get_files()) == []
+
+def test_get_file_and_is_ignored():
+    with tempfile.TemporaryDirectory() as tempdirname:
+        source = LocalSource()
+        source.server = 'http://test/server'
+        source.base_dir = tempdirname
+
+        os.mkdir(os.path.join(tempdirname, 'test1'))
+        with open(os.path.join(tempdirname, 'test1', 'test1sub.ipynb'), 'w') as f:
+            f.write(json.dumps({}))
+        with open(os.path.join(tempdirname, '.nbsearchignore'), 'w') as f:
+            f.write('''
+test2/**
+''')
+        with open(os.path.join(tempdirname, 'test1', '.nbsearchignore'), 'w') as f:
+            f.write('''
+ignore.ipynb
+''')
+
+        file = source.get_file('test1/test1sub.ipynb')
+        assert file == list(source.get_files())[0]
+        assert source.get_file('test1/missing.ipynb') is None
+
+        assert not source.is_ignored('test1/test1sub.ipynb')
+        assert not source.is_ignored('test1/missing.ipynb')
+        assert source.is_ignored('test1/ignore.ipynb')
+        assert source.is_ignored('test2/test2sub.ipynb')
+        assert source.is_ignored('test1/.hidden.ipynb')
+        assert source.is_ignored('.ipynb_checkpoints/test-checkpoint.ipynb')
+
+def test_relpath():
+    source = LocalSource()
+    source.base_dir = '/notebooks'
+
+    assert source.relpath('test1/test1sub.ipynb') == os.path.join('test1', 'test1sub.ipynb')
+    assert source.relpath('/notebooks/test1/test1sub.ipynb') == os.path.join('test1', 'test1sub.ipynb')
+    with pytest.raises(ValueError):
+        source.relpath('/other/test.ipynb')
+    with pytest.raises(ValueError):
+        source.relpath('../test.ipynb')
+
+def test_get_files_in_parallel():
+    with tempfile.TemporaryDirectory() as tempdirname:
+        source = LocalSource()
+        source.server = 'http://test/server'
+        source.base_dir = tempdirname
+
+        for i in range(5):
+            os.makedirs(os.path.join(tempdirname, f'dir{i}', 'sub'))
+            for path in [f'dir{i}/test.ipynb', f'dir{i}/sub/test.ipynb', f'dir{i}/sub/ignore.ipynb', f'dir{i}/test.dat']:
+                with open(os.path.join(tempdirname, path), 'w') as f:
+                    f.write(json.dumps({}))
+        with open(os.path.join(tempdirname, 'dir0', '.nbsearchignore'), 'w') as f:
+            f.write('''
+sub/**
+''')
+        with open(os.path.join(tempdirname, '.nbsearchignore'), 'w') as f:
+            f.write('''
+ignore.ipynb
+''')
+
+        files = sorted(source.get_files(), key=lambda x: x['path'])
+        assert [f['path'] for f in files] == ['dir0/test.ipynb'] + \
+            sorted([f'dir{i}/sub/test.ipynb' for i in range(1, 5)] + [f'dir{i}/test.ipynb' for i in range(1, 5)])
+
+        source.crawl_workers = 4
+        assert sorted(source.get_files(), key=lambda x: x['path']) == files
+
+def test_get_files_prunes_ignored_directories():
+    with tempfile.TemporaryDirectory() as tempdirname:
+        source = LocalSource()
+        source.server = 'http://test/server'
+        source.base_dir = tempdirname
+
+        for path in ['test1/test1sub.ipynb', 'test1/important.ipynb', 'test2/test2sub.ipynb', 'build/out.ipynb']:
+            os.makedirs(os.path.join(tempdirname, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(tempdirname, path), 'w') as f:
+                f.write(json.dumps({}))
+        with open(os.path.join(tempdirname, '.nbsearchignore'), 'w') as f:
+            f.write('''
+test2/**
+build/
+''')
+        with open(os.path.join(tempdirname, 'test1', '.nbsearchignore'), 'w') as f:
+            f.write('''
+*.ipynb
+!important.ipynb
+''')
+
+        scanned = []
+        scandir = os.scandir
+        def _scandir(path):
+            scanned.append(os.path.relpath(path, tempdirname))
+            return scandir(path)
+        with patch('nbsearch.source.os.scandir', side_effect=_scandir):
+            files = sorted([f['path'] for f in source.get_files()])
+        assert files == ['test1/important.ipynb']
+        assert sorted(scanned) == ['.', 'test1']
+        assert source.is_ignored('test2/test2sub.ipynb')
+        assert source.is_ignored('test1/test1sub.ipynb')
+        assert not source.is_ignored('test1/important.ipynb')
+
+
+def _notebook_with_images():
+    return {
+        'cells': [
+            {
+                'cell_type': 'markdown',
+                'source': ['![image](attachment:image.png)'],
+                'metadata': {},
+                'attachments': {'image.png': {'image/png': 'iVBORw0KGgo='}},
+            },
+            {
+                'cell_type': 'code',
+                'source': ['plot()'],
+                'metadata': {'lc_cell_meme': {'current': 'MEME', 'execution_end_time': '2024-01-01T00:00:00Z'}},
+                'execution_count': 1,
+                'outputs': [
+                    {'output_type': 'stream', 'name': 'stdout', 'text': ['\u3042\n']},
+                    {'output_type': 'display_data', 'metadata': {}, 'data': {
+                        'image/png': 'iVBORw0KGgo=',
+                        'application/vnd.plotly.v1+json': {'data': [{'x': [1, 2.5]}]},
+                        'text/plain': ['<Figure>'],
+                    }},
+                    {'output_type': 'execute_result', 'execution_count': 1, 'metadata': {}, 'data': {
+                        'text/plain': ['1.5'],
+                        'text/html': ['<b>1.5</b>'],
+                    }},
+                ],
+            },
+        ],
+        'metadata': {
+            'kernelspec': {'name': 'python3'},
+            'widgets': {'application/vnd.jupyter.widget-state+json': {'state': {}}},
+        },
+        'nbformat': 4,
+        'nbformat_minor': 5,
+    }
+
+def test_load_notebook():
+    notebook = _notebook_with_images()
+    content = json.dumps(notebook).encode('utf8')
+    assert load_notebook(io.BytesIO(content)) == notebook
+
+    expected = _notebook_with_images()
+    del expected['cells'][0]['attachments']
+    del expected['cells'][1]['outputs'][1]['data']['image/png']
+    del expected['cells'][1]['outputs'][1]['data']['application/vnd.plotly.v1+json']
+    del expected['metadata']['widgets']
+    assert load_notebook(io.BytesIO(content), indexed_only=True) == expected
+    with patch('nbsearch.source.ijson', None):
+        assert load_notebook(io.BytesIO(content), indexed_only=True) == expected
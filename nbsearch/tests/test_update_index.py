@@ -0,0 +1,484 @@
+import asyncio
+import json
+import os
+import pickle
+import tempfile
+from unittest import mock
+
+import pytest
+
+from traitlets.config import Config
+
+from nbsearch.db import SolrUpdateBuffer, UpdateIndexHandler, _convert_notebook, _init_converter
+from nbsearch.manifest import Manifest
+from nbsearch.source import LocalSource
+from nbsearch.watcher import Watcher
+
+
+def _notebook(text):
+    return {
+        'cells': [
+            {
+                'cell_type': 'code',
+                'source': [text],
+                'outputs': [],
+            },
+        ],
+        'metadata': {},
+    }
+
+def _write_notebook(path, text):
+    with open(path, 'w') as f:
+        f.write(json.dumps(_notebook(text)))
+
+async def _pages(pages):
+    for page in pages:
+        yield page
+
+def _indexed(path, server='http://test/server'):
+    """Return the notebook document and the first cell document of an indexed notebook"""
+    notebook_id = 'unknown_undefined_' + os.path.basename(path)
+    notebook = {'id': notebook_id, 'filename': os.path.basename(path), 'server': server}
+    cell = {'notebook_id': notebook_id, 'notebook_filename': path, 'notebook_server': server}
+    return notebook, cell
+
+class _QueueWatcher(Watcher):
+
+    def start(self):
+        pass
+
+class _UpdateIndexTestBase:
+
+    def setup_method(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.base_dir = os.path.join(self.tempdir.name, 'notebooks')
+        os.mkdir(self.base_dir)
+        self.config_path = os.path.join(self.tempdir.name, 'config.py')
+        with open(self.config_path, 'w') as f:
+            f.write(f'''
+c.LocalSource.base_dir = {repr(self.base_dir)}
+c.LocalSource.server = 'http://test/server'
+''')
+        self.nbsearchdb_patcher = mock.patch('nbsearch.db.NBSearchDB')
+        self.mock_nbsearchdb = self.nbsearchdb_patcher.start()
+        self.mock_nbsearchdb()._post_update = mock.AsyncMock()
+        self.mock_nbsearchdb().commit = mock.AsyncMock()
+        self.mock_nbsearchdb().open = mock.AsyncMock()
+        self.mock_nbsearchdb().close = mock.AsyncMock()
+        self.uploaded_contents = {}
+
+        async def upload_fileobj(notebook_id, f):
+            self.uploaded_contents[notebook_id] = await f.read()
+        self.mock_nbsearchdb().upload_fileobj = mock.AsyncMock(side_effect=upload_fileobj)
+        self.mock_nbsearchdb().delete_by_query = mock.AsyncMock()
+        self.mock_nbsearchdb().delete_files = mock.AsyncMock()
+        self.indexed_notebooks = []
+        self.indexed_cells = []
+        self.mock_nbsearchdb().iter_query.side_effect = lambda core, *args, **kwargs: _pages([
+            self.indexed_cells if core == 'jupyter-cell' else self.indexed_notebooks,
+        ])
+        self.batch_documents = 1000
+        self.mock_nbsearchdb().create_update_buffer.side_effect = lambda on_flush=None: SolrUpdateBuffer(
+            self.mock_nbsearchdb(),
+            max_documents=self.batch_documents,
+            on_flush=on_flush,
+        )
+
+    def teardown_method(self):
+        self.nbsearchdb_patcher.stop()
+        self.tempdir.cleanup()
+
+    def _handler(self, **kwargs):
+        config = Config()
+        for k, v in kwargs.items():
+            config.UpdateIndexHandler[k] = v
+        return UpdateIndexHandler(config=config)
+
+    def _uploaded_ids(self):
+        return sorted([c[0][0] for c in self.mock_nbsearchdb().upload_fileobj.call_args_list])
+
+
+class TestUpdateIndex(_UpdateIndexTestBase):
+
+    def test_update(self):
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        _write_notebook(os.path.join(self.base_dir, 'b.ipynb'), 'print(2)')
+
+        handler = self._handler()
+        asyncio.run(handler.update(self.config_path, 'local', None))
+        assert self._uploaded_ids() == ['unknown_undefined_a.ipynb', 'unknown_undefined_b.ipynb']
+        self.mock_nbsearchdb().open.assert_awaited_once()
+        self.mock_nbsearchdb().close.assert_awaited_once()
+
+    def test_incremental_update(self):
+        manifest_path = os.path.join(self.tempdir.name, 'manifest.sqlite')
+        a_path = os.path.join(self.base_dir, 'a.ipynb')
+        b_path = os.path.join(self.base_dir, 'b.ipynb')
+        _write_notebook(a_path, 'print(1)')
+        _write_notebook(b_path, 'print(2)')
+
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['skipped'] == 0
+        assert result['removed'] == 0
+        assert self._uploaded_ids() == ['unknown_undefined_a.ipynb', 'unknown_undefined_b.ipynb']
+
+        self.mock_nbsearchdb().upload_fileobj.reset_mock()
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['skipped'] == 2
+        assert self._uploaded_ids() == []
+
+        # Touched without any changes
+        stat = os.stat(a_path)
+        os.utime(a_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        _write_notebook(b_path, 'print(3)')
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['skipped'] == 1
+        assert self._uploaded_ids() == ['unknown_undefined_b.ipynb']
+
+        self.mock_nbsearchdb().upload_fileobj.reset_mock()
+        os.remove(b_path)
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['skipped'] == 1
+        assert result['removed'] == 1
+        assert self._uploaded_ids() == []
+
+    def test_update_with_failures(self):
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        with open(os.path.join(self.base_dir, 'b.ipynb'), 'w') as f:
+            f.write('invalid json content')
+
+        handler = self._handler()
+        with pytest.raises(RuntimeError, match='Failed to update: b.ipynb'):
+            asyncio.run(handler.update(self.config_path, 'local', None))
+        assert self._uploaded_ids() == ['unknown_undefined_a.ipynb']
+
+    def test_update_with_failed_upload(self):
+        manifest_path = os.path.join(self.tempdir.name, 'manifest.sqlite')
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        _write_notebook(os.path.join(self.base_dir, 'b.ipynb'), 'print(2)')
+
+        async def upload_fileobj(notebook_id, f):
+            if notebook_id == 'unknown_undefined_b.ipynb':
+                raise IOError('S3 is not available')
+            self.uploaded_contents[notebook_id] = await f.read()
+        self.mock_nbsearchdb().upload_fileobj.side_effect = upload_fileobj
+
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        with pytest.raises(RuntimeError, match='Failed to update: b.ipynb'):
+            asyncio.run(handler.update(self.config_path, 'local', None))
+        # The uploaded notebook is the content which has been indexed
+        with open(os.path.join(self.base_dir, 'a.ipynb'), 'rb') as f:
+            assert self.uploaded_contents == {'unknown_undefined_a.ipynb': f.read()}
+        manifest = Manifest(manifest_path)
+        assert manifest.get('http://test/server', 'a.ipynb') is not None
+        assert manifest.get('http://test/server', 'b.ipynb') is None
+        manifest.close()
+
+    def test_update_with_notebook_changed_while_indexing(self):
+        manifest_path = os.path.join(self.tempdir.name, 'manifest.sqlite')
+        a_path = os.path.join(self.base_dir, 'a.ipynb')
+        _write_notebook(a_path, 'print(1)')
+
+        async def upload_fileobj(notebook_id, f):
+            # Saved again after the notebook has been converted
+            _write_notebook(a_path, 'print(2)')
+            self.uploaded_contents[notebook_id] = await f.read()
+        self.mock_nbsearchdb().upload_fileobj.side_effect = upload_fileobj
+
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        with pytest.raises(RuntimeError, match='Failed to update: a.ipynb'):
+            asyncio.run(handler.update(self.config_path, 'local', None))
+        manifest = Manifest(manifest_path)
+        assert manifest.get('http://test/server', 'a.ipynb') is None
+        manifest.close()
+
+    def test_convert_notebook_returns_only_documents(self):
+        image = 'iVBORw0KGgo' * 100000
+        notebook = _notebook('print(1)')
+        notebook['cells'][0]['outputs'] = [{
+            'output_type': 'display_data',
+            'data': {'image/png': image, 'text/plain': ['<Figure>']},
+            'metadata': {},
+        }]
+        with open(os.path.join(self.base_dir, 'a.ipynb'), 'w') as f:
+            json.dump(notebook, f)
+        config = Config({'LocalSource': {'base_dir': self.base_dir, 'server': 'http://test/server'}})
+        _init_converter('local', config)
+        source = LocalSource(config=config)
+
+        result = _convert_notebook(source.get_file('a.ipynb'))
+        digest, documents = result
+        assert len(documents['jupyter-cell']) == 1
+        # The notebook itself is not sent back from the worker process
+        assert image.encode('utf8') not in pickle.dumps(result)
+
+    def test_update_concurrency(self):
+        for i in range(10):
+            _write_notebook(os.path.join(self.base_dir, f'{i}.ipynb'), f'print({i})')
+        running = []
+        max_running = []
+
+        async def post_update(core, body, params):
+            running.append(core)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(core)
+        self.mock_nbsearchdb()._post_update = mock.AsyncMock(side_effect=post_update)
+        self.batch_documents = 1
+
+        handler = self._handler(post_concurrency=2, convert_workers=2)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['updated'] == 10
+        assert len(self._uploaded_ids()) == 10
+        assert max(max_running) == 2
+
+    def test_update_batched(self):
+        for i in range(10):
+            _write_notebook(os.path.join(self.base_dir, f'{i}.ipynb'), f'print({i})')
+
+        handler = self._handler()
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['updated'] == 10
+        updates = self.mock_nbsearchdb()._post_update.call_args_list
+        assert sorted([c[0][0] for c in updates]) == ['jupyter-cell', 'jupyter-notebook']
+        assert all([len(json.loads(c[0][1])) == 10 for c in updates])
+        commits = self.mock_nbsearchdb().commit.call_args_list
+        assert sorted([c[0][0] for c in commits]) == ['jupyter-cell', 'jupyter-notebook']
+
+    def test_remove_trailing_cells(self):
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+
+        handler = self._handler()
+        asyncio.run(handler.update(self.config_path, 'local', None))
+        deletes = self.mock_nbsearchdb().delete_by_query.call_args_list
+        assert len(deletes) == 1
+        assert deletes[0][0] == ('jupyter-cell', ['notebook_id:"unknown_undefined_a.ipynb" AND index:[1 TO *]'])
+        self.mock_nbsearchdb().delete_files.assert_not_awaited()
+
+    def test_garbage_collect(self):
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        indexed = [
+            _indexed('a.ipynb'),
+            _indexed('b.ipynb'),
+            _indexed('c.ipynb', server='http://other/server'),
+        ]
+        self.indexed_notebooks = [notebook for notebook, _ in indexed]
+        self.indexed_cells = [cell for _, cell in indexed]
+
+        handler = self._handler(garbage_collect=True)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['deleted'] == 1
+        deletes = [c[0] for c in self.mock_nbsearchdb().delete_by_query.call_args_list]
+        assert ('jupyter-cell', ['notebook_id:"unknown_undefined_b.ipynb"']) in deletes
+        assert ('jupyter-notebook', ['id:"unknown_undefined_b.ipynb"']) in deletes
+        self.mock_nbsearchdb().delete_files.assert_awaited_once_with(['unknown_undefined_b.ipynb'])
+        for c in self.mock_nbsearchdb().iter_query.call_args_list:
+            assert c[1]['fq'][-1] in ['server:"http://test/server"', 'notebook_server:"http://test/server"']
+
+    def test_garbage_collect_keeps_failed_notebooks(self):
+        # A notebook in a subdirectory which fails to be loaded keeps its index
+        os.mkdir(os.path.join(self.base_dir, 'sub'))
+        with open(os.path.join(self.base_dir, 'sub', 'a.ipynb'), 'w') as f:
+            f.write('{')
+        notebook, cell = _indexed(os.path.join('sub', 'a.ipynb'))
+        self.indexed_notebooks = [notebook]
+        self.indexed_cells = [cell]
+
+        handler = self._handler(garbage_collect=True)
+        with pytest.raises(RuntimeError):
+            asyncio.run(handler.update(self.config_path, 'local', None))
+        self.mock_nbsearchdb().delete_files.assert_not_awaited()
+
+    def test_garbage_collect_changed_id(self):
+        # a.ipynb has been indexed under another ID, e.g. before memes were assigned
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        notebook, cell = _indexed('a.ipynb')
+        notebook['id'] = cell['notebook_id'] = 'OLD_ID'
+        self.indexed_notebooks = [notebook]
+        self.indexed_cells = [cell]
+
+        handler = self._handler(garbage_collect=True)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['updated'] == 1
+        assert result['deleted'] == 1
+        self.mock_nbsearchdb().delete_files.assert_awaited_once_with(['OLD_ID'])
+
+    def test_garbage_collect_keeps_skipped_notebooks(self):
+        manifest_path = os.path.join(self.tempdir.name, 'manifest.sqlite')
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        asyncio.run(handler.update(self.config_path, 'local', None))
+        notebook, cell = _indexed('a.ipynb')
+        self.indexed_notebooks = [notebook]
+        self.indexed_cells = [cell]
+
+        handler = self._handler(incremental=True, manifest_path=manifest_path, garbage_collect=True)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['skipped'] == 1
+        assert result['deleted'] == 0
+        self.mock_nbsearchdb().delete_files.assert_not_awaited()
+
+    def test_garbage_collect_keeps_shared_ids(self):
+        # A copy of a.ipynb which shares the same notebook ID
+        os.mkdir(os.path.join(self.base_dir, 'copy'))
+        _write_notebook(os.path.join(self.base_dir, 'copy', 'a.ipynb'), 'print(1)')
+        notebook, cell = _indexed('a.ipynb')
+        self.indexed_notebooks = [notebook]
+        self.indexed_cells = [cell]
+
+        handler = self._handler(garbage_collect=True)
+        result = asyncio.run(handler.update(self.config_path, 'local', None))
+        assert result['deleted'] == 0
+        self.mock_nbsearchdb().delete_files.assert_not_awaited()
+
+    def test_apply_changes(self):
+        manifest_path = os.path.join(self.tempdir.name, 'manifest.sqlite')
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        _write_notebook(os.path.join(self.base_dir, 'b.ipynb'), 'print(2)')
+        handler = self._handler(incremental=True, manifest_path=manifest_path)
+        asyncio.run(handler.update(self.config_path, 'local', None))
+        self.mock_nbsearchdb().upload_fileobj.reset_mock()
+        self.mock_nbsearchdb().delete_by_query.reset_mock()
+
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(3)')
+        os.remove(os.path.join(self.base_dir, 'b.ipynb'))
+        self.indexed_cells = [_indexed('b.ipynb')[1]]
+
+        async def run():
+            db = self.mock_nbsearchdb()
+            source = LocalSource(config=handler.config)
+            manifest = Manifest(manifest_path)
+            try:
+                with handler._create_executor('local') as executor:
+                    return await handler._apply_changes(db, executor, source, manifest, ['a.ipynb', 'b.ipynb'])
+            finally:
+                manifest.close()
+        counts, failed = asyncio.run(run())
+        assert counts['deleted'] == 1
+        assert failed == []
+        assert self._uploaded_ids() == ['unknown_undefined_a.ipynb']
+        query = self.mock_nbsearchdb().iter_query.call_args
+        assert query[0] == ('jupyter-cell', 'notebook_filename:"b.ipynb"')
+        assert query[1]['fq'] == ['index:0', 'notebook_server:"http://test/server"']
+        self.mock_nbsearchdb().delete_files.assert_awaited_once_with(['unknown_undefined_b.ipynb'])
+        manifest = Manifest(manifest_path)
+        assert manifest.get('http://test/server', 'b.ipynb') is None
+        manifest.close()
+
+    def test_watch_retries_failed_batch(self):
+        handler = self._handler(watch_debounce=0.05)
+        applied = []
+
+        async def run():
+            watcher = _QueueWatcher(LocalSource())
+            done = asyncio.Event()
+
+            async def apply_changes(db, executor, source, manifest, paths):
+                applied.append(paths)
+                if len(applied) == 1:
+                    raise RuntimeError('Solr is not available')
+                if len(applied) == 2:
+                    watcher.queue.put_nowait(['c.ipynb'])
+                else:
+                    done.set()
+
+            watcher.queue.put_nowait(['a.ipynb', 'b.ipynb'])
+            with mock.patch('nbsearch.db.create_watcher', return_value=watcher), \
+                    mock.patch.object(handler, '_apply_changes', side_effect=apply_changes):
+                task = asyncio.ensure_future(handler.watch(self.config_path, 'local'))
+                await asyncio.wait_for(done.wait(), 5)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+        asyncio.run(run())
+        # The watcher keeps running and applies the failed batch again
+        assert applied == [['a.ipynb', 'b.ipynb'], ['a.ipynb', 'b.ipynb'], ['c.ipynb']]
+        self.mock_nbsearchdb().close.assert_awaited_once()
+
+    def test_watch_backs_off_failed_batches(self):
+        handler = self._handler(watch_debounce=0.01, watch_retry_max_interval=0.02)
+        applied = []
+
+        async def run():
+            watcher = _QueueWatcher(LocalSource())
+            done = asyncio.Event()
+
+            async def apply_changes(db, executor, source, manifest, paths):
+                applied.append(paths)
+                if len(applied) < 4:
+                    raise RuntimeError('Solr is not available')
+                done.set()
+
+            watcher.queue.put_nowait(['a.ipynb'])
+            with mock.patch('nbsearch.db.create_watcher', return_value=watcher), \
+                    mock.patch.object(handler, '_apply_changes', side_effect=apply_changes), \
+                    mock.patch.object(handler.log, 'exception') as log_exception:
+                task = asyncio.ensure_future(handler.watch(self.config_path, 'local'))
+                await asyncio.wait_for(done.wait(), 5)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+            return [c[0][0] for c in log_exception.call_args_list]
+        messages = asyncio.run(run())
+        assert applied == [['a.ipynb']] * 4
+        # The delay doubles up to watch_retry_max_interval
+        assert messages == [
+            'failed to apply changes, retrying in {:.1f}s: a.ipynb'.format(delay)
+            for delay in [0.01, 0.02, 0.02]
+        ]
+
+    def test_update_notebooks(self):
+        os.mkdir(os.path.join(self.base_dir, 'sub'))
+        _write_notebook(os.path.join(self.base_dir, 'a.ipynb'), 'print(1)')
+        _write_notebook(os.path.join(self.base_dir, 'sub', 'a.ipynb'), 'print(2)')
+        self.indexed_cells = [_indexed('b.ipynb')[1]]
+
+        handler = self._handler()
+        with mock.patch.object(LocalSource, 'get_files', side_effect=AssertionError('crawled')):
+            result = asyncio.run(handler.update(self.config_path, 'local', [
+                os.path.join(self.base_dir, 'sub', 'a.ipynb'),
+                'b.ipynb',
+            ]))
+        assert result['removed'] == 1
+        assert result['deleted'] == 1
+        assert self._uploaded_ids() == ['unknown_undefined_a.ipynb']
+        content = self.uploaded_contents['unknown_undefined_a.ipynb']
+        assert b'print(2)' in content
+        self.mock_nbsearchdb().delete_files.assert_awaited_once_with(['unknown_undefined_b.ipynb'])
+        self.mock_nbsearchdb().close.assert_awaited_once()
+
+    def test_update_notebooks_outside_base_dir(self):
+        handler = self._handler()
+        handler.update_config(Config({'LocalSource': {'base_dir': self.base_dir}}))
+        with pytest.raises(ValueError):
+            asyncio.run(handler.update_notebooks('local', [os.path.join(self.tempdir.name, 'a.ipynb')]))
+
+    def test_update_notebooks_removed_in_subdirectory(self):
+        os.mkdir(os.path.join(self.base_dir, 'sub'))
+        self.indexed_cells = [
+            {'notebook_id': 'SUB_B', 'notebook_filename': 'sub/b.ipynb', 'notebook_server': 'http://test/server'},
+            # Notebooks with the same name in other directories
+            {'notebook_id': 'OTHER_B', 'notebook_filename': 'other/b.ipynb', 'notebook_server': 'http://test/server'},
+            {'notebook_id': 'TOP_B', 'notebook_filename': 'b.ipynb', 'notebook_server': 'http://test/server'},
+        ]
+
+        handler = self._handler()
+        result = asyncio.run(handler.update(self.config_path, 'local', [os.path.join('sub', 'b.ipynb')]))
+        assert result['removed'] == 1
+        assert result['deleted'] == 1
+        self.mock_nbsearchdb().delete_files.assert_awaited_once_with(['SUB_B'])
+
+    def test_update_notebooks_removed_with_same_name(self):
+        self.indexed_cells = [
+            {'notebook_id': 'SUB_B', 'notebook_filename': 'sub/b.ipynb', 'notebook_server': 'http://test/server'},
+            {'notebook_id': 'TOP_B', 'notebook_filename': 'b.ipynb', 'notebook_server': 'http://test/server'},
+        ]
+
+        handler = self._handler()
+        result = asyncio.run(handler.update(self.config_path, 'local', ['b.ipynb']))
+        assert result['deleted'] == 1
+        self.mock_nbsearchdb().delete_files.assert_awaited_once_with(['TOP_B'])
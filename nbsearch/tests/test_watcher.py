@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import mock
+
+import pytest
+
+from nbsearch.source import LocalSource
+from nbsearch.watcher import PollingWatcher, InotifyWatcher, debounce
+
+
+def _write_notebook(path):
+    with open(path, 'w') as f:
+        f.write(json.dumps({'cells': [], 'metadata': {}}))
+
+def _source(base_dir):
+    source = LocalSource()
+    source.server = 'http://test/server'
+    source.base_dir = base_dir
+    return source
+
+
+class _QueueWatcher:
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    async def get(self):
+        return await self.queue.get()
+
+
+def test_debounce():
+    async def run():
+        watcher = _QueueWatcher()
+        batches = debounce(watcher, 0.1)
+        watcher.queue.put_nowait(['a.ipynb'])
+        watcher.queue.put_nowait(['b.ipynb', 'a.ipynb'])
+        first = await asyncio.wait_for(batches.__anext__(), 1)
+        # Continuous changes are held until they settle
+        for _ in range(3):
+            watcher.queue.put_nowait(['c.ipynb'])
+            await asyncio.sleep(0.05)
+        second = await asyncio.wait_for(batches.__anext__(), 1)
+        await batches.aclose()
+        return first, second
+    first, second = asyncio.run(run())
+    assert first == ['a.ipynb', 'b.ipynb']
+    assert second == ['c.ipynb']
+
+
+def _collect(watcher, action, timeout=2):
+    async def run():
+        watcher.start()
+        try:
+            await asyncio.sleep(0.1)
+            action()
+            changed = set()
+            wait = timeout
+            try:
+                while True:
+                    changed.update(await asyncio.wait_for(watcher.get(), wait))
+                    wait = 0.3
+            except asyncio.TimeoutError:
+                pass
+            return changed
+        finally:
+            watcher.close()
+    return asyncio.run(run())
+
+
+def test_polling_watcher():
+    with tempfile.TemporaryDirectory() as tempdirname:
+        _write_notebook(os.path.join(tempdirname, 'a.ipynb'))
+        _write_notebook(os.path.join(tempdirname, 'b.ipynb'))
+        with open(os.path.join(tempdirname, '.nbsearchignore'), 'w') as f:
+            f.write('ignored.ipynb\n')
+
+        def action():
+            _write_notebook(os.path.join(tempdirname, 'c.ipynb'))
+            _write_notebook(os.path.join(tempdirname, 'ignored.ipynb'))
+            os.remove(os.path.join(tempdirname, 'b.ipynb'))
+
+        changed = _collect(PollingWatcher(_source(tempdirname), poll_interval=0.05), action)
+        assert changed == {'b.ipynb', 'c.ipynb'}
+
+
+def test_inotify_watcher():
+    pytest.importorskip('inotify_simple')
+    with tempfile.TemporaryDirectory() as tempdirname:
+        os.mkdir(os.path.join(tempdirname, 'sub'))
+        _write_notebook(os.path.join(tempdirname, 'sub', 'a.ipynb'))
+        with open(os.path.join(tempdirname, '.nbsearchignore'), 'w') as f:
+            f.write('ignored.ipynb\n')
+
+        def action():
+            _write_notebook(os.path.join(tempdirname, 'sub', 'a.ipynb'))
+            _write_notebook(os.path.join(tempdirname, 'ignored.ipynb'))
+            # Saved atomically through a hidden temporary file
+            _write_notebook(os.path.join(tempdirname, '.~b.ipynb'))
+            os.replace(os.path.join(tempdirname, '.~b.ipynb'), os.path.join(tempdirname, 'b.ipynb'))
+            os.mkdir(os.path.join(tempdirname, 'new'))
+            _write_notebook(os.path.join(tempdirname, 'new', 'c.ipynb'))
+
+        changed = _collect(InotifyWatcher(_source(tempdirname)), action)
+        assert changed == {os.path.join('sub', 'a.ipynb'), 'b.ipynb', os.path.join('new', 'c.ipynb')}
+
+
+def test_inotify_watcher_polls_unwatchable_directories():
+    inotify_simple = pytest.importorskip('inotify_simple')
+    with tempfile.TemporaryDirectory() as tempdirname:
+        os.mkdir(os.path.join(tempdirname, 'sub'))
+        add_watch = inotify_simple.INotify.add_watch
+
+        def limited_add_watch(self, path, mask):
+            if os.path.basename(path) == 'sub':
+                raise OSError(28, 'No space left on device')
+            return add_watch(self, path, mask)
+
+        def action():
+            _write_notebook(os.path.join(tempdirname, 'sub', 'a.ipynb'))
+
+        log = mock.Mock()
+        watcher = InotifyWatcher(_source(tempdirname), poll_interval=0.05, log=log)
+        with mock.patch.object(inotify_simple.INotify, 'add_watch', limited_add_watch):
+            changed = _collect(watcher, action)
+        assert changed == {os.path.join('sub', 'a.ipynb')}
+        log.warning.assert_called_once()
+
+
+def test_inotify_watcher_rescans_on_overflow():
+    inotify_simple = pytest.importorskip('inotify_simple')
+    with tempfile.TemporaryDirectory() as tempdirname:
+        os.mkdir(os.path.join(tempdirname, 'sub'))
+        _write_notebook(os.path.join(tempdirname, 'sub', 'a.ipynb'))
+        _write_notebook(os.path.join(tempdirname, 'b.ipynb'))
+
+        async def run():
+            watcher = InotifyWatcher(_source(tempdirname), log=mock.Mock())
+            watcher.start()
+            try:
+                os.remove(os.path.join(tempdirname, 'b.ipynb'))
+                _write_notebook(os.path.join(tempdirname, 'c.ipynb'))
+                # The events have been lost
+                overflow = inotify_simple.Event(wd=-1, mask=inotify_simple.flags.Q_OVERFLOW, cookie=0, name='')
+                with mock.patch.object(watcher.inotify, 'read', return_value=[overflow]):
+                    watcher._read()
+                return set(watcher.queue.get_nowait())
+            finally:
+                watcher.close()
+        changed = asyncio.run(run())
+        assert changed == {os.path.join('sub', 'a.ipynb'), 'b.ipynb', 'c.ipynb'}
+
+
+def test_inotify_watcher_directory_removed_while_added():
+    pytest.importorskip('inotify_simple')
+    with tempfile.TemporaryDirectory() as tempdirname:
+        os.mkdir(os.path.join(tempdirname, 'sub'))
+        scandir = os.scandir
+
+        def removed_scandir(path):
+            if os.path.basename(path) == 'sub':
+                raise FileNotFoundError(path)
+            return scandir(path)
+
+        async def run():
+            watcher = InotifyWatcher(_source(tempdirname))
+            with mock.patch('os.scandir', removed_scandir):
+                watcher.start()
+            watcher.close()
+        asyncio.run(run())
@@ -1,7 +1,9 @@
+import codecs
 from datetime import datetime
 import json
 import os
 from stat import S_IREAD
+from uuid import uuid4
 
 from jupyter_server.base.handlers import APIHandler
 from tornado import web
@@ -12,6 +14,80 @@ import tornado.web
 
 NBSEARCH_TMP = 'nbsearch-tmp'
 
+# Progress of the imports in progress
+IMPORTS = {}
+
+# Fields returned by the summary mode of the search API
+SUMMARY_FIELDS = {
+    'cell': ['id', 'notebook_id', 'index', 'cell_type'],
+    'notebook': ['id', 'filename'],
+}
+# Stored fields from which the snippet is taken, the first one found is used
+SNIPPET_FIELDS = {
+    'cell': ['source__markdown', 'source__code'],
+    'notebook': ['source__markdown__heading'],
+}
+DEFAULT_SNIPPET_LENGTH = 200
+
+# Stored fields which are highlighted by default
+# (the aggregated source and outputs fields are not stored, so their subfields are used)
+HIGHLIGHT_FIELDS = {
+    'cell': [
+        'source__code',
+        'source__markdown',
+        'source__markdown__heading',
+        'outputs__stdout',
+        'outputs__stderr',
+        'outputs__result_plain',
+        'outputs__result_html',
+    ],
+    'notebook': [
+        'source__markdown__heading',
+        'source__markdown__operation_note',
+        'source__markdown__todo',
+        'source__markdown__about',
+    ],
+}
+
+
+# Facets available for each target
+# (owner and server are faceted on the untokenized copies which have docValues)
+FACET_FIELDS = {
+    'cell': {
+        'owner': 'notebook_owner__facet',
+        'server': 'notebook_server__facet',
+        'cell_type': 'cell_type',
+        'hashtags': 'source__markdown__hashtags',
+    },
+    'notebook': {
+        'owner': 'owner__facet',
+        'server': 'server__facet',
+        'hashtags': 'source__markdown__hashtags',
+    },
+}
+FACET_DATE_FIELDS = {
+    'cell': 'estimated_mtime',
+    'notebook': 'mtime',
+}
+DEFAULT_FACET_LIMIT = 10
+# Rounded to the day so that the facet queries can be reused from the caches of Solr
+DEFAULT_FACET_DATE_START = 'NOW/DAY-1YEAR'
+DEFAULT_FACET_DATE_END = 'NOW/DAY+1DAY'
+DEFAULT_FACET_DATE_GAP = '+1MONTH'
+
+
+def _to_facet_buckets(facet):
+    return [{'value': bucket['val'], 'count': bucket['count']} for bucket in facet.get('buckets', [])]
+
+
+def _to_summary(doc, fields, snippet_fields, snippet_length):
+    summary = dict([(k, doc[k]) for k in fields if k in doc])
+    snippet = next((doc[k] for k in snippet_fields if k in doc), '')
+    if len(snippet) > snippet_length:
+        snippet = snippet[:snippet_length] + '...'
+    summary['snippet'] = snippet
+    return summary
+
 
 class SearchHandler(APIHandler):
     def initialize(self, db, base_dir):
@@ -23,16 +99,63 @@ class SearchHandler(APIHandler):
         sort = self.get_query_argument('sort', None)
         query = self.get_query_argument('query')
         q_op = self.get_query_argument('q_op', 'AND')
+        fq = self.get_query_arguments('fq')
+        mode = self.get_query_argument('mode', 'full')
+        fl = self.get_query_argument('fl', None)
+        fields = None
+        if fl is not None:
+            fields = [f.strip() for f in fl.split(',') if len(f.strip()) > 0]
+        if mode == 'summary':
+            if target not in SUMMARY_FIELDS:
+                raise web.HTTPError(400, f'Unknown target: {target}')
+            fields = SUMMARY_FIELDS[target] + SNIPPET_FIELDS[target]
+            snippet_length = int(self.get_query_argument('snippet_length', str(DEFAULT_SNIPPET_LENGTH)))
+        elif mode != 'full':
+            raise web.HTTPError(400, f'Unknown mode: {mode}')
+        highlight = None
+        if self.get_query_argument('highlight', 'false').lower() == 'true':
+            if target not in HIGHLIGHT_FIELDS:
+                raise web.HTTPError(400, f'Unknown target: {target}')
+            hl_fields = self.get_query_argument('hl_fields', None)
+            if hl_fields is not None:
+                highlight = [f.strip() for f in hl_fields.split(',') if len(f.strip()) > 0]
+            else:
+                highlight = HIGHLIGHT_FIELDS[target]
+            if fields is not None and 'id' not in fields:
+                # Snippets are associated with the documents by id
+                fields = fields + ['id']
+        hl_fragsize = self.get_query_argument('hl_fragsize', None)
+        hl_snippets = self.get_query_argument('hl_snippets', None)
+        # Cursor-based paging; '*' for the first page, then nextCursor of the previous response
+        cursor = self.get_query_argument('cursor', None)
+        facets = self._get_facets(target)
         solrquery, result = await self.db.query(
             f'jupyter-{target}',
             query,
             q_op=q_op,
             start=start,
             rows=limit,
-            sort=sort
+            sort=sort,
+            fl=fields,
+            highlight=highlight,
+            highlight_fragment_size=int(hl_fragsize) if hl_fragsize is not None else None,
+            highlight_snippets=int(hl_snippets) if hl_snippets is not None else None,
+            cursor_mark=cursor,
+            facets=facets,
+            fq=fq,
+            use_cache=True,
         )
+        docs = result['response']['docs'] if 'response' in result else None
+        if docs is not None and mode == 'summary':
+            docs = [
+                _to_summary(doc, SUMMARY_FIELDS[target], SNIPPET_FIELDS[target], snippet_length)
+                for doc in docs
+            ]
+        if docs is not None and highlight is not None:
+            highlighting = result.get('highlighting', {})
+            docs = [dict(doc, highlights=highlighting.get(doc.get('id'), {})) for doc in docs]
         resp = {
-            '{}s'.format(target): result['response']['docs'] if 'response' in result else None,
+            '{}s'.format(target): docs,
             'limit': limit,
             'size': result['response']['numFound'] if 'response' in result else limit,
             'start': result['response']['start'] if 'response' in result else start,
@@ -41,6 +164,15 @@ class SearchHandler(APIHandler):
             'solrquery': solrquery,
             'error': result['error'] if 'error' in result else None,
         }
+        if cursor is not None:
+            resp['cursor'] = cursor
+            resp['nextCursor'] = result.get('nextCursorMark')
+        if facets is not None:
+            facet_result = result.get('facets', {})
+            resp['facets'] = dict([
+                (name, _to_facet_buckets(facet_result.get(name, {})))
+                for name in facets.keys()
+            ])
         self.write(resp)
 
     def _get_page(self):
@@ -48,6 +180,119 @@ class SearchHandler(APIHandler):
         limit = self.get_query_argument('limit', '50')
         return int(start), int(limit)
 
+    def _get_facets(self, target):
+        names = self.get_query_argument('facet', None)
+        if names is None:
+            return None
+        if target not in FACET_FIELDS:
+            raise web.HTTPError(400, f'Unknown target: {target}')
+        fields = FACET_FIELDS[target]
+        date_field = FACET_DATE_FIELDS[target]
+        names = [n.strip() for n in names.split(',') if len(n.strip()) > 0]
+        limit = int(self.get_query_argument('facet_limit', str(DEFAULT_FACET_LIMIT)))
+        facets = {}
+        for name in names:
+            if name in fields:
+                facets[name] = {
+                    'type': 'terms',
+                    'field': fields[name],
+                    'limit': limit,
+                    'mincount': 1,
+                }
+            elif name == date_field:
+                facets[name] = {
+                    'type': 'range',
+                    'field': date_field,
+                    'start': self.get_query_argument('facet_date_start', DEFAULT_FACET_DATE_START),
+                    'end': self.get_query_argument('facet_date_end', DEFAULT_FACET_DATE_END),
+                    'gap': self.get_query_argument('facet_date_gap', DEFAULT_FACET_DATE_GAP),
+                }
+            else:
+                raise web.HTTPError(400, f'Unknown facet: {name}')
+        return facets
+
+
+class ExportHandler(APIHandler):
+    def initialize(self, db, base_dir):
+        self.db = db
+
+    @web.authenticated
+    async def get(self, target):
+        """
+        Export all documents matching the query as NDJSON
+
+        The result set is walked with cursors and written out page by page,
+        so the memory usage does not depend on the number of documents.
+        """
+        if target not in SUMMARY_FIELDS:
+            raise web.HTTPError(400, f'Unknown target: {target}')
+        query = self.get_query_argument('query')
+        q_op = self.get_query_argument('q_op', 'AND')
+        fq = self.get_query_arguments('fq')
+        sort = self.get_query_argument('sort', None)
+        fl = self.get_query_argument('fl', None)
+        fields = None
+        if fl is not None:
+            fields = [f.strip() for f in fl.split(',') if len(f.strip()) > 0]
+        self.set_header('Content-Type', 'application/x-ndjson')
+        pages = self.db.iter_query(
+            f'jupyter-{target}',
+            query,
+            q_op=q_op,
+            sort=sort,
+            fl=fields,
+            fq=fq,
+        )
+        try:
+            async for docs in pages:
+                self.write(''.join([json.dumps(doc) + '\n' for doc in docs]))
+                await self.flush()
+        finally:
+            await pages.aclose()
+
+
+class ReindexHandler(APIHandler):
+    def initialize(self, db, base_dir, indexer):
+        self.db = db
+        self.base_dir = base_dir
+        self.indexer = indexer
+
+    @web.authenticated
+    async def post(self):
+        """
+        Update the indices of the notebooks given as paths relative to the server root
+
+        The notebooks are read and posted directly without crawling the
+        source, e.g. when they have been saved.
+        """
+        body = self.get_json_body() or {}
+        paths = body.get('paths')
+        if not isinstance(paths, list) or len(paths) == 0 or \
+                not all([isinstance(path, str) for path in paths]):
+            raise web.HTTPError(400, 'paths must be a non-empty list of strings')
+        actual_paths = [os.path.normpath(os.path.join(self.base_dir, path.lstrip('/'))) for path in paths]
+        try:
+            counts = await self.indexer.update_notebooks(
+                self.indexer.reindex_source,
+                actual_paths,
+                db=self.db,
+                use_processes=False,
+            )
+        except ValueError as e:
+            raise web.HTTPError(400, str(e))
+        except RuntimeError as e:
+            raise web.HTTPError(500, str(e))
+        self.write(counts)
+
+
+class SearchCacheHandler(APIHandler):
+    def initialize(self, db, base_dir):
+        self.db = db
+
+    @web.authenticated
+    async def get(self):
+        self.write(self.db.search_cache.stats())
+
 
 class ImportHandler(APIHandler):
     def initialize(self, db, base_dir):
@@ -93,19 +338,61 @@ class ImportHandler(APIHandler):
         if path is not None and self._has_special(path):
             raise tornado.web.HTTPError(400)
         path = path if path is not None else '.'
-        filename = self._unique_filename(path, filename)
         to_tmp = False
         if path == NBSEARCH_TMP:
             os.makedirs(os.path.join(self.base_dir, NBSEARCH_TMP),
                         exist_ok=True)
             to_tmp = True
-        full_path = os.path.join(self.base_dir, path, filename)
-        with open(full_path, 'wb') as f:
-            await self.db.download_file(id, f)
+        # Download into a hidden file, which is not indexed, and rename it when completed
+        tmp_path = os.path.join(self.base_dir, path, f'.{filename}.{uuid4().hex}.nbsearch-import')
+        progress = {
+            'id': id,
+            'path': path,
+            'filename': filename,
+            'received': 0,
+            'total': None,
+        }
+        import_key = uuid4().hex
+        IMPORTS[import_key] = progress
+        try:
+            await self._download(id, tmp_path, progress)
+            filename = self._unique_filename(path, filename)
+            full_path = os.path.join(self.base_dir, path, filename)
+            os.replace(tmp_path, full_path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            del IMPORTS[import_key]
         if to_tmp:
             os.chmod(full_path, S_IREAD)
         self.write({'filename': filename})
 
+    async def _download(self, id, tmp_path, progress):
+        def _update_progress(received, total):
+            progress['received'] = received
+            progress['total'] = total
+        loop = tornado.ioloop.IOLoop.current()
+        # File operations are delegated to the thread pool to keep the event loop responsive
+        f = await loop.run_in_executor(None, open, tmp_path, 'xb')
+        try:
+            async for chunk in self.db.stream_file(id, progress=_update_progress):
+                await loop.run_in_executor(None, f.write, chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+        self.log.debug('downloaded {} ({} bytes)'.format(id, progress['received']))
+
+
+class ImportProgressHandler(APIHandler):
+    def initialize(self, db, base_dir):
+        self.db = db
+        self.base_dir = base_dir
+
+    @web.authenticated
+    async def get(self):
+        self.write({'imports': list(IMPORTS.values())})
+
 
 class DataHandler(APIHandler):
     def initialize(self, db, base_dir):
@@ -116,6 +403,11 @@ class DataHandler(APIHandler):
     async def get(self, id):
         """
         Get notebook data as JSON response without saving to disk
+
+        The notebook stored on S3 is forwarded in chunks and wrapped with the
+        metadata from Solr without being parsed. Unless `validate=false` is
+        given, the content is checked incrementally to be UTF-8 text which
+        starts with a JSON object.
         """
         solrquery, result = await self.db.query(
             'jupyter-notebook',
@@ -126,37 +418,53 @@ class DataHandler(APIHandler):
             raise tornado.web.HTTPError(404)
 
         notebook = docs[0]
+        _, filename = os.path.split(notebook['filename'])
+        metadata = {
+            'id': id,
+            'filename': filename,
+            'original_path': notebook['filename'],
+            'owner': notebook.get('owner'),
+            'server': notebook.get('signature_server_url'),
+            'modified': notebook.get('mtime')
+        }
+        validate = self.get_query_argument('validate', 'true').lower() != 'false'
+        decoder = codecs.getincrementaldecoder('utf-8')() if validate else None
 
-        # Create a temporary file-like object to capture the notebook data
-        from io import BytesIO
-        notebook_data = BytesIO()
-
-        # Download notebook data to memory
-        await self.db.download_file(id, notebook_data)
-
-        # Get the raw notebook content
-        notebook_data.seek(0)
-        notebook_content = notebook_data.read()
-
+        started = False
+        # Chunks which are held back until the beginning of the content is verified
+        held = []
+        chunks = self.db.stream_file(id)
         try:
-            # Parse as JSON to validate and format
-            notebook_json = json.loads(notebook_content.decode('utf-8'))
-
-            # Add metadata from Solr
-            _, filename = os.path.split(notebook['filename'])
-            response = {
-                'notebook': notebook_json,
-                'metadata': {
-                    'id': id,
-                    'filename': filename,
-                    'original_path': notebook['filename'],
-                    'owner': notebook.get('owner'),
-                    'server': notebook.get('signature_server_url'),
-                    'modified': notebook.get('mtime')
-                }
-            }
+            async for chunk in chunks:
+                if decoder is not None:
+                    text = self._decode(decoder, chunk, started)
+                    if not started:
+                        held.append(chunk)
+                        head = text.lstrip()
+                        if len(head) == 0:
+                            continue
+                        if not head.startswith('{'):
+                            raise tornado.web.HTTPError(400, "Invalid notebook format: not a JSON object")
+                        chunk = b''.join(held)
+                if not started:
+                    self.set_header('Content-Type', 'application/json')
+                    self.write(b'{"notebook": ')
+                    started = True
+                self.write(chunk)
+                await self.flush()
+        finally:
+            await chunks.aclose()
+        if decoder is not None:
+            self._decode(decoder, b'', started, final=True)
+        if not started:
+            raise tornado.web.HTTPError(400, "Invalid notebook format: empty content")
+        self.write(b', "metadata": ' + json.dumps(metadata).encode('utf-8') + b'}')
 
-            self.write(response)
-
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+    def _decode(self, decoder, chunk, started, final=False):
+        try:
+            return decoder.decode(chunk, final=final)
+        except UnicodeDecodeError as e:
+            if started:
+                # The response has already been sent partially
+                raise
             raise tornado.web.HTTPError(400, f"Invalid notebook format: {str(e)}")
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+def create_watcher(source, method='auto', poll_interval=10, log=None):
+    """Create a watcher which reports the paths of the notebooks changed on the source
+
+    inotify is used for a LocalSource if `inotify_simple` is installed,
+    otherwise the source is crawled periodically.
+    """
+    if method not in ['auto', 'inotify', 'polling']:
+        raise ValueError('Unknown watch method: {}'.format(method))
+    use_inotify = method != 'polling' and inotify_simple is not None and hasattr(source, 'base_dir')
+    if method == 'inotify' and not use_inotify:
+        raise RuntimeError('inotify is not available, install inotify_simple')
+    if use_inotify:
+        return InotifyWatcher(source, poll_interval=poll_interval, log=log)
+    return PollingWatcher(source, poll_interval, log=log)
+
+
+async def debounce(watcher, delay, clock=time.monotonic):
+    """Yield the changed paths in batches once each of them has been quiet for `delay` seconds"""
+    pending = {}
+    while True:
+        timeout = None
+        if len(pending) > 0:
+            timeout = max(0, min(pending.values()) + delay - clock())
+        try:
+            paths = await asyncio.wait_for(watcher.get(), timeout)
+            now = clock()
+            for path in paths:
+                pending[path] = now
+        except asyncio.TimeoutError:
+            pass
+        now = clock()
+        ready = sorted([path for path, changed in pending.items() if now - changed >= delay])
+        if len(ready) == 0:
+            continue
+        for path in ready:
+            del pending[path]
+        yield ready
+
+
+class Watcher:
+
+    def __init__(self, source, log=None):
+        self.source = source
+        self.queue = asyncio.Queue()
+        self.log = log if log is not None else logging.getLogger(__name__)
+
+    async def get(self):
+        """Wait for the paths of notebooks which have been changed"""
+        return await self.queue.get()
+
+    def start(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def retry(self, paths):
+        """Report the paths again, e.g. after failing to apply their changes"""
+        self.queue.put_nowait(list(paths))
+
+    def _notify(self, paths):
+        paths = [path for path in paths
+                 if path.lower().endswith('.ipynb') and not self.source.is_ignored(path)]
+        if len(paths) > 0:
+            self.queue.put_nowait(paths)
+
+
+class PollingWatcher(Watcher):
+    """Detects changes by comparing the mtime and size of the crawled notebooks"""
+
+    def __init__(self, source, poll_interval=10, log=None):
+        super(PollingWatcher, self).__init__(source, log=log)
+        self.poll_interval = poll_interval
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._poll())
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, self._snapshot)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = await loop.run_in_executor(None, self._snapshot)
+            changed = [path for path, stat in current.items() if snapshot.get(path) != stat]
+            changed += [path for path in snapshot.keys() if path not in current]
+            snapshot = current
+            self._notify(changed)
+
+    def _snapshot(self):
+        return dict([(file['path'], (file['mtime_ns'], file['size']))
+                     for file in self.source.get_files()])
+
+
+class InotifyWatcher(Watcher):
+    """Detects changes with inotify on the directories under base_dir of a LocalSource
+
+    Directories which cannot be watched, e.g. beyond the limit of
+    max_user_watches, are crawled every `poll_interval` seconds instead.
+    """
+
+    def __init__(self, source, poll_interval=10, log=None):
+        super(InotifyWatcher, self).__init__(source, log=log)
+        self.poll_interval = poll_interval
+        self.inotify = None
+        self.directories = {}
+        # Snapshots of the directories which are polled instead of watched
+        self.unwatched = {}
+        # Notebooks which have been seen, to find the removed ones on a rescan
+        self.notebooks = set()
+        self.task = None
+
+    def start(self):
+        flags = inotify_simple.flags
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | \
+            flags.CREATE | flags.DELETE | flags.DELETE_SELF
+        self.inotify = inotify_simple.INotify()
+        self.notebooks = set(_notebooks(self._add_directory('')))
+        asyncio.get_running_loop().add_reader(self.inotify.fileno(), self._read)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.inotify is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.inotify.fileno())
+        self.inotify.close()
+        self.inotify = None
+
+    def _add_directory(self, path):
+        """Watch the directory and its subdirectories, returning the notebooks found in them"""
+        if len(path) > 0 and self.source.is_ignored(path):
+            return []
+        actual_path = os.path.join(self.source.base_dir, path)
+        try:
+            wd = self.inotify.add_watch(actual_path, self.mask)
+        except OSError as e:
+            if not os.path.isdir(actual_path):
+                return []
+            self.log.warning('cannot watch {}, polling it instead: {}'.format(actual_path, e))
+            return self._poll_directory(path)
+        self.directories[wd] = path
+        self.unwatched.pop(path, None)
+        found = []
+        try:
+            entries = list(os.scandir(actual_path))
+        except OSError:
+            # Removed after it has been watched
+            return found
+        for entry in entries:
+            entry_path = os.path.join(path, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                found += self._add_directory(entry_path)
+            elif entry.is_file():
+                found.append(entry_path)
+        return found
+
+    def _poll_directory(self, path):
+        snapshot = self._snapshot(path)
+        self.unwatched[path] = snapshot
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._poll())
+        return list(snapshot.keys())
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for path, snapshot in list(self.unwatched.items()):
+                current = await loop.run_in_executor(None, self._snapshot, path)
+                changed = [p for p, stat in current.items() if snapshot.get(p) != stat]
+                changed += [p for p in snapshot.keys() if p not in current]
+                self.unwatched[path] = current
+                self._notify(changed)
+
+    def _snapshot(self, path):
+        snapshot = {}
+        for actual_dir, dirnames, filenames in os.walk(os.path.join(self.source.base_dir, path)):
+            dir_path = os.path.relpath(actual_dir, self.source.base_dir)
+            if dir_path == os.curdir:
+                dir_path = ''
+            dirnames[:] = [name for name in dirnames
+                           if not self.source.is_ignored(os.path.join(dir_path, name))]
+            for name in _notebooks(filenames):
+                try:
+                    stat = os.stat(os.path.join(actual_dir, name))
+                except OSError:
+                    continue
+                snapshot[os.path.join(dir_path, name)] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _rescan(self):
+        """Report all the notebooks after events have been lost by the overflow of the queue"""
+        self.log.warning('inotify event queue overflowed, rescanning {}'.format(self.source.base_dir))
+        current = set(_notebooks(self._add_directory('')))
+        changed = list(current | self.notebooks)
+        self.notebooks = current
+        return changed
+
+    def _read(self):
+        flags = inotify_simple.flags
+        changed = []
+        overflowed = False
+        for event in self.inotify.read(timeout=0):
+            if event.mask & flags.Q_OVERFLOW:
+                overflowed = True
+                continue
+            if event.mask & flags.IGNORED:
+                self.directories.pop(event.wd, None)
+                continue
+            directory = self.directories.get(event.wd)
+            if directory is None or len(event.name) == 0:
+                continue
+            path = os.path.join(directory, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # Notebooks may be moved in with the directory
+                    changed += self._add_directory(path)
+                continue
+            changed.append(path)
+        if overflowed:
+            changed += self._rescan()
+        self.notebooks.update(_notebooks(changed))
+        self._notify(changed)
+
+
+def _notebooks(paths):
+    return [path for path in paths if path.lower().endswith('.ipynb')]
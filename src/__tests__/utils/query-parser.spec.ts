@@ -5,7 +5,10 @@ import {
   simplifySolrQuery,
   expandSimplifiedQuery
 } from '../../utils/query-parser';
-import { Composition } from '../../components/query/fields';
+import {
+  Composition,
+  compositeToSolrQuery
+} from '../../components/query/fields';
 import { IndexedColumnId } from '../../components/result/result';
 
 describe('Query Parser', () => {
@@ -198,6 +201,67 @@ describe('Query Parser', () => {
     });
   });
 
+  describe('compositeToSolrQuery', () => {
+    it('should send structural constraints as filter queries', () => {
+      const result = compositeToSolrQuery({
+        composition: Composition.And,
+        fields: [
+          {
+            target: IndexedColumnId.Owner,
+            query: 'yazawa'
+          },
+          {
+            target: IndexedColumnId.Cells,
+            query: 'pandas'
+          },
+          {
+            target: IndexedColumnId.Modified,
+            query: '[NOW-1YEAR TO NOW]'
+          }
+        ]
+      });
+      expect(result).toEqual({
+        queryString: 'source:pandas',
+        filterQueries: ['owner:yazawa', 'mtime:[NOW-1YEAR TO NOW]']
+      });
+    });
+
+    it('should keep all constraints in the query with OR', () => {
+      const result = compositeToSolrQuery({
+        composition: Composition.Or,
+        fields: [
+          {
+            target: IndexedColumnId.Owner,
+            query: 'yazawa'
+          },
+          {
+            target: IndexedColumnId.Cells,
+            query: 'matplotlib'
+          }
+        ]
+      });
+      expect(result).toEqual({
+        queryString: 'owner:yazawa OR source:matplotlib'
+      });
+    });
+
+    it('should match all documents without free text', () => {
+      const result = compositeToSolrQuery({
+        composition: Composition.And,
+        fields: [
+          {
+            target: IndexedColumnId.Owner,
+            query: 'yazawa'
+          }
+        ]
+      });
+      expect(result).toEqual({
+        queryString: '_text_:*',
+        filterQueries: ['owner:yazawa']
+      });
+    });
+  });
+
   describe('canConvertToStructured', () => {
     it('should return true for simple queries', () => {
       expect(canConvertToStructured('python')).toBe(true);
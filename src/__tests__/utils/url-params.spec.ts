@@ -37,6 +37,13 @@ describe('URL Parameters', () => {
       expect(params.solrquery).toBe('owner:yazawa');
     });
 
+    it('should parse repeated fq parameters', () => {
+      window.location.search =
+        '?solrquery=source:pandas&fq=owner:yazawa&fq=mtime:[NOW-1YEAR TO NOW]';
+      const params = getSearchParamsFromURL();
+      expect(params.fq).toEqual(['owner:yazawa', 'mtime:[NOW-1YEAR TO NOW]']);
+    });
+
     it('should parse sort parameter', () => {
       window.location.search = '?sort=mtime desc';
       const params = getSearchParamsFromURL();
@@ -139,6 +146,38 @@ describe('URL Parameters', () => {
     });
   });
 
+  describe('filter queries', () => {
+    it('should round trip filter queries through the URL', () => {
+      updateURLSearchParams(
+        searchQueryToURLParams({
+          queryString: 'source:pandas',
+          filterQueries: ['owner:yazawa', 'mtime:[NOW-1YEAR TO NOW]']
+        })
+      );
+      const call = (window.history.replaceState as jest.Mock).mock.calls[0];
+      window.location.search = new URL(call[2]).search;
+
+      const query = urlParamsToSearchQuery(getSearchParamsFromURL());
+      expect(query.queryString).toBe('source:pandas');
+      expect(query.filterQueries).toEqual([
+        'owner:yazawa',
+        'mtime:[NOW-1YEAR TO NOW]'
+      ]);
+    });
+
+    it('should remove filter queries which are no longer given', () => {
+      window.location.href =
+        'http://localhost:8889/lab?solrquery=source:pandas&fq=owner:yazawa';
+      updateURLSearchParams(
+        searchQueryToURLParams({
+          queryString: 'source:pandas'
+        })
+      );
+      const call = (window.history.replaceState as jest.Mock).mock.calls[0];
+      expect(call[2]).not.toContain('fq=');
+    });
+  });
+
   describe('hasSearchParams', () => {
     it('should return true when nbsearch=yes', () => {
       window.location.search = '?nbsearch=yes&solrquery=python';
@@ -3,6 +3,8 @@ import { Cell } from '@jupyterlab/cells';
 export type SolrQuery = {
   queryString: string;
   q_op?: string;
+  // Constraints which do not affect the scoring, sent as fq
+  filterQueries?: string[];
 };
 
 export type SolrQueryContext = {
@@ -170,6 +170,17 @@ export const ALL_FIELDS: Field[] = [
   }
 ];
 
+// Fields which only narrow down the results, without affecting the scoring
+const FILTER_FIELDS: IndexedColumnId[] = [
+  IndexedColumnId.Owner,
+  IndexedColumnId.Server,
+  IndexedColumnId.Modified,
+  IndexedColumnId.Executed,
+  IndexedColumnId.EstimatedModifiedTime,
+  IndexedColumnId.NotebookServer,
+  IndexedColumnId.NotebookOwner
+];
+
 type FieldQuery = {
   target: IndexedColumnId;
   query: string;
@@ -180,6 +191,31 @@ export type CompositeQuery = {
   fields: FieldQuery[];
 };
 
+/**
+ * Convert a CompositeQuery to a SolrQuery, keeping the free text in q
+ * and sending the structural constraints as filter queries
+ */
+export function compositeToSolrQuery(composite: CompositeQuery): SolrQuery {
+  // Only the constraints which every result satisfies can be filter queries
+  const isFilter = (field: FieldQuery) =>
+    composite.composition === Composition.And &&
+    FILTER_FIELDS.includes(field.target);
+  const queryString = composite.fields
+    .filter(field => !isFilter(field))
+    .map(field => `${field.target}:${field.query}`)
+    .join(` ${composite.composition} `);
+  const filterQueries = composite.fields
+    .filter(isFilter)
+    .map(field => `${field.target}:${field.query}`);
+  const solrQuery: SolrQuery = {
+    queryString: queryString.length > 0 ? queryString : '_text_:*'
+  };
+  if (filterQueries.length > 0) {
+    solrQuery.filterQueries = filterQueries;
+  }
+  return solrQuery;
+}
+
 export type FieldsQueryProps = {
   onChange?: (query: SolrQuery, compositeQuery: CompositeQuery) => void;
   onSearch?: () => void;
@@ -241,9 +277,6 @@ export function FieldsQuery({
 
   const notifyQueryChange = useCallback(
     (newQueries: FieldQuery[], composition: Composition) => {
-      const solrQuery = newQueries
-        .map(field => `${field.target}:${field.query}`)
-        .join(` ${composition} `);
       const compositeQuery: CompositeQuery = {
         composition,
         fields: newQueries
@@ -251,12 +284,7 @@ export function FieldsQuery({
       if (!onChange) {
         return;
       }
-      onChange(
-        {
-          queryString: solrQuery
-        },
-        compositeQuery
-      );
+      onChange(compositeToSolrQuery(compositeQuery), compositeQuery);
     },
     [onChange]
   );
@@ -1,7 +1,7 @@
 import React, { useCallback, useState, useEffect } from 'react';
 import { Box, Tabs, Tab } from '@mui/material';
 
-import { FieldsQuery, CompositeQuery } from './fields';
+import { FieldsQuery, CompositeQuery, compositeToSolrQuery } from './fields';
 import { SolrQuery } from './base';
 import { RawSolrQuery } from './solr';
 import { IndexedColumnId } from '../result/result';
@@ -42,31 +42,57 @@ function TabPanel(props: TabPanelProps): JSX.Element {
   );
 }
 
+// Join the filter queries to the query string so that they are shown as fields
+function toQueryString(query: SolrQuery): string {
+  const filterQueries = query.filterQueries || [];
+  if (filterQueries.length === 0) {
+    return query.queryString;
+  }
+  if (query.queryString === '_text_:*') {
+    return filterQueries.join(' AND ');
+  }
+  const queryString = query.queryString.includes(' OR ')
+    ? `(${query.queryString})`
+    : query.queryString;
+  return [queryString].concat(filterQueries).join(' AND ');
+}
+
 export function Query({
   onChange,
   onSearch,
   fields,
   initialQuery
 }: QueryProps): JSX.Element {
+  const initialQueryString = initialQuery
+    ? toQueryString(initialQuery)
+    : undefined;
   const [solrQuery, setSolrQuery] = useState<SolrQuery>(
-    initialQuery || { queryString: '_text_:*' }
-  );
-  const [fieldsQuery, setFieldsQuery] = useState<SolrQuery>(
-    initialQuery || { queryString: '_text_:*' }
+    initialQueryString
+      ? { queryString: initialQueryString, q_op: initialQuery?.q_op }
+      : { queryString: '_text_:*' }
   );
+  const [fieldsQuery, setFieldsQuery] = useState<SolrQuery>(() => {
+    const composite = initialQueryString
+      ? parseSolrToComposite(initialQueryString)
+      : null;
+    if (composite) {
+      return compositeToSolrQuery(composite);
+    }
+    return initialQuery || { queryString: '_text_:*' };
+  });
   const [fieldsCompositeQuery, setFieldsCompositeQuery] = useState<
     CompositeQuery | undefined
   >(() => {
-    if (initialQuery?.queryString) {
-      return parseSolrToComposite(initialQuery.queryString) || undefined;
+    if (initialQueryString) {
+      return parseSolrToComposite(initialQueryString) || undefined;
     }
     return undefined;
   });
   const [tabIndex, setTabIndex] = useState<TabIndex>(() => {
     // If initial query can be converted to structured format, use Fields tab
     // Otherwise, use Solr tab
-    if (initialQuery?.queryString) {
-      const composite = parseSolrToComposite(initialQuery.queryString);
+    if (initialQueryString) {
+      const composite = parseSolrToComposite(initialQueryString);
       return composite ? TabIndex.Fields : TabIndex.Solr;
     }
     return TabIndex.Fields;
@@ -91,7 +117,7 @@ export function Query({
       const compositeQuery = parseSolrToComposite(query.queryString);
       if (compositeQuery) {
         // If parseable, update fields query state
-        setFieldsQuery(query);
+        setFieldsQuery(compositeToSolrQuery(compositeQuery));
         setFieldsCompositeQuery(compositeQuery);
       } else {
         // If not parseable, clear the composite query to avoid confusion
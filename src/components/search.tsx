@@ -19,6 +19,8 @@ export type SearchQuery = {
   sortQuery?: SortQuery;
   pageQuery?: PageQuery;
   q_op?: string;
+  // Structural constraints which are sent as Solr filter queries (fq)
+  filterQueries?: string[];
 };
 
 export type SearchProps = {
@@ -84,6 +86,12 @@ export function Search({
     return r;
   }, [solrQuery, sortQuery, pageQuery, defaultQuery, queryContext]);
 
+  // A change of the filter queries alone also starts an auto-search
+  const defaultQueryKey = JSON.stringify([
+    defaultQuery.queryString,
+    defaultQuery.filterQueries || []
+  ]);
+
   const solrQueryChanged = useCallback((query: LazySolrQuery) => {
     setSolrQuery(query);
   }, []);
@@ -105,12 +113,8 @@ export function Search({
 
   // Auto-search when query changes
   useEffect(() => {
-    if (
-      autoSearch &&
-      onSearch &&
-      defaultQuery.queryString !== lastAutoSearchQuery
-    ) {
-      setLastAutoSearchQuery(defaultQuery.queryString);
+    if (autoSearch && onSearch && defaultQueryKey !== lastAutoSearchQuery) {
+      setLastAutoSearchQuery(defaultQueryKey);
       // Use defaultQuery directly for auto-search to avoid timing issues
       const initialSearchQuery: SearchQuery = Object.assign({}, defaultQuery);
       if (sortQuery) {
@@ -127,6 +131,7 @@ export function Search({
     onSearch,
     callSearch,
     defaultQuery,
+    defaultQueryKey,
     sortQuery,
     pageQuery
   ]);
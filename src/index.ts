@@ -17,6 +17,7 @@ import { ReactWidget } from '@jupyterlab/apputils';
 import { LOG_PREFIX } from './utils/constants';
 import { LabSearchHandler } from './handlers/lab-search-handler';
 import { Notebook7SearchHandler } from './handlers/notebook7-search-handler';
+import { reindexNotebooks } from './widgets/handler';
 
 /**
  * Find the CodeCell that contains the magic command by cell content
@@ -60,6 +61,25 @@ async function initialize(
   return { platform, settings };
 }
 
+/**
+ * Update the index of each notebook once it has been saved
+ */
+function reindexOnSave(notebookTracker: INotebookTracker) {
+  notebookTracker.widgetAdded.connect((_, panel) => {
+    panel.context.saveState.connect((context, state) => {
+      if (state !== 'completed') {
+        return;
+      }
+      reindexNotebooks([context.path]).catch(reason => {
+        console.error(
+          `${LOG_PREFIX} Failed to reindex ${context.path}`,
+          reason
+        );
+      });
+    });
+  });
+}
+
 function initWidgets(
   app: JupyterFrontEnd,
   platform: Platform,
@@ -147,6 +167,10 @@ const plugin: JupyterFrontEndPlugin<void> = {
           settings
         );
 
+        if (settings.composite.reindexOnSave) {
+          reindexOnSave(notebookTracker);
+        }
+
         // Set up the search handler
         if (platform.type === PlatformType.JUPYTER_LAB_OR_NOTEBOOK7_NOTEBOOK) {
           // Check if running in Notebook 7 or JupyterLab
@@ -4,6 +4,7 @@ import { IndexedColumnId } from '../components/result/result';
 
 export interface IURLSearchParams {
   solrquery?: string;
+  fq?: string[];
   sort?: string;
   start?: number;
   limit?: number;
@@ -22,6 +23,11 @@ export function getSearchParamsFromURL(): IURLSearchParams {
     result.solrquery = solrquery;
   }
 
+  const fq = params.getAll('fq');
+  if (fq.length > 0) {
+    result.fq = fq;
+  }
+
   const sort = params.get('sort');
   if (sort) {
     result.sort = sort;
@@ -85,6 +91,13 @@ export function applyIURLSearchParamsToURLSearchParams(
     }
   }
 
+  if (params.fq !== undefined) {
+    searchParams.delete('fq');
+    for (const fq of params.fq) {
+      searchParams.append('fq', fq);
+    }
+  }
+
   if (params.sort !== undefined) {
     if (params.sort) {
       searchParams.set('sort', params.sort);
@@ -127,6 +140,7 @@ export function updateURLSearchParams(params: IURLSearchParams): void {
 export function searchQueryToURLParams(query: SearchQuery): IURLSearchParams {
   const params: IURLSearchParams = {
     solrquery: query.queryString,
+    fq: query.filterQueries || [],
     nbsearch: 'yes'
   };
 
@@ -154,6 +168,10 @@ export function urlParamsToSearchQuery(
     query.queryString = params.solrquery;
   }
 
+  if (params.fq) {
+    query.filterQueries = params.fq;
+  }
+
   if (params.sort) {
     // Parse sort format: "column order" (e.g., "mtime desc")
     const sortParts = params.sort.split(' ');
@@ -188,6 +206,7 @@ export function clearURLSearchParams(): void {
 
   // Remove only search-related parameters
   searchParams.delete('solrquery');
+  searchParams.delete('fq');
   searchParams.delete('sort');
   searchParams.delete('start');
   searchParams.delete('limit');
@@ -21,6 +21,13 @@ export type NotebookResponse = {
   filename: string;
 };
 
+export type ReindexResponse = {
+  updated: number;
+  skipped: number;
+  removed: number;
+  deleted: number;
+};
+
 export enum SearchTarget {
   Notebook = 'notebook',
   Cell = 'cell'
@@ -28,7 +35,8 @@ export enum SearchTarget {
 
 export async function performSearch<T extends ResponseBase>(
   target: SearchTarget,
-  query: SearchQuery
+  query: SearchQuery,
+  fields?: string[]
 ): Promise<T> {
   const params: {
     query: string;
@@ -36,9 +44,13 @@ export async function performSearch<T extends ResponseBase>(
     limit?: string;
     start?: string;
     q_op?: string;
+    fl?: string;
   } = {
     query: query.queryString
   };
+  if (fields) {
+    params.fl = fields.join(',');
+  }
   const { sortQuery, pageQuery } = query;
   if (query.q_op) {
     params.q_op = query.q_op;
@@ -52,9 +64,11 @@ export async function performSearch<T extends ResponseBase>(
     params.limit = pageQuery.limit.toString();
     params.start = pageQuery.start.toString();
   }
-  const resp = await requestAPI<T>(
-    `v1/${target}/search?${new URLSearchParams(params)}`
-  );
+  const searchParams = new URLSearchParams(params);
+  for (const fq of query.filterQueries || []) {
+    searchParams.append('fq', fq);
+  }
+  const resp = await requestAPI<T>(`v1/${target}/search?${searchParams}`);
   return resp;
 }
 
@@ -65,3 +79,13 @@ export async function prepareNotebook(
   const resp = await requestAPI<NotebookResponse>(`v1/import${path}/${id}`);
   return resp;
 }
+
+export async function reindexNotebooks(
+  paths: string[]
+): Promise<ReindexResponse> {
+  const resp = await requestAPI<ReindexResponse>('v1/reindex', {
+    method: 'POST',
+    body: JSON.stringify({ paths })
+  });
+  return resp;
+}
@@ -20,7 +20,11 @@ import ExpandMoreIcon from '@mui/icons-material/ExpandMore';
 import { theme } from '../themes/search';
 import { Search, SearchError, SearchQuery } from '../components/search';
 import { Query } from '../components/query/notebook';
-import { CompositeQuery, Composition } from '../components/query/fields';
+import {
+  CompositeQuery,
+  Composition,
+  compositeToSolrQuery
+} from '../components/query/fields';
 import { ResultEntity } from '../components/result/result';
 import {
   CellSearchResponse,
@@ -452,6 +456,14 @@ const searchFields: IndexedColumnId[] = resultColumns
     IndexedColumnId.SourceMarkdownHashtags
   ]);
 
+// Fields to be retrieved for the result list; the notebook itself is fetched when added
+const resultFields: string[] = [
+  'id',
+  'notebook_id',
+  'filename',
+  'lc_cell_meme__current'
+].concat(...resultColumns.map(r => r.value));
+
 export function MagicSearchWidget({
   currentCell,
   documents,
@@ -486,11 +498,19 @@ export function MagicSearchWidget({
         cellMemes.next
       );
 
+      // The meme constraint does not affect the scoring, so it is given as a filter query
       const finalQuery = memeQuery
-        ? { ...query, queryString: `(${query.queryString}) AND ${memeQuery}` }
+        ? {
+            ...query,
+            filterQueries: (query.filterQueries || []).concat([memeQuery])
+          }
         : query;
 
-      performSearch<CellSearchResponse>(SearchTarget.Cell, finalQuery)
+      performSearch<CellSearchResponse>(
+        SearchTarget.Cell,
+        finalQuery,
+        resultFields
+      )
         .then(results => {
           setError(undefined);
           setResults(results.cells);
@@ -816,7 +836,7 @@ export function MagicSearchWidget({
           autoSearch={true}
           defaultQuery={
             keyword
-              ? { queryString: getSolrQueryFromKeyword(keyword) }
+              ? compositeToSolrQuery(getCompositeQueryFromKeyword(keyword))
               : { queryString: '_text_:*' }
           }
           queryFactory={(solrQueryChanged, onSearch) => (
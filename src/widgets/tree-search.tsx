@@ -82,6 +82,11 @@ const searchFields: IndexedColumnId[] = resultColumns
     IndexedColumnId.SourceMarkdownHashtags
   ]);
 
+// Fields to be retrieved for the result list
+const resultFields: string[] = ['id', 'filename'].concat(
+  ...resultColumns.map(r => r.value)
+);
+
 export interface ISearchWidgetHandle {
   setSearchQuery: (query: string, timestamp: number) => void;
 }
@@ -98,10 +103,11 @@ export function SearchWidget(props: SearchWidgetProps): JSX.Element {
   // Get initial query from URL parameters
   const initialQuery = useMemo(() => {
     const urlParams = getSearchParamsFromURL();
-    if (urlParams.solrquery) {
+    if (urlParams.solrquery || urlParams.fq) {
       const searchQuery = urlParamsToSearchQuery(urlParams);
       return {
-        queryString: searchQuery.queryString || '_text_:*'
+        queryString: searchQuery.queryString || '_text_:*',
+        filterQueries: searchQuery.filterQueries
       } as SolrQuery;
     }
     return undefined;
@@ -134,7 +140,11 @@ export function SearchWidget(props: SearchWidgetProps): JSX.Element {
         updateURLSearchParams(urlParams);
       }
 
-      performSearch<NotebookSearchResponse>(SearchTarget.Notebook, query)
+      performSearch<NotebookSearchResponse>(
+        SearchTarget.Notebook,
+        query,
+        resultFields
+      )
         .then(results => {
           setError(undefined);
           setResults(results.notebooks);